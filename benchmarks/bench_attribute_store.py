@@ -0,0 +1,123 @@
+"""
+Authors: Tim Bedin, Tim Erwin
+
+Copyright 2014 CSIRO
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Benchmarks the memory use and query speed of the AttributeStore against
+the old dictionary of path sets.
+
+Usage: python benchmarks/bench_attribute_store.py [number_of_files]
+
+"""
+
+import sys
+import time
+import itertools
+from collections import defaultdict
+
+from cwsl.core.attribute_store import AttributeStore
+
+
+ATT_NAMES = ['model', 'experiment', 'variable', 'ensemble', 'year']
+
+
+def fake_files(n_files):
+    """ Generate (path, values) pairs for a CMIP5 like archive. """
+
+    models = ['MODEL{0}'.format(i) for i in range(40)]
+    experiments = ['historical', 'rcp45', 'rcp85', 'piControl']
+    variables = ['tas', 'pr', 'psl', 'ua', 'va', 'zg', 'hus', 'ts']
+    ensembles = ['r{0}i1p1'.format(i) for i in range(1, 11)]
+    years = [str(year) for year in range(1850, 2100)]
+
+    combinations = itertools.product(models, experiments, variables, ensembles, years)
+    for values in itertools.islice(combinations, n_files):
+        path = '/data/{0}/{1}/{2}/{3}/{2}_{0}_{1}_{3}_{4}.nc'.format(*values)
+        yield path, values
+
+
+def path_sets_nbytes(subsets):
+    """ Estimate the memory used by a dictionary of path sets. """
+
+    total = sys.getsizeof(subsets)
+    for value_dict in subsets.values():
+        total += sys.getsizeof(value_dict)
+        for key, paths in value_dict.items():
+            total += sys.getsizeof(key) + sys.getsizeof(paths)
+
+    return total
+
+
+def main(n_files):
+
+    files = list(fake_files(n_files))
+    print("Files: {0}".format(len(files)))
+
+    # The old representation: a set of paths for every attribute value.
+    start = time.time()
+    subsets = defaultdict(dict)
+    for path, values in files:
+        for name, value in zip(ATT_NAMES, values):
+            subsets[name].setdefault(value, set()).add(path)
+    set_build = time.time() - start
+
+    start = time.time()
+    store = AttributeStore(ATT_NAMES)
+    for path, values in files:
+        store.add(path, values)
+    store_build = time.time() - start
+
+    query = {'model': 'MODEL1', 'variable': 'pr', 'ensemble': 'r2i1p1'}
+
+    def set_query():
+        return set.intersection(*[subsets[name][value]
+                                  for name, value in query.items()])
+
+    # The first store query builds the bitmaps, later queries reuse them.
+    set_times = time_query(set_query)
+    store_times = time_query(lambda: store.find(query))
+
+    assert len(set_query()) == len(store.find(query))
+
+    print("{0:<16}{1:>14}{2:>12}{3:>14}{4:>14}".format("", "memory (MB)", "build (s)",
+                                                       "first query", "next queries"))
+    for label, n_bytes, build, times in [("path sets", path_sets_nbytes(subsets),
+                                          set_build, set_times),
+                                         ("AttributeStore", store.nbytes(),
+                                          store_build, store_times)]:
+        print("{0:<16}{1:>14.1f}{2:>12.3f}{3:>12.1f}us{4:>12.1f}us".format(label, n_bytes / 1e6,
+                                                                          build, *times))
+
+
+def time_query(query_function, repeats=20):
+    """ Return the time of the first call and the mean of the
+    next calls of query_function, in microseconds.
+
+    """
+
+    start = time.time()
+    query_function()
+    first = time.time() - start
+
+    start = time.time()
+    for _ in range(repeats):
+        query_function()
+    mean = (time.time() - start) / repeats
+
+    return first * 1e6, mean * 1e6
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main(200000)
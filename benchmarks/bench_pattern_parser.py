@@ -0,0 +1,182 @@
+"""
+Authors: Tim Bedin, Tim Erwin
+
+Copyright 2014 CSIRO
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Benchmarks getting the attributes of DRS paths.
+
+The compiled pattern regex is compared with a parser that splits each
+path on the literal text between the attributes. Then a directory tree
+is walked with the DirectoryWalker, once keeping the attributes it
+matched segment by segment and once parsing every path it finds again.
+
+Usage: python benchmarks/bench_pattern_parser.py [number_of_paths]
+
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import itertools
+
+from cwsl.core.directory_walker import DirectoryWalker
+from cwsl.core.pattern_parser import PatternParser, split_pattern
+
+
+PATTERN = ('/g/data/ua6/drstree/CMIP5/GCM/%institute%/%model%/%experiment%/%frequency%/'
+           '%realm%/%variable%/%ensemble%/'
+           '%variable%_%mip_table%_%model%_%experiment%_%ensemble%_%time_span%.nc')
+
+
+class DelimiterParser(object):
+    """ Parses paths by finding the literal text between the attributes
+
+    in turn, rather than with a regex.
+
+    Every pair of attributes must be separated by some literal text.
+
+    """
+
+    def __init__(self, pattern):
+        parts = split_pattern(pattern)
+        self.prefix = parts[0]
+        self.fields = zip(parts[1::2], parts[2::2])
+
+        self.att_names = []
+        for name, _ in self.fields:
+            if name not in self.att_names:
+                self.att_names.append(name)
+
+    def parse(self, path):
+        """ Return a tuple of the attribute values of a path, in att_names
+        order, or None if the path does not match the pattern.
+
+        """
+
+        if not path.startswith(self.prefix):
+            return None
+
+        values = {}
+        start = len(self.prefix)
+        last = len(self.fields) - 1
+        for i, (name, literal) in enumerate(self.fields):
+            if i == last:
+                if not path.endswith(literal):
+                    return None
+                end = len(path) - len(literal)
+                if end <= start:
+                    return None
+            else:
+                end = path.find(literal, start + 1)
+                if end == -1:
+                    return None
+            value = path[start:end]
+            if values.setdefault(name, value) != value:
+                return None
+            start = end + len(literal)
+
+        return tuple([values[name] for name in self.att_names])
+
+
+def fake_paths(n_paths, root=''):
+    """ Generate paths that match PATTERN, below root. """
+
+    models = [('CSIRO-BOM', 'ACCESS1-{0}'.format(i)) for i in range(10)]
+    experiments = ['historical', 'rcp45', 'rcp85']
+    variables = ['tas', 'pr', 'psl', 'ua', 'va']
+    ensembles = ['r{0}i1p1'.format(i) for i in range(1, 6)]
+    years = ['{0}01-{0}12'.format(year) for year in range(1850, 2100)]
+
+    pattern = root + PATTERN
+    combinations = itertools.product(models, experiments, variables, ensembles, years)
+    for (institute, model), experiment, variable, ensemble, time_span in itertools.islice(combinations, n_paths):
+        attributes = {'institute': institute, 'model': model, 'experiment': experiment,
+                      'frequency': 'mon', 'realm': 'atmos', 'variable': variable,
+                      'ensemble': ensemble, 'mip_table': 'Amon', 'time_span': time_span}
+        path = pattern
+        for name, value in attributes.items():
+            path = path.replace('%' + name + '%', value)
+        yield path
+
+
+def time_call(function, *args):
+    """ Return the result of calling function and the seconds it took. """
+
+    start = time.time()
+    result = function(*args)
+    return result, time.time() - start
+
+
+def bench_parsers(n_paths):
+
+    paths = list(fake_paths(n_paths))
+    regex_parser = PatternParser(PATTERN)
+    delimiter_parser = DelimiterParser(PATTERN)
+
+    regex_values, regex_time = time_call(lambda: [regex_parser.parse(path) for path in paths])
+    split_values, split_time = time_call(lambda: [delimiter_parser.parse(path) for path in paths])
+
+    assert regex_values == split_values
+
+    per_million = 1e6 / len(paths)
+    print("Parsing {0} paths".format(len(paths)))
+    print("{0:<25}{1:>20}".format("", "seconds per million"))
+    print("{0:<25}{1:>20.2f}".format("regex parse", regex_time * per_million))
+    print("{0:<25}{1:>20.2f}".format("delimiter split", split_time * per_million))
+
+
+def bench_walker(n_paths):
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        for path in fake_paths(n_paths, tempdir):
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, 'w').close()
+
+        pattern = tempdir + PATTERN
+        walker = DirectoryWalker(pattern)
+        parser = PatternParser(pattern)
+
+        # Warm the file system caches.
+        walker.walk()
+
+        walked, walk_time = time_call(walker.walk_attributes)
+        parsed, parse_time = time_call(lambda: [(path, parser.parse_dict(path))
+                                                for path in walker.walk()])
+
+        assert walked == parsed
+    finally:
+        shutil.rmtree(tempdir)
+
+    per_million = 1e6 / len(walked)
+    print("Walking {0} files".format(len(walked)))
+    print("{0:<25}{1:>20}".format("", "seconds per million"))
+    print("{0:<25}{1:>20.2f}".format("walker attributes", walk_time * per_million))
+    print("{0:<25}{1:>20.2f}".format("walk, then regex parse", parse_time * per_million))
+
+
+def main(n_paths):
+
+    bench_parsers(n_paths)
+    print("")
+    # Creating the files is slow, so walk a smaller tree.
+    bench_walker(min(n_paths, 20000))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main(200000)
@@ -46,7 +46,9 @@ try:
         authoritative_basepath='',
         #Path to put user files
         user_basepath='/local/%s/%s/' % (PROJECT, USER),
-        #Execution Manager
+        #Execution Manager. SimpleExecManager runs one script that stops at the first
+        #failed command - StreamingExecManager and ParallelExecManager run each command
+        #on its own, with retries
         execution_manager='SimpleExecManager',
         #Execution Options
         execution_options='update',
@@ -58,6 +60,28 @@ try:
         debug=False,
         #Path to CWSL Climate Toolkit
         cwsl_ctools_path='',
+        #Path to the file catalogue database (empty to disable)
+        file_catalogue='',
+        #Refuse to run a module that would run more commands than this (0 for no limit)
+        max_commands=0,
+        #Number of commands the ParallelExecManager runs at once (0 for the number of CPUs)
+        exec_workers=0,
+        #Queue, project and script directory for the PBSExecManager
+        batch_queue='',
+        batch_project='',
+        batch_job_dir='',
+        #Directory for the journals that let stopped runs resume (empty to disable)
+        journal_dir='',
+        #Shared cache of command outputs (empty to disable) and its size in GB
+        result_cache_dir='',
+        result_cache_max_gb=100,
+        #Number of threads to use when scanning the file system
+        scan_workers=1,
+        #Number of directory entries remembered between scans, so refreshes skip unchanged directories
+        listing_cache_entries=1000000,
+        #Manifests listing the CMIP5 and CMIP3 files (empty to scan the file system)
+        cmip5_manifest='',
+        cmip3_manifest='',
     )
 except ImportError:
     # If vistrails is not in the PYTHONPATH, we are in testing mode.
@@ -76,7 +76,7 @@ class ArgumentCreator(object):
                     temp_list.append(constraint.values)
 
             if(temp_list):
-                self.final_shared.append(Constraint(name, set.intersection(*temp_list)))
+                self.final_shared.append(Constraint(name, frozenset.intersection(*temp_list)))
 
         # Check for Constraint overwrites.
         to_remove = []
@@ -91,8 +91,48 @@ class ArgumentCreator(object):
 
         self.all_names = [cons.key for cons in self.final_shared]
 
-        all_vals = [cons.values for cons in self.final_shared]
-        self.all_combinations = itertools.product(*all_vals)
+        self.all_combinations = self.join_combinations()
+
+    def join_combinations(self):
+        """ Return an iterator over the combinations of the shared
+
+        attribute values (in all_names order) that at least one input has.
+
+        Each input's valid combinations are projected onto the shared
+        attributes and the projections are merged, so only combinations
+        that have input files are looked up, rather than every combination
+        of the shared values. If an input's valid combinations do not
+        cover all of the shared attributes, every combination of the
+        shared values is returned.
+
+        """
+
+        allowed = [cons.values for cons in self.final_shared]
+
+        if not self.input_datasets:
+            return itertools.product(*allowed)
+
+        joined = set()
+        for ds in self.input_datasets:
+            for combination in ds.valid_combinations:
+                values = dict((cons.key, value) for cons in combination
+                              for value in cons.values)
+                try:
+                    projected = tuple(values[name] for name in self.all_names)
+                except KeyError:
+                    module_logger.debug("Can not join on the valid combinations of {}"
+                                        .format(ds))
+                    return itertools.product(*allowed)
+                if all(value in values_allowed
+                       for value, values_allowed in zip(projected, allowed)):
+                    joined.add(projected)
+
+        # Keep the order that the product of the values would give.
+        positions = [dict((value, i) for i, value in enumerate(values))
+                     for values in allowed]
+        return iter(sorted(joined, key=lambda combination:
+                           [position[value] for position, value
+                            in zip(positions, combination)]))
 
     def __iter__(self):
         "Set up the ArgumentCreator as an iterator"
@@ -102,7 +142,7 @@ class ArgumentCreator(object):
     def get_combinations(self):
         """ Return the next group of input and output file/metafile objects."""
 
-        processed_hashes = []
+        processed_hashes = set()
 
         for comb in self.all_combinations:
             this_dict = {key: value for key, value
@@ -120,9 +160,11 @@ class ArgumentCreator(object):
                 input_atts = {}
                 for ds in self.input_datasets:
                     good_atts = {}
+                    alias_map = getattr(ds, 'alias_map', {})
                     for thing, value in output.all_atts.items():
                         if thing in ds.cons_names:
-                            in_con = ds.get_constraint(thing)
+                            # Mapped names are aliases of an input constraint.
+                            in_con = ds.get_constraint(alias_map.get(thing, thing))
                             if in_con and (value in in_con.values):
                                 good_atts[thing] = value
 
@@ -142,13 +184,14 @@ class ArgumentCreator(object):
                     module_logger.debug("Performing the output overwrite")
                     output_overwrite = self.output_file_creator.get_files(final_atts, update=True,
                                                                           check=False)
-                    module_logger.debug("All the valid output files: {}"
-                                        .format([thing for thing in self.output_file_creator.files]))
+                    if module_logger.isEnabledFor(logging.DEBUG):
+                        module_logger.debug("All the valid output files: {}"
+                                            .format([thing for thing in self.output_file_creator.files]))
                     out_hash = hash(output_overwrite[0])
                     if out_hash in processed_hashes:
                         continue
                     else:
-                        processed_hashes.append(out_hash)
+                        processed_hashes.add(out_hash)
                         module_logger.debug("Yielding a combination of input and output")
                         yield (in_list, output_overwrite, final_atts)
                 else:
@@ -176,8 +219,7 @@ class ArgumentCreator(object):
 
         # Update the constraints of the output.
         for consname in self.merge_output:
-            old_con = (self.output_file_creator
-                       .get_constraint(consname)
-                       .values.add(attdict[consname]))
+            self.output_file_creator.constraints.add(Constraint(consname,
+                                                                [attdict[consname]]))
 
         return attdict
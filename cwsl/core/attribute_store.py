@@ -0,0 +1,350 @@
+"""
+Authors: Tim Bedin, Tim Erwin
+
+Copyright 2014 CSIRO
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Contains the AttributeStore class.
+
+"""
+
+import re
+import sys
+import binascii
+from array import array
+
+try:
+    intern
+except NameError:
+    from sys import intern
+
+
+class AttributeStore(object):
+    """ A compact, column based table of files and their attributes.
+
+    Every file is given an integer id. Each attribute has a dictionary of
+    its distinct values, and a column of integer codes (one per file) that
+    index into it, so a path or a value string is only ever stored once.
+
+    An inverted index (postings) maps each attribute value to the ids of
+    the files that have it. A query starts from the shortest postings of
+    the requested values. If that is short, its files are checked against
+    the columns of the other attributes. Otherwise every requested value
+    is common, and their bitmaps (Python ints with a bit set for each
+    file id) are ANDed together. Only the bitmaps of values that at least
+    one file in DENSE_FRACTION has are cached, so a cached bitmap is never
+    more than twice the size of its postings.
+
+    Removed files are marked with a flag byte per file id rather than
+    taken out of the postings, so removing a file does not depend on
+    the number of files. The removed files with each value, and the
+    files with each distinct row of values, are counted so the present
+    values and combinations do not need a pass over every file.
+
+    """
+
+    def __init__(self, att_names):
+        """ Arguments:
+
+        att_names: The attribute names, in the order values are added.
+
+        """
+
+        self.att_names = tuple(att_names)
+
+        self.paths = []
+        self.path_ids = {}
+
+        # For each attribute: code -> value, value -> code,
+        # the code of every file and value -> file ids.
+        self.values = dict((name, []) for name in self.att_names)
+        self.codes = dict((name, {}) for name in self.att_names)
+        self.columns = dict((name, array('i')) for name in self.att_names)
+        self.postings = dict((name, {}) for name in self.att_names)
+        self.bitmaps = dict((name, {}) for name in self.att_names)
+
+        # The number of removed files with each value of each attribute,
+        # and the number of files with each distinct row of value codes.
+        self.removed_counts = dict((name, {}) for name in self.att_names)
+        self.row_counts = {}
+
+        # A flag for each file id, set if the file was removed.
+        self.removed = bytearray()
+
+    def __len__(self):
+        return len(self.path_ids)
+
+    def add(self, path, values):
+        """ Add a file and its attribute values (in att_names order).
+
+        Returns the id of the file. Adding a path that is already in the
+        store returns the existing id. Ids are never reused.
+
+        """
+
+        try:
+            return self.path_ids[path]
+        except KeyError:
+            pass
+
+        file_id = len(self.paths)
+        self.paths.append(path)
+        self.path_ids[path] = file_id
+        self.removed.append(0)
+
+        code_row = []
+        for name, value in zip(self.att_names, values):
+            value_codes = self.codes[name]
+            try:
+                code = value_codes[value]
+            except KeyError:
+                code = len(self.values[name])
+                value = intern(value)
+                self.values[name].append(value)
+                value_codes[value] = code
+                self.postings[name][value] = array('i')
+            self.columns[name].append(code)
+            self.postings[name][value].append(file_id)
+            # The bitmap for this value is now out of date.
+            self.bitmaps[name].pop(value, None)
+            code_row.append(code)
+
+        code_row = tuple(code_row)
+        self.row_counts[code_row] = self.row_counts.get(code_row, 0) + 1
+
+        return file_id
+
+    def remove(self, path):
+        """ Remove a file from the store.
+
+        The file's id is left empty, so the ids of other files do not change,
+        and is flagged as removed rather than taken out of the postings.
+        This takes the same time however many files there are.
+
+        """
+
+        file_id = self.path_ids.pop(path)
+        self.paths[file_id] = None
+        self.removed[file_id] = 1
+
+        code_row = self.code_row(file_id)
+        for name, code in zip(self.att_names, code_row):
+            value = self.values[name][code]
+            removed_counts = self.removed_counts[name]
+            removed_counts[value] = removed_counts.get(value, 0) + 1
+
+        self.row_counts[code_row] -= 1
+        if not self.row_counts[code_row]:
+            del self.row_counts[code_row]
+
+    def code_row(self, file_id):
+        """ Return the tuple of value codes for a file id. """
+
+        return tuple(self.columns[name][file_id] for name in self.att_names)
+
+    def row(self, file_id):
+        """ Return the tuple of attribute values for a file id. """
+
+        return self.decode(self.code_row(file_id))
+
+    def atts(self, file_id):
+        """ Return the dictionary of attributes for a file id. """
+
+        return dict(zip(self.att_names, self.row(file_id)))
+
+    def present_values(self, name):
+        """ Return the values of an attribute that at least one file has. """
+
+        removed_counts = self.removed_counts[name]
+        return [value for value, file_ids in self.postings[name].items()
+                if len(file_ids) > removed_counts.get(value, 0)]
+
+    def find(self, reqs_dict):
+        """ Return a list of the ids of the files that have every
+
+        attribute value in reqs_dict ({"attribute": "value"}).
+
+        """
+
+        if not reqs_dict:
+            return []
+
+        try:
+            requests = [(self.postings[name][value], name, value)
+                        for name, value in reqs_dict.items()]
+        except KeyError:
+            return []
+        requests.sort(key=lambda request: len(request[0]))
+
+        removed = self.removed
+        file_ids = requests[0][0]
+        if len(requests) == 1 or not self.is_dense(file_ids):
+            if len(self.paths) > len(self.path_ids):
+                found = [file_id for file_id in file_ids if not removed[file_id]]
+            else:
+                found = file_ids.tolist()
+            for _, name, value in requests[1:]:
+                column = self.columns[name]
+                code = self.codes[name][value]
+                found = [file_id for file_id in found if column[file_id] == code]
+                if not found:
+                    break
+            return found
+
+        found_bits = -1
+        for _, name, value in requests:
+            found_bits &= self.value_bitmap(name, value)
+            if not found_bits:
+                return []
+
+        return [file_id for file_id in ids_from_bitmap(found_bits)
+                if not removed[file_id]]
+
+    def is_dense(self, file_ids):
+        """ Return True if at least one file in DENSE_FRACTION is in file_ids. """
+
+        return len(file_ids) * DENSE_FRACTION >= len(self.paths)
+
+    def bitmap(self, name, value):
+        """ Return the bitmap of the files with a value of an attribute.
+
+        Returns 0 if no file has the value.
+
+        """
+
+        if name not in self.postings or value not in self.postings[name]:
+            return 0
+
+        if len(self.paths) > len(self.path_ids):
+            return bitmap_from_ids([file_id for file_id in self.postings[name][value]
+                                    if not self.removed[file_id]])
+
+        return self.value_bitmap(name, value)
+
+    def value_bitmap(self, name, value):
+        """ Return the bitmap of the files with a value, including removed files.
+
+        The bitmaps of dense values are cached.
+
+        """
+
+        try:
+            return self.bitmaps[name][value]
+        except KeyError:
+            pass
+
+        file_ids = self.postings[name][value]
+        bits = bitmap_from_ids(file_ids)
+        if self.is_dense(file_ids):
+            self.bitmaps[name][value] = bits
+
+        return bits
+
+    def combinations(self):
+        """ Return a set of the distinct tuples of attribute values. """
+
+        return set(self.decode(code_row) for code_row in self.row_counts)
+
+    def has_combination(self, values):
+        """ Return True if at least one file has a tuple of attribute values. """
+
+        try:
+            code_row = tuple(self.codes[name][value]
+                             for name, value in zip(self.att_names, values))
+        except KeyError:
+            return False
+
+        return code_row in self.row_counts
+
+    def decode(self, code_row):
+        """ Return the tuple of values for a tuple of value codes. """
+
+        return tuple(self.values[name][code]
+                     for name, code in zip(self.att_names, code_row))
+
+    def nbytes(self):
+        """ Estimate the memory used by the store, in bytes.
+
+        The path strings themselves are not counted, as they are
+        shared with the file list.
+
+        """
+
+        total = sys.getsizeof(self.paths) + sys.getsizeof(self.path_ids)
+        for name in self.att_names:
+            total += sys.getsizeof(self.values[name])
+            total += sys.getsizeof(self.codes[name])
+            total += array_nbytes(self.columns[name])
+            total += sys.getsizeof(self.postings[name])
+            total += sum(array_nbytes(file_ids)
+                         for file_ids in self.postings[name].values())
+            total += sum(sys.getsizeof(bits)
+                         for bits in self.bitmaps[name].values())
+            total += sys.getsizeof(self.removed_counts[name])
+        total += sys.getsizeof(self.row_counts) + sys.getsizeof(self.removed)
+
+        return total
+
+
+def array_nbytes(an_array):
+    """ Return the size in bytes of the buffer of an array."""
+
+    return an_array.buffer_info()[1] * an_array.itemsize
+
+
+# Values that fewer than one file in DENSE_FRACTION has are searched
+# through the columns, rather than with bitmaps.
+DENSE_FRACTION = 64
+
+NONZERO_BYTE = re.compile(b'[^\x00]')
+
+# The positions of the bits that are set in each possible byte.
+BYTE_BITS = [[bit for bit in range(8) if byte >> bit & 1]
+             for byte in range(256)]
+
+
+def bitmap_from_ids(file_ids):
+    """ Build an integer bitmap with the bits of the file ids set."""
+
+    if not len(file_ids):
+        return 0
+
+    bit_bytes = bytearray(max(file_ids) // 8 + 1)
+    for file_id in file_ids:
+        bit_bytes[file_id >> 3] |= 1 << (file_id & 7)
+
+    # Least significant byte first, so reverse for the hex string.
+    bit_bytes.reverse()
+    return int(binascii.hexlify(bytes(bit_bytes)), 16)
+
+
+def ids_from_bitmap(bits):
+    """ Return a sorted list of the file ids set in a bitmap."""
+
+    # Skip the empty low end of the bitmap.
+    offset = ((bits & -bits).bit_length() - 1) & ~7
+    bits >>= offset
+
+    hex_string = '%x' % bits
+    if len(hex_string) % 2:
+        hex_string = '0' + hex_string
+    bit_bytes = bytearray(binascii.unhexlify(hex_string))
+    bit_bytes.reverse()
+
+    # Only look at the bytes that have bits set.
+    file_ids = []
+    for match in NONZERO_BYTE.finditer(bit_bytes):
+        position = match.start()
+        base = offset + position * 8
+        file_ids.extend([base + bit for bit in BYTE_BITS[bit_bytes[position]]])
+
+    return file_ids
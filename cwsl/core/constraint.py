@@ -17,7 +17,13 @@ Contains the Constraint class.
 
 """
 
-from copy import deepcopy
+import weakref
+import collections
+
+try:
+    intern
+except NameError:
+    from sys import intern
 
 
 class Constraint(object):
@@ -26,17 +32,25 @@ class Constraint(object):
 
     A DataSet owns a set of Constraints.
 
-    Each Constraint has a key and a set with zero or more values.
-    new_constraint.key = 'variable' new_constraint.values = set(['tas','pr'])
+    Each Constraint has a key and a frozenset with zero or more values.
+    new_constraint.key = 'variable' new_constraint.values = frozenset(['tas','pr'])
     or,
-    new_constraint.key = 'model' new_constraint.values = set(['ACCESS1-0'])
+    new_constraint.key = 'model' new_constraint.values = frozenset(['ACCESS1-0'])
     or,
-    new_constraint.key = 'perturbed_physics_number' new_constraint.values = set([])
+    new_constraint.key = 'perturbed_physics_number' new_constraint.values = frozenset([])
 
+    Constraints are immutable - to change the values of a constraint, make
+    a new one. Constraints with the same key and values are the same object,
+    and their hash is only calculated once.
 
     '''
 
-    def __init__(self, key, values):
+    __slots__ = ('key', 'values', '_hash', '__weakref__')
+
+    # The existing Constraints, by (key, values).
+    _interned = weakref.WeakValueDictionary()
+
+    def __new__(cls, key, values):
         '''
         @param key: The element of the DataSet that we wish to constrain.
         @type key: string
@@ -49,10 +63,29 @@ class Constraint(object):
 
         # The unicode stuff is to deal with some funny equality/hash problems.
         # it may not actually be necessary.
-        self.key = str(key)
+        key = intern(str(key))
+        values = frozenset([intern(str(val)) for val in values])
+
+        try:
+            return cls._interned[(key, values)]
+        except KeyError:
+            pass
+
+        new_constraint = object.__new__(cls)
+        object.__setattr__(new_constraint, 'key', key)
+        object.__setattr__(new_constraint, 'values', values)
+        object.__setattr__(new_constraint, '_hash', hash((key, values)))
+
+        return cls._interned.setdefault((key, values), new_constraint)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Constraint objects are immutable")
 
-        str_vals = [str(val) for val in values]
-        self.values = set(str_vals)
+    def __delattr__(self, name):
+        raise AttributeError("Constraint objects are immutable")
+
+    def __reduce__(self):
+        return (Constraint, (self.key, list(self.values)))
 
     def __repr__(self):
         # The values set needs to be transformed to a sorted list
@@ -68,44 +101,132 @@ class Constraint(object):
     def __hash__(self):
         # The class needs to be hashable in order to work
         # inside a set.
-        return(hash(repr(self)))
+        return self._hash
 
     def __eq__(self, other):
-        # Constraints are equal if their hashes are the same.
-        return hash(self) == hash(other)
+        # Constraints are equal if their keys and values are the same.
+        if self is other:
+            return True
+        if not isinstance(other, Constraint):
+            return NotImplemented
+        return (self._hash == other._hash and self.key == other.key and
+                self.values == other.values)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
 
     def __iter__(self):
-        self.values_iter = iter(self.values)
-        return self
-
-    def next(self):
-        current_val = self.values_iter.next()
+        return ((self.key, value) for value in self.values)
 
-        return self.key, current_val
-    
     @staticmethod
     def remove_constraints(cons_name_list, cons_set):
-        cons_copy = deepcopy(cons_set)
-        
-        cons_names = [cons.key for cons in cons_set]
-        
-        to_remove = []
-        
+        """ Return a ConstraintSet of cons_set without the named constraints. """
+
+        cons_copy = ConstraintSet(cons_set)
+
         for cons_name in cons_name_list:
-            if cons_name not in cons_names:
+            if cons_name not in cons_copy.keys():
                 raise ConstraintNotFoundError
-        
-        for constraint in cons_set:
-            if constraint.key in cons_name_list:
-                to_remove.append(constraint)
-                
-        for removed in to_remove:
-            cons_copy.remove(removed)
-            
+
+        for cons_name in cons_name_list:
+            cons_copy.remove_key(cons_name)
+
         return cons_copy
-        
-        
-        
+
+
+class ConstraintSet(collections.MutableSet):
+    '''
+    A set of Constraints with at most one Constraint for each key,
+    so a constraint can be found by its key without a search.
+
+    Adding a Constraint for a key that is already in the set merges the
+    values of the two. Use override to replace the values instead.
+
+    A ConstraintSet compares equal to a set of the same Constraints.
+
+    '''
+
+    def __init__(self, constraints=()):
+
+        self._constraints = {}
+        self.update(constraints)
+
+    def __contains__(self, constraint):
+        try:
+            return self._constraints[constraint.key] == constraint
+        except (KeyError, AttributeError):
+            return False
+
+    def __iter__(self):
+        return iter(self._constraints.values())
+
+    def __len__(self):
+        return len(self._constraints)
+
+    def __repr__(self):
+        return "ConstraintSet({0})".format(sorted(self._constraints.values(),
+                                                  key=lambda cons: cons.key))
+
+    def add(self, constraint):
+        """ Add a Constraint, merging its values with any existing
+        Constraint with the same key.
+
+        """
+
+        existing = self._constraints.get(constraint.key)
+        if existing is not None and existing is not constraint:
+            constraint = Constraint(constraint.key,
+                                    existing.values.union(constraint.values))
+        self._constraints[constraint.key] = constraint
+
+    def override(self, constraint):
+        """ Add a Constraint, replacing any existing Constraint with the same key. """
+
+        self._constraints[constraint.key] = constraint
+
+    def discard(self, constraint):
+        """ Remove a Constraint if it is in the set. """
+
+        if constraint in self:
+            del self._constraints[constraint.key]
+
+    def remove_key(self, key):
+        """ Remove the Constraint for a key, if there is one. """
+
+        self._constraints.pop(key, None)
+
+    def get(self, key, default=None):
+        """ Return the Constraint for a key, or default if there is none. """
+
+        return self._constraints.get(key, default)
+
+    def keys(self):
+        """ Return a list of the constraint keys. """
+
+        return list(self._constraints.keys())
+
+    def update(self, constraints):
+        """ Add (and merge) each Constraint in an iterable. """
+
+        for constraint in constraints:
+            self.add(constraint)
+
+    def union(self, *others):
+        """ Return a new ConstraintSet with the Constraints of this set and others merged. """
+
+        new_set = ConstraintSet(self)
+        for other in others:
+            new_set.update(other)
+
+        return new_set
+
+    def copy(self):
+        return ConstraintSet(self)
+
+
 class ConstraintNotFoundError(Exception):
     ''' Raised if you try and remove a Constraint that doesn't exist. '''
     pass
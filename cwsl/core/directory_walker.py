@@ -0,0 +1,388 @@
+"""
+Authors: Tim Bedin, Tim Erwin
+
+Copyright 2014 CSIRO
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Contains the DirectoryWalker class.
+
+"""
+
+import os
+import re
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+from cwsl.core.pattern_parser import attribute_names, split_pattern
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+module_logger = logging.getLogger('cwsl.core.directory_walker')
+
+# The coarsest directory mtime resolution expected (e.g. on NFS), in seconds.
+MTIME_GRANULARITY = 2.0
+
+
+class DirectoryWalker(object):
+    """ Finds the files that match a pattern by walking the file system
+
+    one path segment at a time.
+
+    At each level only the entries allowed by the constraints on that
+    segment are followed, so every directory is listed at most once
+    no matter how many constraint combinations share it. Segments whose
+    attributes are all constrained are not listed at all - the allowed
+    names are built directly from the constraint values.
+
+    """
+
+    def __init__(self, pattern, constraints=None, list_dir=None):
+        """ Arguments:
+
+        pattern: A string filename pattern, with placeholders
+                 surrounding attribute names.
+                 e.g. "/home/billy/test/%colour%/%texture%/%fruit%_%colour%.%file_type%"
+
+        constraints: A set of Constraint objects to restrict the values the
+                     attributes can take.
+
+        list_dir: A function that returns the entry names of a directory,
+                  or an empty list if it can not be listed.
+                  Defaults to scan_dir.
+
+        """
+
+        self.pattern = pattern
+
+        self.allowed = {}
+        for cons in constraints or []:
+            if cons.values:
+                self.allowed[cons.key] = sorted(cons.values)
+
+        if list_dir:
+            self.list_dir = list_dir
+        else:
+            self.list_dir = scan_dir
+
+        if pattern.startswith(os.sep):
+            self.root = os.sep
+        else:
+            self.root = ''
+
+        self.segments = [segment for segment in pattern.split(os.sep)
+                         if segment]
+        self.segment_names = [unique(attribute_names(segment))
+                              for segment in self.segments]
+
+        # Compiled segment regexes, keyed by segment and bound values.
+        self._regex_cache = {}
+
+    def walk(self, workers=1):
+        """ Return a list of the paths that match the pattern and constraints.
+
+        If workers is greater than one, directories are listed in parallel.
+
+        """
+
+        return [path for path, _ in self.walk_attributes(workers)]
+
+    def walk_attributes(self, workers=1):
+        """ Return a list of (path, attributes) for the paths that match
+
+        the pattern and constraints. The attributes are the dictionary of
+        values matched while walking, so the paths do not need to be parsed
+        again.
+
+        """
+
+        if workers > 1:
+            return self.parallel_walk(workers)
+
+        found_paths = []
+        self.walk_from(self.root, 0, {}, found_paths)
+
+        return found_paths
+
+    def parallel_walk(self, workers):
+        """ Walk the pattern one level at a time, matching the directories
+
+        of each level on a pool of threads.
+
+        Directory listing on a parallel file system is latency bound, so
+        threads give a speedup despite the GIL. The results of each level
+        are merged in order, so the paths are returned in the same order
+        as a serial walk.
+
+        """
+
+        pool = ThreadPool(workers)
+        try:
+            frontier = [(self.root, {})]
+            for depth in range(len(self.segments)):
+                level_matches = pool.map(lambda node: self.match_segment(node[0], depth, node[1]),
+                                         frontier)
+                frontier = [match for node_matches in level_matches
+                            for match in node_matches]
+        finally:
+            pool.close()
+            pool.join()
+
+        return frontier
+
+    def walk_from(self, dir_path, depth, bound, found_paths):
+        """ Walk the segments of the pattern below dir_path, starting at depth.
+
+        bound is a dictionary of the attribute values already fixed by the
+        segments above. Matching (path, attributes) are appended to found_paths.
+
+        """
+
+        for path, new_bound in self.match_segment(dir_path, depth, bound):
+            if depth == len(self.segments) - 1:
+                found_paths.append((path, new_bound))
+            else:
+                self.walk_from(path, depth + 1, new_bound, found_paths)
+
+    def match_segment(self, dir_path, depth, bound):
+        """ Return a list of (path, bound values) for the entries of dir_path
+
+        that can match the segment of the pattern at depth.
+
+        """
+
+        segment = self.segments[depth]
+        names = self.segment_names[depth]
+        last = (depth == len(self.segments) - 1)
+
+        free_names = [name for name in names
+                      if name not in bound and name not in self.allowed]
+
+        if not free_names:
+            # Every attribute is known - build the names without listing.
+            candidates = self.enumerate_segment(segment, names, bound)
+            if last:
+                entries = set(self.list_dir(dir_path))
+                candidates = [(name, new_bound) for name, new_bound in candidates
+                              if name in entries]
+        else:
+            regex = self.segment_regex(depth, bound)
+            candidates = []
+            for entry in sorted(self.list_dir(dir_path)):
+                if entry.startswith('.') and not segment.startswith('.'):
+                    continue
+                match = regex.match(entry)
+                if match:
+                    new_bound = dict(bound)
+                    new_bound.update(match.groupdict())
+                    candidates.append((entry, new_bound))
+
+        return [(os.path.join(dir_path, name), new_bound)
+                for name, new_bound in candidates]
+
+    def enumerate_segment(self, segment, names, bound):
+        """ Build every allowed name for a segment whose attributes are all constrained. """
+
+        values = [[bound[name]] if name in bound else self.allowed[name]
+                  for name in names]
+
+        candidates = []
+        seen = set()
+        for combination in itertools.product(*values):
+            entry = segment
+            for name, value in zip(names, combination):
+                entry = entry.replace('%' + name + '%', value)
+            if entry not in seen:
+                seen.add(entry)
+                new_bound = dict(bound)
+                new_bound.update(zip(names, combination))
+                candidates.append((entry, new_bound))
+
+        return candidates
+
+    def segment_regex(self, depth, bound):
+        """ Build (or fetch) the compiled regex for a segment of the pattern.
+
+        Attributes bound by earlier segments must match their value exactly,
+        constrained attributes must match one of their allowed values.
+
+        """
+
+        names = self.segment_names[depth]
+        cache_key = (depth, tuple(bound.get(name) for name in names))
+        try:
+            return self._regex_cache[cache_key]
+        except KeyError:
+            pass
+
+        regex = r"^"
+        seen = []
+        for i, name in enumerate(split_pattern(self.segments[depth])):
+            if i % 2 == 0:
+                # Literal text.
+                regex += re.escape(name)
+                continue
+
+            if name in bound:
+                regex += re.escape(bound[name])
+            elif name in seen:
+                regex += r"(?P=" + name + r")"
+            elif name in self.allowed:
+                regex += (r"(?P<" + name + r">" +
+                          "|".join(re.escape(value) for value in self.allowed[name]) +
+                          r")")
+            else:
+                regex += r"(?P<" + name + r">.+?)"
+            seen.append(name)
+        regex += r"$"
+
+        compiled = re.compile(regex)
+        self._regex_cache[cache_key] = compiled
+
+        return compiled
+
+
+class ListingCache(object):
+    """ A list_dir function that remembers the entries of each directory
+
+    it lists, and only lists a directory again when its mtime or size
+    has changed. Rescanning an unchanged tree then costs one stat
+    per directory. A directory that was modified within MTIME_GRANULARITY
+    of being listed is always listed again, as a change made just after
+    the listing may not have changed its mtime.
+
+    The number of entries remembered is bounded. When it is exceeded,
+    the listings that were used least recently are dropped, and those
+    directories are listed again the next time they are needed.
+
+    """
+
+    def __init__(self, list_dir=None, max_entries=1000000):
+        """ Arguments:
+
+        list_dir: The function used to list changed directories.
+                  Defaults to scan_dir.
+
+        max_entries: The total number of directory entries to remember.
+
+        """
+
+        if list_dir:
+            self.list_dir = list_dir
+        else:
+            self.list_dir = scan_dir
+
+        self.max_entries = max_entries
+
+        # {directory: ((mtime, size, listed time), entries)}, least recently used first.
+        self.listings = OrderedDict()
+        self.n_entries = 0
+        # Parallel walks list directories from several threads.
+        self.lock = threading.Lock()
+
+    def __call__(self, dir_path):
+
+        try:
+            dir_stat = os.stat(dir_path or os.curdir)
+        except OSError:
+            with self.lock:
+                self.forget(dir_path)
+            return []
+
+        with self.lock:
+            old_listing = self.forget(dir_path)
+        if old_listing and listing_current(old_listing[0], dir_stat):
+            stamp, entries = old_listing
+        else:
+            stamp = (dir_stat.st_mtime, dir_stat.st_size, time.time())
+            entries = self.list_dir(dir_path)
+
+        with self.lock:
+            self.remember(dir_path, (stamp, entries))
+
+        return entries
+
+    def remember(self, dir_path, listing):
+        """ Store the listing of a directory as the most recently used,
+
+        dropping the oldest listings if there are too many entries.
+
+        """
+
+        self.forget(dir_path)
+        if len(listing[1]) > self.max_entries:
+            return
+
+        self.listings[dir_path] = listing
+        self.n_entries += len(listing[1])
+
+        while self.n_entries > self.max_entries:
+            _, (_, entries) = self.listings.popitem(last=False)
+            self.n_entries -= len(entries)
+
+    def forget(self, dir_path):
+        """ Remove and return the listing of a directory, or None. """
+
+        listing = self.listings.pop(dir_path, None)
+        if listing:
+            self.n_entries -= len(listing[1])
+
+        return listing
+
+
+def listing_current(stamp, dir_stat):
+    """ Return True if a directory listing with a stamp of (mtime, size,
+
+    listed time) is still current for the directory's new stat.
+
+    """
+
+    mtime, size, listed = stamp
+
+    return (mtime == dir_stat.st_mtime and size == dir_stat.st_size and
+            listed - mtime > MTIME_GRANULARITY)
+
+
+def scan_dir(dir_path):
+    """ Return the entry names of a directory, or an empty list
+
+    if it can not be listed.
+
+    """
+
+    real_path = dir_path or os.curdir
+
+    try:
+        if scandir:
+            return [entry.name for entry in scandir(real_path)]
+        else:
+            return os.listdir(real_path)
+    except OSError:
+        return []
+
+
+def unique(names):
+    """ Return the names in order, without repeats."""
+
+    seen = set()
+    return [name for name in names
+            if not (name in seen or seen.add(name))]
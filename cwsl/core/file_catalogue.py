@@ -0,0 +1,165 @@
+"""
+Authors: Tim Bedin, Tim Erwin
+
+Copyright 2014 CSIRO
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Contains the FileCatalogue class.
+
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+from cwsl.configuration import configuration
+from cwsl.core.directory_walker import listing_current
+
+
+module_logger = logging.getLogger('cwsl.core.file_catalogue')
+
+# The version of the database layout, kept in its user_version.
+SCHEMA_VERSION = 1
+
+# The shared catalogues, keyed by database path.
+_catalogues = {}
+_catalogues_lock = threading.Lock()
+
+
+class FileCatalogue(object):
+    """ A persistent, on-disk index of the files found by PatternDataSet scans.
+
+    The catalogue is a SQLite database holding the listing, modification
+    time and size of every directory visited while scanning.
+
+    When a pattern is scanned again, directories are only listed from the
+    file system if their mtime or size has changed since they were
+    catalogued, or if they were modified so close to being listed that
+    a change may not show in the mtime.
+
+    """
+
+    def __init__(self, db_path):
+        """ Arguments:
+
+        db_path: The path to the SQLite database file. It is created
+                 if it does not exist.
+
+        """
+
+        self.db_path = db_path
+
+        # The catalogue may be shared by scanning threads, so access
+        # to the connection is serialised with a lock.
+        self.connection = sqlite3.connect(db_path, timeout=60,
+                                          check_same_thread=False)
+        self.lock = threading.Lock()
+        # Keep paths as byte strings, like os.listdir returns them.
+        self.connection.text_factory = str
+
+        with self.connection:
+            version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+            if version < SCHEMA_VERSION:
+                self.migrate()
+
+    def migrate(self):
+        """ Bring a new database, or one from an older version of the
+        catalogue, up to SCHEMA_VERSION.
+
+        """
+
+        # Tables from older versions of the catalogue.
+        self.connection.execute("DROP TABLE IF EXISTS directories")
+        self.connection.execute("DROP TABLE IF EXISTS matches")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS listings
+                                   (path TEXT PRIMARY KEY,
+                                    mtime REAL,
+                                    size INTEGER,
+                                    listed REAL,
+                                    entries TEXT)""")
+        self.connection.execute("PRAGMA user_version = {0}".format(SCHEMA_VERSION))
+
+    def list_dir(self, dir_path):
+        """ Return the entries of a directory, only hitting the file system
+
+        if the directory has changed since it was last catalogued.
+
+        Returns an empty list if dir_path is not a directory.
+
+        """
+
+        real_path = dir_path or os.curdir
+
+        try:
+            dir_stat = os.stat(real_path)
+        except OSError:
+            return []
+
+        with self.lock:
+            row = self.connection.execute("SELECT mtime, size, listed, entries FROM listings "
+                                          "WHERE path = ?", (dir_path,)).fetchone()
+        if row and listing_current(row[:3], dir_stat):
+            return split_lines(row[3])
+
+        listed = time.time()
+        try:
+            entries = os.listdir(real_path)
+        except OSError:
+            return []
+
+        module_logger.debug("Cataloguing directory: {}".format(real_path))
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?, ?)",
+                                    (dir_path, dir_stat.st_mtime, dir_stat.st_size, listed,
+                                     '\n'.join(entries)))
+
+        return entries
+
+    def close(self):
+        """ Close the connection to the database. """
+
+        self.connection.close()
+
+
+def configured_catalogue():
+    """ Return the FileCatalogue for the database set in the configuration,
+
+    or None if no catalogue is configured.
+
+    There is one FileCatalogue (and one database connection) for each
+    database, shared by every dataset that uses it.
+
+    """
+
+    db_path = getattr(configuration, 'file_catalogue', '')
+    if not db_path:
+        return None
+
+    db_path = os.path.abspath(os.path.expandvars(db_path))
+    with _catalogues_lock:
+        try:
+            return _catalogues[db_path]
+        except KeyError:
+            catalogue = FileCatalogue(db_path)
+            _catalogues[db_path] = catalogue
+            return catalogue
+
+
+def split_lines(stored_string):
+    """ Split a newline separated string from the database into a list."""
+
+    if not stored_string:
+        return []
+
+    return stored_string.split('\n')
@@ -18,13 +18,14 @@ Contains the FileCreator class.
 """
 
 import os
-import re
 import itertools
 import logging
 
 from cwsl.core.dataset import DataSet
-from cwsl.core.constraint import Constraint
+from cwsl.core.constraint import Constraint, ConstraintSet
 from cwsl.core.metafile import MetaFile
+from cwsl.core.attribute_store import AttributeStore
+from cwsl.core.pattern_parser import PathTemplate, attribute_names
 
 
 module_logger = logging.getLogger('cwsl.core.file_creator')
@@ -65,9 +66,11 @@ class FileCreator(DataSet):
         '''
 
         self.output_pattern = output_pattern
+        # The output pattern is split up once, to build file names quickly.
+        self.template = PathTemplate(output_pattern)
 
         # Construct the initial constraints from the output pattern.
-        self.constraints = FileCreator.constraints_from_pattern(output_pattern)
+        self.constraints = ConstraintSet(FileCreator.constraints_from_pattern(output_pattern))
 
         # Add the extra constraints to the self.constraints, strip out any that
         # are not part of the output pattern.
@@ -77,13 +80,13 @@ class FileCreator(DataSet):
         # be in canonical form.
         # "extra" and "info" are keywords for non-compulsory constraints that
         # are replaced by a placeholder value.
-        for constraint in self.constraints:
+        for constraint in list(self.constraints):
             if not constraint.values:
                 split_key = constraint.key.split('_')
                 if 'extra' in split_key:
-                    constraint.values = set(['noextras'])
+                    self.constraints.override(Constraint(constraint.key, ['noextras']))
                 elif 'info' in split_key:
-                    constraint.values = set(['orig'+split_key[0]])
+                    self.constraints.override(Constraint(constraint.key, ['orig'+split_key[0]]))
                 else:
                     module_logger.error("Constraint {0} is empty - should be in canonical form!"
                                         .format(constraint))
@@ -98,6 +101,13 @@ class FileCreator(DataSet):
 
         self.cons_names = [cons.key for cons in self.constraints]
 
+        # A compact table of the valid output files and their attributes.
+        self.store = AttributeStore(self.cons_names)
+
+        # The ids of batch jobs that will create the files, if they
+        # have been submitted to a queue.
+        self.job_ids = []
+
     def get_files(self, att_dict, check=False, update=True):
         """ This method returns all possible MockClimateFiles from the
         FileCreator that match an input attribute dictionary.
@@ -109,6 +119,11 @@ class FileCreator(DataSet):
 
         """
 
+        if check:
+            # Only the valid files can be returned, so find them in the
+            # store rather than building every combination of values.
+            return self.valid_files(att_dict)
+
         # Get the keys of the input dictionary.
         search_keys = [att for att in att_dict.keys()]
 
@@ -129,44 +144,113 @@ class FileCreator(DataSet):
         keys = [cons[0] for cons in to_loop]
         values = [cons[1] for cons in to_loop]
 
-        new_iter = itertools.product(*values)
+        combinations = list(itertools.product(*values))
+        new_paths = self.template.fill_many(keys, combinations)
 
         outfiles = []
-        for combination in new_iter:
+        for combination, new_path in zip(combinations, new_paths):
             new_file = self.climate_file_from_combination(keys, combination,
-                                                          check=check, update=update)
+                                                          check=check, update=update,
+                                                          new_file=new_path)
             if new_file:
                 outfiles.append(new_file)
 
         return outfiles
 
+    def valid_files(self, att_dict):
+        """ Return MetaFiles for the valid files that match the values
+
+        in an attribute dictionary. Aliases of attributes (from a
+        ProcessUnit map_dict) are looked up by the attribute they alias.
+        Attributes that are not constraints of this FileCreator are ignored.
+
+        """
+
+        alias_map = getattr(self, 'alias_map', {})
+        search_dict = {}
+        for key, value in att_dict.items():
+            store_key = alias_map.get(key, key)
+            if store_key in self.store.att_names:
+                if search_dict.setdefault(store_key, value) != value:
+                    # An attribute and its alias disagree.
+                    return []
+            elif key in self.cons_names:
+                # A constraint that can't be matched to the files.
+                return []
+
+        if search_dict:
+            file_ids = self.store.find(search_dict)
+        else:
+            file_ids = sorted(self.store.path_ids.values())
+
+        outfiles = []
+        for file_id in file_ids:
+            path, name = os.path.split(self.store.paths[file_id])
+            outfiles.append(MetaFile.from_values(name, path, self.store.att_names,
+                                                 self.store.row(file_id)))
+
+        return outfiles
+
     @property
     def files(self):
         """ This property returns all the real files
         that exist in this file_creator.
 
+        The files are built from the valid combinations, so the cost
+        is proportional to the number of real files.
+
         """
 
-        huge_iterator = itertools.product(*[cons.values
-                                            for cons in self.constraints])
         cons_names = [cons.key for cons in self.constraints]
+        name_set = frozenset(cons_names)
+        allowed = dict((cons.key, cons.values) for cons in self.constraints)
+
+        combinations = []
+        for valid_combination in self.valid_combinations:
+            # Only combinations of one value for exactly this FileCreator's
+            # attributes, with values that its constraints allow, are real files.
+            if any(len(cons.values) != 1 for cons in valid_combination):
+                continue
+            values = dict((cons.key, list(cons.values)[0]) for cons in valid_combination)
+            if (len(values) != len(valid_combination) or
+                    frozenset(values) != name_set):
+                continue
+            if all(values[name] in allowed[name] for name in cons_names):
+                combinations.append(tuple(values[name] for name in cons_names))
+
+        combinations.sort()
+        new_paths = self.template.fill_many(cons_names, combinations)
+
+        for combination, new_path in zip(combinations, new_paths):
+            yield self.climate_file_from_combination(cons_names, combination,
+                                                     check=False, update=False,
+                                                     new_file=new_path)
+
+    def remove_files(self, paths):
+        """ Remove files from the valid files of this FileCreator,
+        e.g. because the commands to create them failed.
 
-        for combination in huge_iterator:
-            # Create a set of constraints for this combination.
-            climate_file =  self.climate_file_from_combination(cons_names, combination,
-                                                               check=True, update=False)
-            if climate_file:
-                yield climate_file
+        """
+
+        for path in paths:
+            file_id = self.store.path_ids.get(path)
+            if file_id is None:
+                continue
+
+            atts = self.store.atts(file_id)
+            removed_file = MetaFile(path_dir=os.path.dirname(path),
+                                    filename=os.path.basename(path),
+                                    all_atts=atts)
+            self.valid_hashes.discard(hash(removed_file))
+            self.valid_combinations.discard(frozenset(Constraint(key, [value])
+                                                      for key, value in atts.items()))
+            self.store.remove(path)
 
     def get_constraint(self, attribute_name):
         """ Get a particular constraint by name."""
 
-        for constraint in self.constraints:
-            if constraint.key == attribute_name:
-                return constraint
-
         # If it can't be found, return None.
-        return None
+        return self.constraints.get(attribute_name)
 
     def merge_constraints(self, new_constraints):
         """ This function adds the constraint values to the constraints from
@@ -174,39 +258,21 @@ class FileCreator(DataSet):
 
         """
 
-        existing_cons_names = [cons.key for cons in self.constraints]
+        existing_cons_names = self.constraints.keys()
 
         # Now add the constraints - only if they are in the pattern!
+        # Constraints with the same key have their values merged.
         for cons in new_constraints:
             if cons.key in existing_cons_names:
                 self.constraints.add(cons)
 
-        attribute_names = [cons.key for cons in self.constraints]
-
-        repeated_atts = []
-        for name in attribute_names:
-            if attribute_names.count(name) > 1:
-                repeated_atts.append(name)
-
-        to_remove = [cons for cons in self.constraints
-                     if cons.key in repeated_atts]
-
-        new_cons_dict = {}
-        for cons in to_remove:
-            new_cons_dict[cons.key] = set([])
-
-        for cons in to_remove:
-            new_cons_dict[cons.key] = new_cons_dict[cons.key].union(cons.values)
-            self.constraints.remove(cons)
-
-        for key in new_cons_dict:
-            self.constraints.add(Constraint(key, new_cons_dict[key]))
-
     def climate_file_from_combination(self, keys, next_combination,
-                                      check, update):
+                                      check, update, new_file=None):
         """ Make a possible output MetaFile object from
         a combination of attributes.
 
+        new_file is the path of the file, if it has already been built.
+
         """
 
         # Turn the combination tuple into a dictionary with
@@ -217,10 +283,8 @@ class FileCreator(DataSet):
             sub_dict[key] = value
             cons_list.append(Constraint(key, [value]))
 
-        new_file = self.output_pattern
-        for key in sub_dict:
-            att_sub = "%" + key + "%"
-            new_file = re.sub(att_sub, sub_dict[key], new_file)
+        if new_file is None:
+            new_file = self.template.fill(sub_dict)
 
         new_path = os.path.dirname(new_file)
         file_name = os.path.basename(new_file)
@@ -234,8 +298,9 @@ class FileCreator(DataSet):
             # If it is not, return None.
             module_logger.debug("Checking cons_list: {}".format(cons_list))
             if frozenset(cons_list) not in self.valid_combinations:
-                module_logger.debug("This combination: {0} is not found in {1}"
-                                    .format(cons_list, self.valid_combinations))
+                if module_logger.isEnabledFor(logging.DEBUG):
+                    module_logger.debug("This combination: {0} is not found in {1}"
+                                        .format(cons_list, self.valid_combinations))
                 return None
 
         if update:
@@ -243,6 +308,9 @@ class FileCreator(DataSet):
             file_hash = hash(new_climate_file)
             self.valid_hashes.add(file_hash)
             self.valid_combinations.add(frozenset(cons_list))
+            if all(name in sub_dict for name in self.store.att_names):
+                self.store.add(new_file, [sub_dict[name]
+                                          for name in self.store.att_names])
 
         module_logger.debug("Returning climate file: {}".format(new_climate_file))
         return new_climate_file
@@ -281,12 +349,8 @@ class FileCreator(DataSet):
         an output pattern.
 
         """
-        regex_pattern = r"%(\S+?)%"
-
-        attribute_names = re.findall(regex_pattern, pattern_string)
-
         constraint_list = [Constraint(att_name, [])
-                           for att_name in attribute_names]
+                           for att_name in attribute_names(pattern_string)]
 
         return set(constraint_list)
 
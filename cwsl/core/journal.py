@@ -0,0 +1,132 @@
+"""
+Authors: Tim Bedin, Tim Erwin
+
+Copyright 2014 CSIRO
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Contains the Journal class.
+
+"""
+
+import os
+import json
+import time
+import errno
+import pipes
+import hashlib
+import logging
+
+
+module_logger = logging.getLogger('cwsl.core.journal')
+
+QUEUED = 'queued'
+COMPLETED = 'completed'
+
+
+class Journal(object):
+    """ An append-only record of the commands run by a ProcessUnit.
+
+    Each line of the journal is a JSON object with the hash of a
+    command and its status. When a command is queued, its inputs and
+    outputs are recorded too. The line that marks a command as
+    completed is written by the shell that runs it, straight after the
+    command (and its annotation) succeed. This works the same way for
+    every exec manager, including batch jobs.
+
+    When a run is repeated, commands that are marked as completed and
+    whose outputs still exist can be skipped.
+
+    """
+
+    def __init__(self, path):
+        """ Arguments:
+
+        path: The journal file. It is created if it does not exist.
+
+        """
+
+        self.path = path
+
+        # The latest status of each command hash.
+        self.status = {}
+        self.load()
+
+        journal_dir = os.path.dirname(path)
+        if journal_dir:
+            try:
+                os.makedirs(journal_dir)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+        # Line buffered, so lines from the shell are not interleaved.
+        self.journal_file = open(path, 'a', 1)
+
+    def load(self):
+        """ Read the status of the commands from the journal file."""
+
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path) as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short when a run was killed.
+                    module_logger.warning("Skipping bad journal line: {}"
+                                          .format(line.strip()))
+                    continue
+                self.status[entry['hash']] = entry['status']
+
+    def record(self, command_hash, status, inputs=None, outputs=None):
+        """ Append the status of a command to the journal."""
+
+        entry = {'hash': command_hash, 'status': status, 'time': time.time()}
+        if inputs is not None:
+            entry['inputs'] = inputs
+        if outputs is not None:
+            entry['outputs'] = outputs
+
+        self.journal_file.write(json.dumps(entry) + '\n')
+        self.status[command_hash] = status
+
+    def is_complete(self, command_hash, outputs):
+        """ Return True if a command has completed and its outputs still exist."""
+
+        return (self.status.get(command_hash) == COMPLETED and
+                all(os.path.exists(output) for output in outputs))
+
+    def completion_cmd(self, command_hash):
+        """ Return the shell command that marks a command as completed."""
+
+        entry = json.dumps({'hash': command_hash, 'status': COMPLETED})
+        return ['echo', pipes.quote(entry), '>>', pipes.quote(self.path)]
+
+    def close(self):
+        self.journal_file.close()
+
+
+def command_hash(command_list):
+    """ Return a hash that identifies a command line."""
+
+    return hashlib.sha1('\0'.join(str(arg) for arg in command_list)).hexdigest()
+
+
+def journal_path(journal_dir, shell_command, output_pattern):
+    """ Return the path of the journal for a command and its output pattern,
+
+    so that the same ProcessUnit uses the same journal every time it is run.
+
+    """
+
+    unit_hash = hashlib.sha1(shell_command + '\0' + output_pattern).hexdigest()
+    return os.path.join(journal_dir, unit_hash + '.jsonl')
@@ -0,0 +1,156 @@
+"""
+Authors: Tim Bedin, Tim Erwin
+
+Copyright 2014 CSIRO
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Contains functions to read file manifests - published listings of
+the files in a data tree - so that the tree does not need to be walked.
+
+Supported formats (optionally gzipped, with a .gz suffix):
+
+    .txt (or anything else): one path per line, like the output of find.
+    .csv: a column named path, file_path or local_path, or else the first column.
+    .json: a list of paths or of objects with a path key,
+           or an object with such a list under "files".
+    .jsonl: one path, or object with a path key, per line.
+
+Relative paths are taken to be relative to the directory of the manifest.
+
+"""
+
+import os
+import re
+import csv
+import gzip
+import json
+import logging
+
+from cwsl.core.pattern_parser import split_pattern, pattern_regex
+
+module_logger = logging.getLogger('cwsl.core.manifest')
+
+# Column names (or object keys) that hold the file path.
+PATH_KEYS = ('path', 'file_path', 'local_path')
+
+
+def read_manifest(manifest_path):
+    """ Generate the paths listed in a manifest, one at a time. """
+
+    manifest_path = os.path.expandvars(manifest_path)
+    root = os.path.dirname(os.path.abspath(manifest_path))
+
+    if manifest_path.endswith('.gz'):
+        manifest_file = gzip.open(manifest_path, 'rb')
+        format_name = manifest_path[:-3]
+    else:
+        manifest_file = open(manifest_path, 'rb')
+        format_name = manifest_path
+
+    try:
+        if format_name.endswith('.csv'):
+            paths = csv_paths(manifest_file)
+        elif format_name.endswith('.jsonl'):
+            paths = (record_path(json.loads(line)) for line in manifest_file
+                     if line.strip())
+        elif format_name.endswith('.json'):
+            paths = json_paths(json.load(manifest_file))
+        else:
+            paths = (line.rstrip('\r\n') for line in manifest_file)
+
+        for path in paths:
+            if not path:
+                continue
+            # Keep paths as byte strings, like the file system scan.
+            if not isinstance(path, str):
+                path = path.encode('utf-8')
+            if not os.path.isabs(path):
+                path = os.path.normpath(os.path.join(root, path))
+            yield path
+    finally:
+        manifest_file.close()
+
+
+def match_manifest(manifest_path, parser, constraints=None):
+    """ Generate (path, attributes) for the paths in a manifest that match
+
+    the pattern of a PatternParser and are allowed by the constraints.
+
+    """
+
+    allowed = {}
+    for cons in constraints or []:
+        if cons.values:
+            allowed[cons.key] = set(cons.values)
+
+    # Most lines of a manifest for a whole archive will not match, so
+    # reject them on the fixed start of the pattern before the regex.
+    prefix = split_pattern(parser.pattern)[0]
+    # Unlike a glob, the regex of the parser lets an attribute match
+    # across directories, so paths deeper than the pattern would match.
+    regex = re.compile(pattern_regex(parser.pattern, within_segments=True))
+
+    for path in read_manifest(manifest_path):
+        if not path.startswith(prefix):
+            continue
+        match = regex.match(path)
+        if match is None:
+            continue
+        attributes = match.groupdict()
+        if all(attributes[key] in values for key, values in allowed.items()):
+            yield path, attributes
+
+
+def csv_paths(manifest_file):
+    """ Generate the paths from a CSV manifest. """
+
+    reader = csv.reader(manifest_file)
+    try:
+        header = next(reader)
+    except StopIteration:
+        return
+
+    column = 0
+    for key in PATH_KEYS:
+        if key in header:
+            column = header.index(key)
+            break
+    else:
+        # No header, so the first row is a path too.
+        if header:
+            yield header[0]
+
+    for row in reader:
+        if len(row) > column:
+            yield row[column]
+
+
+def json_paths(manifest):
+    """ Generate the paths from a loaded JSON manifest. """
+
+    if isinstance(manifest, dict):
+        manifest = manifest.get('files', [])
+
+    for record in manifest:
+        yield record_path(record)
+
+
+def record_path(record):
+    """ Return the path of a JSON manifest record. """
+
+    if isinstance(record, dict):
+        for key in PATH_KEYS:
+            if key in record:
+                return record[key]
+        return None
+
+    return record
@@ -20,20 +20,74 @@ This module contains the MetaFile class.
 import os
 import logging
 
+try:
+    intern
+except NameError:
+    from sys import intern
+
+
+# Attribute name tuples, shared between MetaFiles with the same attributes.
+_shared_names = {}
+
 
 class MetaFile(object):
-    """This object represents a single file and its stored attributes."""
+    """This object represents a single file and its stored attributes.
+
+    MetaFiles are immutable. The attributes are stored as a tuple of
+    names (shared between MetaFiles) and a tuple of interned values,
+    both sorted by name, and the full path and hash are only worked
+    out once.
+
+    """
+
+    __slots__ = ('path_dir', 'filename', 'full_path',
+                 'att_names', 'att_values', '_hash')
 
     def __init__(self, filename, path_dir, all_atts):
 
-        self.path_dir = path_dir
-        self.filename = filename
+        self._set_attributes(filename, path_dir, all_atts.keys(), all_atts.values())
+
+    @classmethod
+    def from_values(cls, filename, path_dir, att_names, att_values):
+        """ Make a MetaFile from a sequence of attribute names and
+
+        a matching sequence of values, without building a dictionary.
+
+        """
 
-        self.all_atts = all_atts
+        new_file = cls.__new__(cls)
+        new_file._set_attributes(filename, path_dir, att_names, att_values)
+
+        return new_file
+
+    def _set_attributes(self, filename, path_dir, att_names, att_values):
+
+        items = sorted(zip(att_names, att_values))
+        names = tuple(name for name, _ in items)
+        names = _shared_names.setdefault(names, names)
+        values = tuple(intern(value) if type(value) is str else value
+                       for _, value in items)
+
+        set_slot = object.__setattr__
+        set_slot(self, 'path_dir', path_dir)
+        set_slot(self, 'filename', filename)
+        set_slot(self, 'full_path', os.path.join(path_dir, filename))
+        set_slot(self, 'att_names', names)
+        set_slot(self, 'att_values', values)
+        set_slot(self, '_hash', hash((self.full_path, names, values)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("MetaFile objects are immutable")
+
+    def __reduce__(self):
+        return (MetaFile.from_values,
+                (self.filename, self.path_dir, self.att_names, self.att_values))
 
     @property
-    def full_path(self):
-        return os.path.join(self.path_dir, self.filename)
+    def all_atts(self):
+        """ A new dictionary of the attributes of the file. """
+
+        return dict(zip(self.att_names, self.att_values))
 
     def __repr__(self):
 
@@ -41,14 +95,23 @@ class MetaFile(object):
 
     def __hash__(self):
 
-        frozen_keys = frozenset(sorted(self.all_atts.keys()))
-        frozen_vals = frozenset(sorted(self.all_atts.values()))
-
-        val = hash(frozen_keys) ^ hash(frozen_vals) ^ hash(self.full_path)
-
-        return val
+        return self._hash
 
     def __eq__(self, other):
-        """ Two MetaFiles are equal if their hashs are equal."""
-        
-        return(hash(self) == hash(other))
+        """ Two MetaFiles are equal if their paths and attributes are equal."""
+
+        if self is other:
+            return True
+        if not isinstance(other, MetaFile):
+            return NotImplemented
+
+        return (self._hash == other._hash and
+                self.full_path == other.full_path and
+                self.att_names == other.att_names and
+                self.att_values == other.att_values)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
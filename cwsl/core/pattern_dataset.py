@@ -19,15 +19,16 @@ Contains the PatternDataSet class.
 
 import os.path
 import logging
-import glob
-import re
-import itertools
-from collections import defaultdict
 
+from cwsl.configuration import configuration
 from cwsl.core.metafile import MetaFile
-from cwsl.core.constraint import Constraint
+from cwsl.core.constraint import Constraint, ConstraintSet
 from cwsl.core.dataset import DataSet
 from cwsl.core.file_creator import FileCreator
+from cwsl.core.directory_walker import DirectoryWalker, ListingCache
+from cwsl.core.attribute_store import AttributeStore
+from cwsl.core.pattern_parser import PatternParser, pattern_regex
+from cwsl.core.manifest import match_manifest
 
 module_logger = logging.getLogger('cwsl.core.pattern_dataset')
 
@@ -39,7 +40,8 @@ class PatternDataSet(DataSet):
 
     """
 
-    def __init__(self, pattern_to_glob, constraint_set=set()):
+    def __init__(self, pattern_to_glob, constraint_set=set(), catalogue=None,
+                 scan_workers=None, lazy=False, manifest=None, track_changes=False):
         """ Arguments:
 
         pattern_to_glob: this is a string filename pattern, with placeholders
@@ -48,61 +50,141 @@ class PatternDataSet(DataSet):
 
         constraint_set: A set of Constraint objects to restrict the values the
                         attributes can take.
+
+        Optional:
+
+        catalogue: A FileCatalogue to use for scanning the file system, so that
+                   unchanged directories are not listed again.
+
+        scan_workers: The number of threads used to list directories when
+                      scanning. Defaults to the scan_workers configuration option.
+
+        lazy: If True, the file system is not scanned until the files,
+              constraints, subsets or valid combinations are first needed.
+              The cons_names are taken straight from the pattern.
+
+        manifest: The path to a manifest file listing the files in the
+                  archive (see cwsl.core.manifest). If given, the files are
+                  read from the manifest instead of the file system.
+
+        track_changes: If True, the modification time and size of every file
+                       found on the file system is recorded, so that refresh()
+                       also reports the files that have been rewritten. This
+                       costs a stat of every file on each scan.
         """
 
         self._files = None
+        self.pattern = pattern_to_glob
+        self.catalogue = catalogue
+        self.manifest = manifest
+        self.track_changes = track_changes
+
+        if scan_workers:
+            self.scan_workers = scan_workers
+        else:
+            self.scan_workers = getattr(configuration, 'scan_workers', 1)
 
         self.check_filename_pattern(pattern_to_glob,
                                     constraint_set)
 
-        if constraint_set:
-            self.restricted_patterns = []
-            given_names, given_values = zip(*[(cons.key, cons.values)
-                                              for cons in constraint_set])
-
-            # Generate all combinations
-            for combination in itertools.product(*given_values):
-                new_pattern = pattern_to_glob
-                for i, name in enumerate(given_names):
-                    pat_name = "%" + name + "%"
-                    new_pattern = re.sub(pat_name, combination[i], new_pattern)
-                self.restricted_patterns.append(new_pattern)
+        self.given_constraints = constraint_set
+
+        # The walker only follows the directories allowed by the constraints.
+        # Directory listings are remembered so that refresh() only lists
+        # the directories that have changed.
+        if catalogue:
+            self.walker = DirectoryWalker(pattern_to_glob, constraint_set,
+                                          list_dir=catalogue.list_dir)
+        else:
+            max_entries = getattr(configuration, 'listing_cache_entries', 1000000)
+            self.walker = DirectoryWalker(pattern_to_glob, constraint_set,
+                                          list_dir=ListingCache(max_entries=max_entries))
+
+        # Build a parser (and a regex) from the original pattern.
+        self.parser = PatternParser(pattern_to_glob)
+        self.regex_pattern = self.parser.regex_pattern
+        self.compiled_regex = self.parser.regex
+        self.att_names = self.parser.att_names
+
+        self._store = None
+        self._constraints = None
+        self._valid_combinations = None
+
+        if lazy:
+            self.cons_names = list(self.att_names)
         else:
-            self.restricted_patterns = [pattern_to_glob]
+            self.build_indexes()
+            self.cons_names = [cons.key for cons in self.constraints]
 
-        # Build a globbing pattern from each restricted pattern.
-        self.glob_patterns = [re.sub(r"%.+?%", r"*", pattern)
-                              for pattern in self.restricted_patterns]
+    def build_indexes(self):
+        """ Scan the file system and build any of the attribute store,
 
-        # Build a regex from the original pattern.
-        self.regex_pattern = self.generate_regex(pattern_to_glob)
+        constraints and valid combinations that have not been set yet.
 
-        # Update the constraints to only include those that are matched.
-        self.constraints = self.update_constraints()
+        """
+
+        # Parse the found files once into a table of attribute values
+        # that the constraints, subsets and valid combinations are built from.
+        if self._store is None:
+            self._store = self.parse_files()
 
-        # Update the constraints.
-        bad_cons_names = [cons.key for cons in constraint_set]
-        to_remove = []
-        for cons in self.constraints:
-            if cons.key in bad_cons_names:
-                to_remove.append(cons)
+        if self._constraints is None:
+            # Update the constraints to only include those that are matched,
+            # keeping the given constraints as they are.
+            found_constraints = self.update_constraints()
+            for cons in ConstraintSet(self.given_constraints):
+                found_constraints.override(cons)
 
-        for cons in to_remove:
-            self.constraints.remove(cons)
+            self._constraints = found_constraints
 
-        self.constraints = self.constraints.union(constraint_set)
-        self.cons_names = [cons.key for cons in self.constraints]
+        if self._valid_combinations is None:
+            # Find all the valid values for the constraints for later
+            # looping.
+            self._valid_combinations = self.generate_valids()
 
-        self.subsets = self.create_subsets()
+    @property
+    def store(self):
+        if self._store is None:
+            self.build_indexes()
+        return self._store
+
+    @property
+    def constraints(self):
+        if self._constraints is None:
+            self.build_indexes()
+        return self._constraints
 
-        # Find all the valid values for the constraints for later
-        # looping.
-        self.valid_combinations = self.generate_valids()
+    @constraints.setter
+    def constraints(self, value):
+        self._constraints = ConstraintSet(value)
+
+    @property
+    def subsets(self):
+        """ A dictionary of {attribute: {value: file ids}} to allow you to get
+
+        the required files by key and attribute.
+
+        The ids of files removed by refresh() are kept, with an empty
+        path in store.paths.
+
+        """
+
+        return self.store.postings
+
+    @property
+    def valid_combinations(self):
+        if self._valid_combinations is None:
+            self.build_indexes()
+        return self._valid_combinations
+
+    @valid_combinations.setter
+    def valid_combinations(self, value):
+        self._valid_combinations = value
 
     @property
     def files(self):
-        # If there are already files found, do not glob.
-        if not self._files:
+        # If the file system has already been scanned, do not glob.
+        if self._files is None:
             self._files = self.glob_fs()
 
         return self._files
@@ -120,16 +202,113 @@ class PatternDataSet(DataSet):
     def glob_fs(self):
         """ Returns a list of the files that match the
 
-        glob patterns.
+        pattern and constraints.
 
         """
 
+        if self.manifest:
+            found = match_manifest(self.manifest, self.parser,
+                                   self.given_constraints)
+        else:
+            # The walker matches the pattern one path segment at a time, so it
+            # already knows the attributes of every file it finds.
+            found = self.walker.walk_attributes(workers=self.scan_workers)
+
         found_files = []
-        for pattern in self.glob_patterns:
-            found_files += [PathString(present_file)
-                            for present_file in glob.glob(pattern)]
+        for present_file, attributes in found:
+            found_file = PathString(present_file)
+            found_file.attributes = attributes
+            if self.track_changes and not self.manifest:
+                found_file.stamp = file_stamp(present_file)
+            found_files.append(found_file)
+
         return found_files
 
+    def refresh(self):
+        """ Rescan the file system and update the dataset in place.
+
+        Only directories that have changed since the last scan are listed
+        again. The attribute store, constraints and valid combinations are
+        updated from the added and removed files, rather than rebuilt.
+
+        If the dataset tracks changes, files that are still present but
+        whose modification time or size has changed are reported too.
+
+        Returns a tuple of lists of the (added, removed, changed) files.
+
+        """
+
+        if self._files is None:
+            # Nothing has been scanned yet, so every file is new.
+            self.build_indexes()
+            return list(self.files), [], []
+
+        old_files = dict((old_file, old_file) for old_file in self._files)
+        new_files = self.glob_fs()
+        new_set = set(new_files)
+
+        added = [found_file for found_file in new_files
+                 if found_file not in old_files]
+        removed = [old_file for old_file in self._files
+                   if old_file not in new_set]
+
+        changed = []
+        if self.track_changes:
+            changed = [found_file for found_file in new_files
+                       if found_file in old_files and
+                       getattr(found_file, 'stamp', None) !=
+                       getattr(old_files[found_file], 'stamp', None)]
+
+        self._files = new_files
+
+        if self._store is not None and (added or removed):
+            self.update_indexes(added, removed)
+
+        module_logger.info("Refreshed {0}: {1} files added, {2} removed, {3} changed"
+                           .format(self.pattern, len(added), len(removed), len(changed)))
+
+        return added, removed, changed
+
+    def update_indexes(self, added, removed):
+        """ Update the attribute store, and the constraints and valid
+
+        combinations if they have been built, for the files added to
+        and removed from the dataset.
+
+        """
+
+        # The rows of values whose valid combination may have changed.
+        rows = set()
+        for old_file in removed:
+            rows.add(self._store.row(self._store.path_ids[old_file]))
+            self._store.remove(old_file)
+        for found_file in added:
+            values = tuple(self.file_values(found_file))
+            self._store.add(found_file, values)
+            rows.add(values)
+
+        if self._constraints is not None:
+            given_names = set(cons.key for cons in self.given_constraints)
+            for name in self.att_names:
+                if name in given_names:
+                    continue
+                present_values = self._store.present_values(name)
+                if present_values:
+                    self._constraints.override(Constraint(name, present_values))
+                else:
+                    self._constraints.remove_key(name)
+                if name not in self.cons_names:
+                    self.cons_names.append(name)
+
+        if self._valid_combinations is not None:
+            for values in rows:
+                combination = frozenset(Constraint(name, [value])
+                                        for name, value in zip(self.att_names, values))
+                if self._store.has_combination(values):
+                    self._valid_combinations.add(combination)
+                else:
+                    self._valid_combinations.discard(combination)
+
     def __iter__(self):
         """ Make the object iterable """
 
@@ -138,12 +317,8 @@ class PatternDataSet(DataSet):
     def get_constraint(self, attribute_name):
         """ Get a particular constraint by name."""
 
-        for constraint in self.constraints:
-            if constraint.key == attribute_name:
-                return constraint
-
         # If it can't be found, return None.
-        return None
+        return self.constraints.get(attribute_name)
 
     def generate_regex(self, pattern_to_glob):
         """ From the input pattern (of from %model%_%variable%_%agg_type% etc.)
@@ -153,55 +328,48 @@ class PatternDataSet(DataSet):
 
         """
 
-        # First thing, replace '.' with '\.' and make sure we're going
-        # to match the start and the end of the pattern string.
-        pattern_to_glob = re.sub(r"\.", r"\.", pattern_to_glob)
-        pattern_to_glob = r"^" + pattern_to_glob + r"$"
+        return pattern_regex(pattern_to_glob)
 
-        found_values = []
-        new_val = pattern_to_glob
+    def parse_files(self):
+        """ Match every file in the dataset against the pattern regex, once.
 
-        # Find all the named attributes
-        all_matches = re.findall(r"%.+?%", pattern_to_glob)
+        Returns an AttributeStore with a column for each name in self.att_names.
 
-        for match_thing in all_matches:
-            name = match_thing[1:-1]
+        """
+
+        store = AttributeStore(self.att_names)
+        for found_file in self.files:
+            store.add(found_file, self.file_values(found_file))
 
-            if match_thing not in found_values:
-                # Change to a named group.
-                group_string = r"(?P<" + name + r">.+?)"
-                new_val = re.sub(match_thing, group_string, new_val, count=1)
-                found_values.append(match_thing)
-            else:
-                # Use the existing group.
-                group_string = r"(?P=" + name + r")"
-                new_val = re.sub(match_thing, group_string, new_val, count=1)
+        return store
 
-        return new_val
+    def file_values(self, found_file):
+        """ Return the attribute values of a found file, in att_names order. """
+
+        stored_atts = getattr(found_file, 'attributes', None)
+        if stored_atts is not None:
+            return [stored_atts[name] for name in self.att_names]
+
+        values = self.parser.parse(found_file)
+        if values is not None:
+            return values
+        else:
+            module_logger.error("Pattern regex did not match found file!")
+            raise Exception
 
     def update_constraints(self):
-        """ Loop through the files in the dataset and update
+        """ Use the parsed files in the dataset to update
 
         self.constraints to match only the constraint values
         that actually exist in the DataSet.
 
         """
 
-        new_cons_dir = defaultdict(set)
-        for found_file in self.files:
-            match = re.match(self.regex_pattern, found_file)
-            if match:
-                for thing in match.groupdict():
-                    new_cons_dir[thing].add(match.groupdict()[thing])
-            else:
-                module_logger.error("Pattern regex did not match found file!")
-                raise Exception
+        if not len(self.store):
+            return ConstraintSet()
 
-        cons_set = set()
-        for new_cons in new_cons_dir:
-            cons_set.add(Constraint(new_cons, new_cons_dir[new_cons]))
-
-        return cons_set
+        return ConstraintSet(Constraint(name, self.store.present_values(name))
+                             for name in self.att_names)
 
     def get_files(self, reqs_dict, **kwargs):
         """ Get the required file set from the dataset,
@@ -216,15 +384,13 @@ class PatternDataSet(DataSet):
         This method would then return all the files in the dataset that have
         variable tas, model NorESM and activity CMIP5.
 
-        This requires self.create_subsets() to be called before running.
-
         Returns a list of MetaFile objects.
 
         """
 
-        files_returned = []
+        search_dict = {}
 
-        all_valid_names = self.cons_names
+        all_valid_names = list(self.cons_names)
         try:
             all_valid_names += self.alias_map.keys()
         except:
@@ -239,71 +405,38 @@ class PatternDataSet(DataSet):
                 except:
                     old_key = key
 
-                att_value = reqs_dict[old_key]
-                files_returned.append(self.subsets[key][att_value])
-
-        if not files_returned:
-            return []
-
-        all_files = set.intersection(*files_returned)
+                search_dict[key] = reqs_dict[old_key]
 
         output = []
-        for full_path in all_files:
-            out_dict = self.read_atts(full_path)
-            path, name = os.path.split(full_path)
-            output.append(MetaFile(name, path, out_dict))
+        for file_id in self.store.find(search_dict):
+            path, name = os.path.split(self.store.paths[file_id])
+            output.append(MetaFile.from_values(name, path, self.store.att_names,
+                                               self.store.row(file_id)))
 
         return output
 
     def read_atts(self, file_name):
         """ Applies the file pattern to a file name to read the correct attributes. """
 
-        match = re.match(self.regex_pattern, file_name)
-
-        return match.groupdict()
+        stored_atts = getattr(file_name, 'attributes', None)
+        if stored_atts is not None:
+            return dict(stored_atts)
 
-    def create_subsets(self):
-        """ Sets up a hash table to allow you to get the required files
-        by key and attribute.
-
-        """
-        new_dict = defaultdict(dict)
-
-        for found_file in self.files:
-            match = re.match(self.regex_pattern,
-                             found_file)
-            if match:
-                groups = match.groupdict()
-                for att in groups:
-                    value = groups[att]
-                    try:
-                        new_dict[att][value].add(found_file)
-                    except KeyError:
-                        new_dict[att][value] = set([found_file])
-
-        return new_dict
+        try:
+            return self.store.atts(self.store.path_ids[file_name])
+        except KeyError:
+            return self.parser.parse_dict(file_name)
 
     def generate_valids(self):
         """ Generate the valid combinations of constraints.
 
-        This is quite inefficient - doubles the number of regex
-        matches.
+        Files with the same attribute values share a single combination.
 
         """
 
-        new_valids = set()
-
-        # Loop over files
-        for present_file in self.files:
-            match = re.match(self.regex_pattern, present_file)
-            if match:
-                valids = []
-                matchdict = match.groupdict()
-                for cons in matchdict:
-                    valids.append(Constraint(cons, [matchdict[cons]]))
-                new_valids.add(frozenset(valids))
-
-        return new_valids
+        return set(frozenset(Constraint(name, [value])
+                             for name, value in zip(self.att_names, values))
+                   for values in self.store.combinations())
 
 
 class PathString(str):
@@ -315,6 +448,22 @@ class PathString(str):
     def __init__(self, value):
         super(PathString, self).__init__(value)
         self.full_path = value
+        # Attributes parsed from the path, if already known.
+        self.attributes = None
+        # The (mtime, size) of the file, if changes are tracked.
+        self.stamp = None
+
+
+def file_stamp(path):
+    """ Return the (mtime, size) of a file, or None if it can't be read."""
+
+    try:
+        file_stat = os.stat(path)
+    except OSError:
+        return None
+
+    return (file_stat.st_mtime, file_stat.st_size)
+
 
 class ConstraintNotFoundError(Exception):
     """ Exception class for misspelled constraints. """
@@ -0,0 +1,215 @@
+"""
+Authors: Tim Bedin, Tim Erwin
+
+Copyright 2014 CSIRO
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Contains the PatternParser and PathTemplate classes.
+
+"""
+
+import re
+import logging
+
+
+module_logger = logging.getLogger('cwsl.core.pattern_parser')
+
+# An attribute name surrounded by % signs.
+PLACEHOLDER_REGEX = re.compile(r"%(\S+?)%")
+
+
+class PatternParser(object):
+    """ Extracts the attribute values from paths that match a pattern.
+
+    This is the one place a pattern is compiled, so the PatternDataSet,
+    the DirectoryWalker and the FileCreator all agree on its attributes.
+
+    """
+
+    def __init__(self, pattern):
+        """ Arguments:
+
+        pattern: A string filename pattern, with placeholders
+                 surrounding attribute names.
+                 e.g. "/home/billy/test/%colour%/%texture%/%fruit%_%colour%.%file_type%"
+
+        """
+
+        self.pattern = pattern
+
+        self.regex_pattern = pattern_regex(pattern)
+        self.regex = re.compile(self.regex_pattern)
+        self.att_names = sorted(self.regex.groupindex,
+                                key=self.regex.groupindex.get)
+
+    def parse(self, path):
+        """ Return a tuple of the attribute values of a path, in att_names
+        order, or None if the path does not match the pattern.
+
+        """
+
+        match = self.regex.match(path)
+        if match:
+            return match.groups()
+
+        return None
+
+    def parse_dict(self, path):
+        """ Return a dictionary of the attributes of a path,
+        or None if the path does not match the pattern.
+
+        """
+
+        match = self.regex.match(path)
+        if match:
+            return match.groupdict()
+
+        return None
+
+
+class PathTemplate(object):
+    """ Builds paths from a pattern by filling in attribute values.
+
+    The pattern is split once into its literal text and attribute
+    fields, so a path is built with a single join or format rather than
+    a substitution per attribute. Attributes without a value are
+    left in the path as they are.
+
+    """
+
+    def __init__(self, pattern):
+        """ Arguments:
+
+        pattern: A string filename pattern, with placeholders
+                 surrounding attribute names.
+
+        """
+
+        self.pattern = pattern
+
+        parts = split_pattern(pattern)
+        self.literals = parts[0::2]
+        self.names = parts[1::2]
+
+        # Format strings for filling from a sequence of values, by key order.
+        self._formats = {}
+
+    def fill(self, att_dict):
+        """ Return the path for a dictionary of attribute values. """
+
+        path_parts = [self.literals[0]]
+        for name, literal in zip(self.names, self.literals[1:]):
+            try:
+                path_parts.append(att_dict[name])
+            except KeyError:
+                path_parts.append('%' + name + '%')
+            path_parts.append(literal)
+
+        return ''.join(path_parts)
+
+    def fill_many(self, keys, combinations):
+        """ Return a list of the paths for many combinations of values.
+
+        keys: The attribute names, in the order of the values in
+              each combination.
+
+        """
+
+        path_format = self.format_string(tuple(keys))
+
+        return [path_format.format(*combination)
+                for combination in combinations]
+
+    def format_string(self, keys):
+        """ Build (or fetch) the format string that fills the pattern
+
+        from a sequence of values in keys order.
+
+        """
+
+        try:
+            return self._formats[keys]
+        except KeyError:
+            pass
+
+        positions = dict((name, i) for i, name in enumerate(keys))
+
+        format_parts = [escape_format(self.literals[0])]
+        for name, literal in zip(self.names, self.literals[1:]):
+            if name in positions:
+                format_parts.append('{' + str(positions[name]) + '}')
+            else:
+                format_parts.append(escape_format('%' + name + '%'))
+            format_parts.append(escape_format(literal))
+
+        path_format = ''.join(format_parts)
+        self._formats[keys] = path_format
+
+        return path_format
+
+
+def escape_format(text):
+    """ Escape the braces in text for use in a format string."""
+
+    return text.replace('{', '{{').replace('}', '}}')
+
+
+def split_pattern(pattern):
+    """ Split a pattern into its literal text and attribute names.
+
+    The literals are at the even positions of the returned list and
+    the names at the odd positions, e.g. "%model%_%variable%.nc" gives
+    ['', 'model', '_', 'variable', '.nc'].
+
+    """
+
+    return PLACEHOLDER_REGEX.split(pattern)
+
+
+def attribute_names(pattern):
+    """ Return the attribute names in a pattern, in order, with repeats."""
+
+    return PLACEHOLDER_REGEX.findall(pattern)
+
+
+def pattern_regex(pattern, within_segments=False):
+    """ From the input pattern (of from %model%_%variable%_%agg_type% etc.)
+
+    create a regular expression that will match the file name and extract
+    the named attributes (model=?, variable=?, att_type=?)
+
+    If within_segments is True, attribute values can't contain a '/', as
+    for paths found with glob. Use this for paths from anywhere else.
+
+    """
+
+    value_regex = r"[^/]+?" if within_segments else r".+?"
+
+    # Escape the '.' in the literal text, and make sure we're going
+    # to match the start and the end of the pattern string.
+    parts = split_pattern(pattern)
+
+    regex = r"^"
+    found_values = []
+    for i, part in enumerate(parts):
+        if i % 2 == 0:
+            regex += part.replace('.', r'\.')
+        elif part not in found_values:
+            # Change to a named group.
+            regex += r"(?P<" + part + r">" + value_regex + r")"
+            found_values.append(part)
+        else:
+            # Use the existing group.
+            regex += r"(?P=" + part + r")"
+    regex += r"$"
+
+    return regex
@@ -25,8 +25,10 @@ from cwsl.configuration import configuration
 from cwsl.utils import utils
 from cwsl.core.argument_creator import ArgumentCreator
 from cwsl.core.file_creator import FileCreator
-from cwsl.core.constraint import Constraint
-from cwsl.core.scheduler import SimpleExecManager
+from cwsl.core.constraint import Constraint, ConstraintSet
+from cwsl.core.scheduler import get_exec_manager
+from cwsl.core.journal import Journal, QUEUED, COMPLETED, command_hash, journal_path
+from cwsl.core.result_cache import configured_cache, cache_key, file_fingerprint
 
 
 module_logger = logging.getLogger('cwsl.core.process_unit')
@@ -79,8 +81,24 @@ class ProcessUnit(object):
                          has to be used as a positional argument.
 
         execution_options: A dictionary to pass options like required queues, walltime,
-                           required modules etc. to the process unit. Currently only
-                           required_modules is implemented.
+                           required modules etc. to the process unit. Currently
+                           required_modules, execution_manager (the name of the
+                           exec manager to use instead of the configured one) and
+                           queue_size (for the StreamingExecManager) are implemented.
+                           max_commands refuses to run plans with more commands
+                           than the limit (overriding the configured max_commands).
+                           journal is a file to record the commands in, so that
+                           a run that stops can be resumed (overriding the
+                           configured journal_dir).
+                           skip_up_to_date skips commands whose outputs are newer
+                           than their inputs, or with 'fingerprint' (and a journal)
+                           commands whose inputs are unchanged since they completed.
+                           result_cache is a shared directory to cache the outputs
+                           of commands in (overriding the configured
+                           result_cache_dir), and result_cache_max_gb its size.
+                           The other options of each exec manager (e.g. workers,
+                           retries, queue and walltime) are read by its
+                           from_options method.
 
         kw_string: A string used for composite constraint keyword arguments, i.e.
                    using multiple attribute values in a single keyword argument.
@@ -120,8 +138,11 @@ class ProcessUnit(object):
         else:
             self.kw_string = None
 
+        # The plan_stats estimate of the last run, set by execute.
+        self.plan_estimate = None
+
         # The initial Constraints are built from the output file pattern.
-        pattern_constraints = set(FileCreator.constraints_from_pattern(output_pattern))
+        pattern_constraints = ConstraintSet(FileCreator.constraints_from_pattern(output_pattern))
 
         mapped_constraints = self.apply_mappings(pattern_constraints)
 
@@ -150,22 +171,11 @@ class ProcessUnit(object):
         for map_name, map_spec in self.map_dict.items():
             # First update the outputs with values from the input.
             found_con = self.inputlist[map_spec[1]].get_constraint(map_spec[0])
-            constraints.add(Constraint(map_name, found_con.values))
-            # Remove the empty constraint.
-            constraints.remove(Constraint(map_name, []))
+            constraints.override(Constraint(map_name, found_con.values))
 
-            # Update the subsets dictionary for the input.
-            # this will fail for a FileCreator.
-            try:
-                for value in found_con.values:
-                    module_logger.debug("Updating subsets for {}: {}"
-                                        .format(map_name, value))
-                    found_files = self.inputlist[map_spec[1]].get_files({found_con.key: value})
-                    module_logger.debug("Found files are: {}".format(found_files))
-                    self.inputlist[map_spec[1]].subsets[map_name][value] = [file_ob.full_path
-                                                                            for file_ob in found_files]
-            except AttributeError:
-                pass
+            # Alias the mapped name to the input constraint, so
+            # that files can be looked up from the input by either.
+            self.inputlist[map_spec[1]].alias_constraint(map_spec[0], map_name)
 
             # Added the mapped constraint to the input self.cons_names
             self.inputlist[map_spec[1]].cons_names.append(map_name)
@@ -196,25 +206,23 @@ class ProcessUnit(object):
         module_logger.debug("Before filling from input, output_constraints are: {}"
                             .format(constraints))
 
-        new_cons = set([])
-        to_remove = []
+        new_cons = ConstraintSet()
         for cons in constraints:
             if not cons.values:
                 module_logger.debug("Trying to fill constraint: {}"
                                     .format(cons))
-                found_cons = set([input_ds.get_constraint(cons.key)
-                                  for input_ds in inputlist
-                                  if input_ds.get_constraint(cons.key)])
+                found_cons = [input_ds.get_constraint(cons.key)
+                              for input_ds in inputlist]
+                found_cons = [found_con for found_con in found_cons if found_con]
 
                 module_logger.debug("Found constraints: {}"
                                     .format(found_cons))
-                new_cons = new_cons.union(found_cons)
-                to_remove.append(cons)
+                new_cons.update(found_cons)
 
-        for cons in to_remove:
-            constraints.remove(cons)
-
-        constraints = constraints.union(new_cons)
+        # The values found in the inputs are merged.
+        constraints = ConstraintSet(constraints)
+        for cons in new_cons:
+            constraints.override(cons)
 
         module_logger.debug("After filling from input, output_constraints are: {}"
                             .format(constraints))
@@ -246,22 +254,11 @@ class ProcessUnit(object):
         module_logger.debug("Attempting to fill: {}"
                             .format(empty_cons_names))
 
-        # Lists to hold constraints to add or remove.
-        to_add = []
-        to_remove = []
-
         for cons in extra_constraints:
-            # Add the extra_constraints if they are found in the output.
+            # Add the extra_constraints if they are found in the output,
+            # merging the values of repeated extras.
             if cons.key in empty_cons_names:
-                to_add.append(cons)
-                # Remove the empty.
-                to_remove += [bad_cons for bad_cons in constraints
-                              if bad_cons.key == cons.key]
-
-        for cons in to_remove:
-            constraints.remove(cons)
-        for cons in to_add:
-            constraints.add(cons)
+                constraints.add(cons)
 
         module_logger.debug("After filling from extras, output constraints: {}"
                             .format(constraints))
@@ -272,7 +269,10 @@ class ProcessUnit(object):
         """ This method runs the actual process.
 
         This method returns a FileCreator to be used
-        as input to the next VisTrails module.
+        as input to the next VisTrails module. If the exec manager
+        runs each command on its own (the StreamingExecManager and
+        ParallelExecManager, not the default SimpleExecManager), the
+        outputs of commands that failed are left out of the FileCreator.
 
         """
 
@@ -289,8 +289,31 @@ class ProcessUnit(object):
         # the output FileCreator.
         this_looper = ArgumentCreator(self.inputlist, self.file_creator, self.merge_output)
 
-        # TODO determine scheduler from user options.
-        scheduler = SimpleExecManager(noexec=simulate)
+        # Report the size of the plan, and refuse to run plans that are
+        # too big, before any commands are built.
+        stats = self.plan_stats(inputs=False)
+        self.plan_estimate = stats
+        module_logger.info("Plan estimate: up to {commands} commands, creating {output_files} "
+                           "output files, from {combinations} input combinations".format(**stats))
+        max_commands = self.execution_options.get('max_commands',
+                                                  getattr(configuration, 'max_commands', 0))
+        if max_commands and stats['commands'] > max_commands:
+            raise TooManyCommandsError("About {0} commands would be run, but the limit is {1}. "
+                                       "Estimated plan: {2}"
+                                       .format(stats['commands'], max_commands, stats))
+
+        # The execution options can override the configured scheduler.
+        manager_name = self.execution_options.get('execution_manager',
+                                                  getattr(configuration, 'execution_manager',
+                                                          'SimpleExecManager'))
+        scheduler = get_exec_manager(manager_name, noexec=simulate,
+                                     options=self.execution_options)
+
+        # Batch jobs wait for the jobs that create their input files.
+        input_jobs = []
+        for ds in self.inputlist:
+            input_jobs.extend(getattr(ds, 'job_ids', []))
+        scheduler.add_job_deps(input_jobs)
 
         if self.execution_options.has_key('required_modules'):
             scheduler.add_module_deps(self.execution_options['required_modules'])
@@ -300,36 +323,237 @@ class ProcessUnit(object):
         os.environ['CWSL_CTOOLS'] = configuration.cwsl_ctools_path
         scheduler.add_python_paths([os.path.join(configuration.cwsl_ctools_path,'pythonlib')])
 
-        # For every valid possible combination, apply any positional and
-        # keyword args, then add the command to the scheduler.
-        for combination in this_looper:
-            if combination:
+        journal = self.open_journal(simulate)
+        skip_mode = self.skip_mode(journal)
+        skipped = 0
+        cache = None if simulate else configured_cache(self.execution_options)
+        # The cache keys and staged outputs of the commands that were run,
+        # to store their results.
+        to_cache = []
+        # Built when the first command is added, or False if there is no VisTrails api.
+        metadata = None
+        # Input files are often shared, so they are only looked at once.
+        input_mtimes = {}
+        input_fingerprints = {}
+
+        # If planning fails part way, the scheduler's workers are stopped
+        # and the journal and cache are closed before the error is raised.
+        planned = False
+        try:
+            # For every valid possible combination, apply any positional and
+            # keyword args, then add the command to the scheduler.
+            for combination in this_looper:
+                if combination:
+
+                    in_files, out_files = self.get_fullnames((combination[0], combination[1]))
+                    this_dict = combination[2]
+
+                    base_cmd_list = [self.shell_command] + in_files + out_files
+
+                    # Now apply any keyword arguments and positional args.
+                    keyword_command_list = self.apply_keyword_args(base_cmd_list, this_dict)
+                    positional_list = self.apply_positional_args(keyword_command_list, this_dict)
+                    final_command_list = self.apply_kwstring(positional_list, this_dict)
+
+                    # Skip commands whose outputs are newer than their inputs.
+                    if skip_mode == 'mtime' and up_to_date(in_files, out_files, input_mtimes):
+                        skipped += 1
+                        continue
+
+                    # Skip commands that completed in an earlier run. In
+                    # fingerprint mode, a command is only complete if its
+                    # inputs have not changed since.
+                    on_success = None
+                    if journal:
+                        if skip_mode == 'fingerprint':
+                            cmd_hash = command_hash(final_command_list +
+                                                    [cached_fingerprint(in_file, input_fingerprints, cache)
+                                                     for in_file in in_files])
+                        else:
+                            cmd_hash = command_hash(final_command_list)
+                        if journal.is_complete(cmd_hash, out_files):
+                            skipped += 1
+                            continue
+
+                    # Generate the annotation string. The parts that are the same for
+                    # every command are only looked up once per run.
+                    if metadata is None:
+                        try:
+                            metadata = utils.MetadataBuilder()
+                        except NameError:
+                            metadata = False
+                    if metadata:
+                        annotation = metadata.build(final_command_list)
+                    else:
+                        annotation = None
+
+                    # Reuse the outputs of the same command on the same inputs.
+                    # The cache holds outputs as the command wrote them, so
+                    # fetched outputs are annotated like new ones.
+                    on_created = None
+                    if cache:
+                        key = cache_key(final_command_list, in_files, out_files,
+                                        dict((in_file, cached_fingerprint(in_file, input_fingerprints,
+                                                                          cache))
+                                             for in_file in in_files))
+                        # Inputs that don't exist yet can't be fingerprinted.
+                        if key is not None:
+                            if cache.fetch(key, out_files):
+                                skipped += 1
+                                if not annotation:
+                                    if journal:
+                                        journal.record(cmd_hash, COMPLETED, in_files, out_files)
+                                    continue
+                                final_command_list = None
+                            elif scheduler.runs_on_submit:
+                                # Batch jobs have not created their outputs
+                                # when submit returns, so they are not stored.
+                                staged_dir, on_created = cache.stage(out_files)
+                                to_cache.append((key, out_files, staged_dir))
+
+                    if journal:
+                        journal.record(cmd_hash, QUEUED, in_files, out_files)
+                        on_success = journal.completion_cmd(cmd_hash)
+
+                    # The subprocess / queue submission is done here.
+                    scheduler.add_cmd(final_command_list, out_files, annotation=annotation,
+                                      on_success=on_success, on_created=on_created)
+
+            planned = True
+        finally:
+            if journal:
+                journal.close()
+            if not planned:
+                scheduler.cancel()
+                if cache:
+                    close_cache(cache, to_cache)
+
+        if skipped:
+            module_logger.info("Skipped {0} commands with up to date outputs"
+                               .format(skipped))
+
+        try:
+            scheduler.submit()
+
+            # Only pass on the files that were created.
+            failed_files = scheduler.failed_files
+            if failed_files:
+                module_logger.error("{0} output files were not created, as their commands failed"
+                                    .format(len(failed_files)))
+                self.file_creator.remove_files(failed_files)
+
+            if cache:
+                while to_cache:
+                    key, out_files, staged_dir = to_cache.pop()
+                    if failed_files.intersection(out_files):
+                        cache.discard(staged_dir)
+                    else:
+                        cache.store(key, out_files, staged_dir)
+                module_logger.info(cache.report())
+        finally:
+            if cache:
+                close_cache(cache, to_cache)
+
+        job_id = getattr(scheduler, 'job_id', None)
+        if job_id:
+            self.file_creator.job_ids = [job_id]
+
+        # The scheduler is kept for testing purposes.
+        self.scheduler = scheduler
+
+        return self.file_creator
 
-                in_files, out_files = self.get_fullnames((combination[0], combination[1]))
-                this_dict = combination[2]
+    def open_journal(self, simulate=False):
+        """ Open the journal of this ProcessUnit, or return None
+        if there is no journal.
 
-                base_cmd_list = [self.shell_command] + in_files + out_files
+        The journal is the journal execution option, or else a file in
+        the configured journal_dir named for the command and output pattern.
 
-                # Now apply any keyword arguments and positional args.
-                keyword_command_list = self.apply_keyword_args(base_cmd_list, this_dict)
-                positional_list = self.apply_positional_args(keyword_command_list, this_dict)
-                final_command_list = self.apply_kwstring(positional_list, this_dict)
+        """
 
-                # Generate the annotation string.
-                try:
-                    annotation = utils.build_metadata(final_command_list)
-                except NameError:
-                    annotation = None
+        if simulate:
+            return None
 
-                # The subprocess / queue submission is done here.
-                scheduler.add_cmd(final_command_list, out_files, annotation=annotation)
+        path = self.execution_options.get('journal')
+        if not path:
+            journal_dir = getattr(configuration, 'journal_dir', '')
+            if not journal_dir:
+                return None
+            path = journal_path(os.path.expandvars(journal_dir),
+                                self.shell_command, self.file_creator.output_pattern)
 
-        scheduler.submit()
+        return Journal(os.path.expandvars(path))
 
-        # The scheduler is kept for testing purposes.
-        self.scheduler = scheduler
+    def skip_mode(self, journal=None):
+        """ Return how to decide whether a command's outputs are up to date:
 
-        return self.file_creator
+        'mtime' (outputs newer than all inputs), 'fingerprint' (inputs
+        unchanged since the command completed, which needs a journal)
+        or None to always run the command.
+
+        """
+
+        mode = self.execution_options.get('skip_up_to_date',
+                                          getattr(configuration, 'execution_options', '')
+                                          == 'skip_up_to_date')
+        if not mode:
+            return None
+        if mode == 'fingerprint':
+            if journal:
+                return 'fingerprint'
+            module_logger.warning("Input fingerprints need a journal - using modification times")
+
+        return 'mtime'
+
+    def plan_stats(self, sample_size=100, inputs=True):
+        """ Estimate the size of a run without building any MetaFiles.
+
+        The estimate comes from the valid combinations and the attribute
+        tables of the input DataSets. It returns a dictionary of:
+
+        combinations: The number of combinations of the shared input attributes.
+        commands: The number of commands that would be run (an upper bound).
+        output_files: The number of output files that would be created. This
+                      is the same as commands, as each command creates the one
+                      file named by all of the output attributes, and commands
+                      with the same output file are only run once.
+        input_files: The number of input files that match the combinations.
+        input_bytes: The total size of those input files, estimated from a
+                     sample of sample_size files.
+
+        The input files are only counted if inputs is True, as that looks
+        at every file of the input DataSets.
+
+        """
+
+        looper = ArgumentCreator(self.inputlist, self.file_creator, self.merge_output)
+        joined = list(looper.all_combinations)
+        combinations = len(joined)
+
+        # Output attributes that are not shared with the inputs give
+        # one command for each of their values.
+        per_combination = 1
+        for cons in self.file_creator.constraints:
+            if cons.key not in looper.all_names:
+                per_combination *= len(cons.values)
+        commands = combinations * per_combination
+
+        stats = {'combinations': combinations,
+                 'commands': commands,
+                 'output_files': commands}
+        if not inputs:
+            return stats
+
+        input_paths = []
+        for ds in self.inputlist:
+            input_paths.extend(planned_inputs(ds, looper.all_names, joined,
+                                              self.file_creator.constraints))
+
+        stats['input_files'] = len(input_paths)
+        stats['input_bytes'] = estimate_bytes(input_paths, sample_size)
+
+        return stats
 
     def apply_keyword_args(self, command_list, kw_cons_dict, prefix='--'):
         """ Add keywords from the keyword constraint dictionary to the command list."""
@@ -388,6 +612,130 @@ class ProcessUnit(object):
         return in_files, out_file
 
 
+def up_to_date(in_files, out_files, input_mtimes=None):
+    """ Return True if every output file exists and is newer than every input.
+
+    input_mtimes is a dictionary to cache the modification times of the inputs in.
+
+    """
+
+    if not out_files:
+        return False
+    if input_mtimes is None:
+        input_mtimes = {}
+
+    try:
+        oldest_output = min(os.path.getmtime(out_file) for out_file in out_files)
+    except OSError:
+        return False
+
+    for in_file in in_files:
+        try:
+            in_mtime = input_mtimes[in_file]
+        except KeyError:
+            try:
+                in_mtime = os.path.getmtime(in_file)
+            except OSError:
+                return False
+            input_mtimes[in_file] = in_mtime
+        if in_mtime > oldest_output:
+            return False
+
+    return True
+
+
+def close_cache(cache, to_cache):
+    """ Close a ResultCache, removing the staged outputs that were not stored."""
+
+    for _, _, staged_dir in to_cache:
+        cache.discard(staged_dir)
+    cache.close()
+
+
+def cached_fingerprint(path, fingerprints, cache=None):
+    """ Return the fingerprint of a file, keeping it in the fingerprints dictionary.
+
+    If there is a ResultCache, its stored fingerprints are used.
+
+    """
+
+    try:
+        return fingerprints[path]
+    except KeyError:
+        if cache:
+            fingerprint = cache.fingerprint(path)
+        else:
+            fingerprint = file_fingerprint(path)
+        fingerprints[path] = fingerprint
+        return fingerprint
+
+
+def planned_inputs(dataset, names, combinations, out_constraints=()):
+    """ Return the paths of the files in a DataSet's attribute store
+
+    that match at least one of the combinations of values of names,
+    and have values allowed by the output constraints.
+
+    """
+
+    store = getattr(dataset, 'store', None)
+    if store is None:
+        return []
+
+    # The positions in each combination and in the store rows of
+    # the names this DataSet has, possibly under an alias.
+    alias_map = getattr(dataset, 'alias_map', {})
+    positions = []
+    for i, name in enumerate(names):
+        name = alias_map.get(name, name)
+        if name in store.att_names:
+            positions.append((i, store.att_names.index(name)))
+
+    wanted = set(tuple(combination[i] for i, _ in positions)
+                 for combination in combinations)
+
+    allowed = [(store.att_names.index(cons.key), cons.values)
+               for cons in out_constraints
+               if cons.key not in names and cons.key in store.att_names]
+
+    paths = []
+    for file_id in sorted(store.path_ids.values()):
+        row = store.row(file_id)
+        if (tuple(row[j] for _, j in positions) in wanted and
+                all(row[j] in values for j, values in allowed)):
+            paths.append(store.paths[file_id])
+
+    return paths
+
+
+def estimate_bytes(paths, sample_size=100):
+    """ Estimate the total size of a list of files from an even sample of them.
+
+    Files that do not exist (yet) are left out of the sample.
+
+    """
+
+    if not paths:
+        return 0
+
+    step = max(1, len(paths) // sample_size)
+    sizes = []
+    for path in paths[::step]:
+        try:
+            sizes.append(os.path.getsize(path))
+        except OSError:
+            continue
+
+    if not sizes:
+        return 0
+
+    return int(float(sum(sizes)) / len(sizes) * len(paths))
+
+
 # Exception Classes
 class EmptyOverwriteError(Exception):
     pass
+
+
+class TooManyCommandsError(Exception):
+    pass
@@ -0,0 +1,355 @@
+"""
+Authors: Tim Bedin, Tim Erwin
+
+Copyright 2014 CSIRO
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Contains the ResultCache class.
+
+"""
+
+import os
+import time
+import pipes
+import shutil
+import sqlite3
+import hashlib
+import logging
+import tempfile
+
+from cwsl.configuration import configuration
+from cwsl.core.scheduler import make_dirs
+
+
+module_logger = logging.getLogger('cwsl.core.result_cache')
+
+
+class ResultCache(object):
+    """ A shared cache of the output files of ProcessUnit commands.
+
+    Results are keyed by a hash of the command line, with the input
+    files replaced by fingerprints of their contents and the output
+    files by their position. The same command run on the same inputs
+    by another user, writing to a different directory, has the same key.
+
+    The cached outputs are kept in cache_dir, and a SQLite database
+    there records their size and when they were last used. When the
+    cache grows past max_bytes, the least recently used results are
+    removed. The number of hits, misses, stores and evictions are
+    counted in the database too, for the report.
+
+    Cached outputs are copied into place, never linked, so changing an
+    output (e.g. with ncatted) does not change the cached result. The
+    outputs are staged before they are annotated, so the cache holds
+    them as the command wrote them, and each fetch is annotated afresh.
+
+    The fingerprints of input files are kept in the database too, with
+    the size and modification time of the file, so a file is only read
+    again when it has changed.
+
+    """
+
+    def __init__(self, cache_dir, max_bytes=100*1024**3):
+        """ Arguments:
+
+        cache_dir: The directory to keep the cache in. It is created
+                   if it does not exist.
+
+        max_bytes: The size the cache is kept under.
+
+        """
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+        make_dirs(os.path.join(cache_dir, 'objects'))
+        make_dirs(os.path.join(cache_dir, 'staging'))
+
+        self.connection = sqlite3.connect(os.path.join(cache_dir, 'cache.db'),
+                                          timeout=60)
+        self.connection.text_factory = str
+
+        with self.connection:
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS results
+                                       (key TEXT PRIMARY KEY,
+                                        nfiles INTEGER,
+                                        size INTEGER,
+                                        last_used REAL)""")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS counts
+                                       (name TEXT PRIMARY KEY,
+                                        count INTEGER)""")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS fingerprints
+                                       (path TEXT PRIMARY KEY,
+                                        size INTEGER,
+                                        mtime REAL,
+                                        fingerprint TEXT)""")
+
+    def result_dir(self, key):
+        return os.path.join(self.cache_dir, 'objects', key[:2], key)
+
+    def fingerprint(self, path):
+        """ Return the fingerprint of the contents of a file, or None
+        if it can't be read.
+
+        The file is only read if its size or modification time has
+        changed since its fingerprint was stored.
+
+        """
+
+        real_path = os.path.realpath(path)
+        try:
+            file_stat = os.stat(real_path)
+        except OSError:
+            return None
+
+        row = self.connection.execute("SELECT size, mtime, fingerprint FROM fingerprints "
+                                      "WHERE path = ?", (real_path,)).fetchone()
+        if row and row[0] == file_stat.st_size and row[1] == file_stat.st_mtime:
+            return row[2]
+
+        fingerprint = file_fingerprint(real_path)
+        if fingerprint is not None:
+            with self.connection:
+                self.connection.execute("INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?)",
+                                        (real_path, file_stat.st_size, file_stat.st_mtime,
+                                         fingerprint))
+
+        return fingerprint
+
+    def fetch(self, key, out_files):
+        """ Put the cached outputs for a key in place, as out_files.
+
+        The outputs are copied, so the cached result can't be changed
+        through them. Returns True on a hit, or False if the result is
+        not cached.
+
+        """
+
+        row = self.connection.execute("SELECT nfiles FROM results WHERE key = ?",
+                                      (key,)).fetchone()
+        if not row or row[0] != len(out_files):
+            self.count('misses')
+            return False
+
+        result_dir = self.result_dir(key)
+        try:
+            for i, out_file in enumerate(out_files):
+                make_dirs(os.path.dirname(out_file))
+                copy_file(os.path.join(result_dir, str(i)), out_file)
+        except (IOError, OSError), e:
+            module_logger.warning("Could not fetch cached result {0}: {1}"
+                                  .format(key, e))
+            self.count('misses')
+            return False
+
+        with self.connection:
+            self.connection.execute("UPDATE results SET last_used = ? WHERE key = ?",
+                                    (time.time(), key))
+        self.count('hits')
+
+        return True
+
+    def stage(self, out_files):
+        """ Make a staging directory for the outputs of a command.
+
+        Returns the directory and a command that copies out_files into
+        it. The command is run as soon as the outputs are created, before
+        they are annotated, and the directory is passed to store.
+
+        """
+
+        staged_dir = tempfile.mkdtemp(dir=os.path.join(self.cache_dir, 'staging'))
+
+        copy_cmd = []
+        for i, out_file in enumerate(out_files):
+            copy_cmd += ['cp', '-p', pipes.quote(out_file),
+                         pipes.quote(os.path.join(staged_dir, str(i))), '&&']
+        # A failed copy only means the result is not cached.
+        copy_cmd[-1:] = ['||', 'true']
+
+        return staged_dir, copy_cmd
+
+    def discard(self, staged_dir):
+        """ Remove a staging directory that is not stored. """
+
+        shutil.rmtree(staged_dir, ignore_errors=True)
+
+    def store(self, key, out_files, staged_dir=None):
+        """ Add the outputs of a command to the cache.
+
+        If staged_dir is given, it holds the copies of out_files made by
+        the command from stage, and it is moved into the cache. Otherwise
+        out_files are copied.
+
+        """
+
+        if self.connection.execute("SELECT 1 FROM results WHERE key = ?",
+                                   (key,)).fetchone():
+            if staged_dir:
+                self.discard(staged_dir)
+            return
+
+        result_dir = self.result_dir(key)
+        make_dirs(os.path.dirname(result_dir))
+
+        # Fill a temporary directory, then move it into place, so that
+        # a half stored result is never used. The outputs are copied, so
+        # later changes to them do not change the cache.
+        temp_dir = staged_dir or tempfile.mkdtemp(dir=os.path.dirname(result_dir))
+        try:
+            size = 0
+            for i, out_file in enumerate(out_files):
+                temp_file = os.path.join(temp_dir, str(i))
+                if not staged_dir:
+                    shutil.copy2(out_file, temp_file)
+                size += os.path.getsize(temp_file)
+            os.rename(temp_dir, result_dir)
+        except (IOError, OSError), e:
+            module_logger.warning("Could not cache result {0}: {1}".format(key, e))
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            return
+
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                                    (key, len(out_files), size, time.time()))
+        self.count('stores')
+
+        self.evict()
+
+    def evict(self):
+        """ Remove the least recently used results until the cache
+        is no bigger than max_bytes.
+
+        """
+
+        total = self.total_bytes()
+        if total <= self.max_bytes:
+            return
+
+        oldest = self.connection.execute("SELECT key, size FROM results ORDER BY last_used")
+        to_remove = []
+        for key, size in oldest:
+            if total <= self.max_bytes:
+                break
+            to_remove.append(key)
+            total -= size
+
+        for key in to_remove:
+            with self.connection:
+                self.connection.execute("DELETE FROM results WHERE key = ?", (key,))
+            shutil.rmtree(self.result_dir(key), ignore_errors=True)
+            self.count('evictions')
+
+    def total_bytes(self):
+        return self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    def count(self, name):
+        with self.connection:
+            self.connection.execute("INSERT OR IGNORE INTO counts VALUES (?, 0)", (name,))
+            self.connection.execute("UPDATE counts SET count = count + 1 WHERE name = ?",
+                                    (name,))
+
+    def stats(self):
+        """ Return a dictionary of the cache statistics. """
+
+        stats = dict.fromkeys(['hits', 'misses', 'stores', 'evictions'], 0)
+        stats.update(self.connection.execute("SELECT name, count FROM counts"))
+        stats['results'] = self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        stats['bytes'] = self.total_bytes()
+        stats['max_bytes'] = self.max_bytes
+
+        return stats
+
+    def report(self):
+        """ Return a summary of the cache statistics as a string. """
+
+        stats = self.stats()
+        lookups = stats['hits'] + stats['misses']
+        hit_rate = 100.0 * stats['hits'] / lookups if lookups else 0.0
+
+        return ("Result cache {0}: {1} results, {2:.1f} of {3:.1f} GB used. "
+                "{4} hits, {5} misses ({6:.1f}% hit rate), {7} stored, {8} evicted."
+                .format(self.cache_dir, stats['results'], stats['bytes'] / 1024.0**3,
+                        stats['max_bytes'] / 1024.0**3, stats['hits'], stats['misses'],
+                        hit_rate, stats['stores'], stats['evictions']))
+
+    def close(self):
+        """ Close the connection to the database. """
+
+        self.connection.close()
+
+
+def cache_key(command_list, in_files, out_files, fingerprints):
+    """ Return the cache key of a command, or None if the command
+    can't be cached because an input has no fingerprint (e.g. it
+    has not been created yet).
+
+    fingerprints: A dictionary of input file -> content fingerprint.
+
+    """
+
+    if any(fingerprints.get(in_file) is None for in_file in in_files):
+        return None
+
+    replacements = dict((in_file, fingerprints[in_file]) for in_file in in_files)
+    for i, out_file in enumerate(out_files):
+        # Scripts may choose the output format from the extension.
+        replacements[out_file] = '%output_{0}{1}%'.format(i, os.path.splitext(out_file)[1])
+
+    key_parts = [replacements.get(str(arg), str(arg)) for arg in command_list]
+
+    return hashlib.sha1('\0'.join(key_parts)).hexdigest()
+
+
+def file_fingerprint(path, block_size=1024*1024):
+    """ Return a hash of the contents of a file, or None if it can't be read."""
+
+    file_hash = hashlib.sha1()
+    try:
+        with open(path, 'rb') as in_file:
+            for block in iter(lambda: in_file.read(block_size), b''):
+                file_hash.update(block)
+    except IOError:
+        return None
+
+    return file_hash.hexdigest()
+
+
+def copy_file(source, destination):
+    """ Copy source to destination, replacing rather than writing through
+    any existing file or link at destination.
+
+    """
+
+    if os.path.lexists(destination):
+        os.remove(destination)
+
+    shutil.copy2(source, destination)
+
+
+def configured_cache(options=None):
+    """ Return the ResultCache set in the execution options or the configuration,
+
+    or None if no cache is configured.
+
+    """
+
+    options = options or {}
+
+    cache_dir = options.get('result_cache', getattr(configuration, 'result_cache_dir', ''))
+    if not cache_dir:
+        return None
+
+    max_gb = options.get('result_cache_max_gb',
+                         getattr(configuration, 'result_cache_max_gb', 100))
+
+    return ResultCache(os.path.expandvars(cache_dir), int(max_gb * 1024**3))
@@ -23,6 +23,14 @@ from textwrap import dedent
 import tempfile
 import subprocess
 import logging
+import re
+import time
+import errno
+import threading
+import multiprocessing
+import Queue
+
+from cwsl.configuration import configuration
 
 log = logging.getLogger('cwsl.core.scheduler')
 
@@ -40,6 +48,12 @@ class Job(object):
         self.cmds = []
         self.outdirs = set()
 
+        # The files the commands create, and the exit status and
+        # output of the last time the Job was run.
+        self.out_files = []
+        self.returncode = None
+        self.output = None
+
     def add_pre_cmd(self, args):
         """Add a command to the list of commands to be executed by the Job.
 
@@ -127,12 +141,16 @@ class SimpleJob(Job):
 
             args = ['sh', script_name]
 
+            output = ''
             try:
                 output = subprocess.check_output(args, stderr=subprocess.STDOUT)
+                self.returncode = 0
             except subprocess.CalledProcessError, e:
                 output = e.output
+                self.returncode = e.returncode
                 raise
             finally:
+                self.output = output
                 # For now, print output to console as well.
                 print(output)
                 os.remove(script_name)
@@ -141,19 +159,50 @@ class AbstractExecManager(object):
 
     __metaclass__ = abc.ABCMeta
 
+    # Whether the commands have run by the time submit returns.
+    # Batch managers only queue them.
+    runs_on_submit = True
+
     def __init__(self, verbose, noexec):
         self.noexec = noexec
         self.verbose = verbose
 
+    @classmethod
+    def from_options(cls, noexec, options):
+        """Create an exec manager from a dictionary of execution options."""
+        return cls(noexec=noexec)
+
     def add_dep(self, task, dep):
         task.add_dep(dep)
 
+    @property
+    def failed_files(self):
+        """The output files of the commands that failed."""
+        return set()
+
+    def add_job_deps(self, job_ids):
+        """Wait for the batch jobs with these ids before running.
+
+        Other managers run their commands before submit returns, so there
+        is nothing to wait for.
+        """
+        pass
+
     def add_pre_cmd(self, job, allargs):
         job.add_pre_cmd(allargs)
 
     def queue_cmd(self, job, allargs):
         job.queue_cmd(allargs)
 
+    def cancel(self):
+        """Give up on the commands that have not started, e.g. because
+        building the rest of the commands failed.
+
+        Only managers that run commands as they are added have anything
+        to stop.
+        """
+        pass
+
     @abc.abstractmethod
     def new_task(self, exec_node, ratio_unique=1.0, dep=None):
         raise NotImplementedException
@@ -164,6 +213,15 @@ class AbstractExecManager(object):
 
 
 class SimpleExecManager(AbstractExecManager):
+    """Writes every command into one SimpleJob script, which is run
+    when planning is finished.
+
+    The script runs with set -e, so the first failed command stops the
+    commands after it, and failed commands are not retried or reported
+    in failed_files. Use the StreamingExecManager or ParallelExecManager
+    to run each command on its own, with retries.
+
+    """
 
     def __init__(self, verbose=False, noexec=False):
         super(SimpleExecManager, self).__init__(verbose, noexec)
@@ -186,25 +244,51 @@ class SimpleExecManager(AbstractExecManager):
         for path in python_paths:
             self.add_pre_cmd(self.job,['export','PYTHONPATH=$PYTHONPATH:%s' % path])
 
-    def add_cmd(self, cmd_list, out_files, annotation=None):
+    def add_cmd(self, cmd_list, out_files, annotation=None, on_success=None,
+                on_created=None):
+        """Add a command that creates out_files.
+
+        on_created is a command to run once the command has succeeded,
+        before the outputs are annotated. on_success is a command to run
+        once the command and its annotation have succeeded.
+
+        If cmd_list is None, the out_files already exist (e.g. they were
+        fetched from a cache), and only their annotation is run.
+        """
         self._out_files = out_files
+        self.queue_commands(self.job, cmd_list, out_files, annotation,
+                            on_success, on_created)
+
+    def queue_commands(self, job, cmd_list, out_files, annotation=None,
+                       on_success=None, on_created=None):
+        """Queue a command, and the commands that go with it, on a job."""
+
         for ofile in out_files:
-            self.job.outdirs.add(os.path.dirname(ofile))
+            job.outdirs.add(os.path.dirname(ofile))
+
+        if cmd_list is not None:
+            self.queue_cmd(job, cmd_list)
 
-        self.queue_cmd(self.job, cmd_list)
+        if on_created:
+            self.queue_cmd(job, on_created)
 
-        # If there is an annotation, add a second job that annotates the outfile.
+        # If there is an annotation, annotate the outfiles.
         if annotation:
-            self.add_annotation(annotation, out_files)
+            self.add_annotation(annotation, out_files, job=job)
+
+        if on_success:
+            self.queue_cmd(job, on_success)
 
-    def add_annotation(self, annotation, out_files):
+    def add_annotation(self, annotation, out_files, job=None):
         """ Annotate the vistrails_history metadata tag with an annotation string."""
-        self.add_module_deps(['nco'])
+        if job is None:
+            job = self.job
+        self.add_pre_cmd(job, ['module', 'load', 'nco'])
         att_desc = 'vistrails_history,global,a,c,"' + annotation + '"'
         for out_file in out_files:
             if os.path.splitext(out_file)[1] in ['.nc', '.NC']:
                 annotate_list = ['ncatted', '-O', '-a', att_desc, out_file]
-                self.queue_cmd(self.job, annotate_list)
+                self.queue_cmd(job, annotate_list)
             else:
                 log.warning("Not annotating file '%s' - not NetCDF" % out_file)
 
@@ -225,3 +309,496 @@ class SimpleExecManager(AbstractExecManager):
 
     def new_task(self, exec_node, ratio_unique=1.0, dep=None):
         raise NotImplementedException
+
+
+class StreamingExecManager(SimpleExecManager):
+    """Runs each command as soon as it is added, rather than writing
+    every command into one script that runs when planning is finished.
+
+    Each command becomes a small SimpleJob of its own - the environment
+    set up so far, the command and its annotation - which is put on a
+    bounded queue and run by a worker thread. When the queue is full,
+    add_cmd blocks until the workers catch up, so planning the next
+    commands and running the current ones overlap without holding the
+    whole script in memory.
+
+    Each command is run on its own, so a failed command does not stop
+    the others. A failed command is retried up to retries times, waiting
+    retry_delay seconds before the first retry and twice as long before
+    each one after that. Commands that still fail are kept in
+    failed_tasks, with their exit status and output. If stop_on_error is
+    set, the first failure stops the run instead, like set -e in the
+    SimpleJob script: commands that have not started are not run, and
+    the error is raised from add_cmd or submit.
+
+    """
+
+    def __init__(self, verbose=False, noexec=False, queue_size=100, workers=1,
+                 retries=0, retry_delay=1.0, stop_on_error=False):
+        super(StreamingExecManager, self).__init__(verbose, noexec)
+
+        self.tasks = Queue.Queue(maxsize=queue_size)
+        self.submitted = 0
+        self.completed = 0
+        self.failed_tasks = []
+        self.error = None
+        self.cancelled = False
+        self.stopped = False
+        self.lock = threading.Lock()
+
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.stop_on_error = stop_on_error
+
+        self.workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self.run_tasks,
+                                      name='%s-%d' % (self.__class__.__name__, i))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    @classmethod
+    def from_options(cls, noexec, options):
+        """Create the manager, with the queue_size and the retry policy
+        from the execution options.
+        """
+        return cls(noexec=noexec,
+                   queue_size=options.get('queue_size', 100),
+                   **retry_options(options))
+
+    @property
+    def failed_files(self):
+        return set(out_file for task in self.failed_tasks
+                   for out_file in task.out_files)
+
+    def add_cmd(self, cmd_list, out_files, annotation=None, on_success=None,
+                on_created=None):
+        self.check_error()
+
+        self._out_files = out_files
+
+        # The environment is set up before the commands are added,
+        # so each task starts from a copy of it.
+        task = SimpleJob()
+        task.out_files = list(out_files)
+        for precmd in self.job.precmds:
+            self.add_pre_cmd(task, precmd)
+
+        self.queue_commands(task, cmd_list, out_files, annotation,
+                            on_success, on_created)
+
+        # Blocks while the queue is full.
+        self.tasks.put(task)
+        self.submitted += 1
+
+    def run_tasks(self):
+        """Run the queued tasks until the end of the queue is reached."""
+
+        while True:
+            task = self.tasks.get()
+            try:
+                if task is None:
+                    return
+                if self.error is None and not self.cancelled:
+                    failure = self.run_task(task)
+                    with self.lock:
+                        if failure is None:
+                            self.completed += 1
+                        else:
+                            self.failed_tasks.append(task)
+                    if failure is not None:
+                        log.error("Command failed with exit status %s: %s"
+                                  % (task.returncode, ' '.join(task.cmds[0])))
+                        if self.stop_on_error:
+                            self.error = failure
+            except Exception, e:
+                log.error("Command could not be run: %s" % ' '.join(task.cmds[0]))
+                self.error = e
+            finally:
+                self.tasks.task_done()
+
+    def run_task(self, task):
+        """Run a single task, retrying it if it fails.
+
+        Returns None if the task succeeded, or else the error of its last try.
+
+        """
+
+        if not self.noexec:
+            # Other tasks may be making the same directories.
+            for out_dir in task.outdirs:
+                make_dirs(out_dir)
+            task.outdirs = set()
+
+        delay = self.retry_delay
+        for attempt in range(self.retries + 1):
+            if attempt:
+                log.warning("Retrying (%d of %d): %s"
+                            % (attempt, self.retries, ' '.join(task.cmds[0])))
+                time.sleep(delay)
+                delay *= 2
+            try:
+                task.submit(noexec=self.noexec)
+                return None
+            except subprocess.CalledProcessError, e:
+                failure = e
+
+        return failure
+
+    def check_error(self):
+        """Raise the error of a failed command, if there was one."""
+
+        if self.error is not None:
+            raise self.error
+
+    def stop_workers(self):
+        """Wait for the workers to reach the end of the queue and stop."""
+
+        if self.stopped:
+            return
+        self.stopped = True
+
+        for worker in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join()
+
+    def cancel(self):
+        """Stop the workers. Commands that are running are finished,
+        but the queued commands are not run.
+        """
+
+        self.cancelled = True
+        self.stop_workers()
+
+    def submit(self):
+        """Wait for the queued commands to finish."""
+
+        self.stop_workers()
+        self.check_error()
+
+
+class ParallelExecManager(StreamingExecManager):
+    """Runs the commands on a pool of workers, each of which runs
+    one command at a time in its own shell.
+
+    Every command gets the same environment set up (module loads and
+    exported variables) that the SimpleJob script would have given it.
+    The number of workers is the workers execution option, or the
+    configured exec_workers, or else the number of CPUs.
+
+    """
+
+    def __init__(self, verbose=False, noexec=False, queue_size=None, workers=None,
+                 **kwargs):
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        if queue_size is None:
+            queue_size = 4 * workers
+        super(ParallelExecManager, self).__init__(verbose, noexec,
+                                                  queue_size=queue_size,
+                                                  workers=workers, **kwargs)
+
+    @classmethod
+    def from_options(cls, noexec, options):
+        """Create the manager, with the number of workers from the execution
+        options or the configuration.
+        """
+
+        workers = (options.get('workers') or
+                   getattr(configuration, 'exec_workers', 0) or
+                   None)
+        return cls(noexec=noexec, queue_size=options.get('queue_size'),
+                   workers=workers, **retry_options(options))
+
+
+class BatchJob(Job):
+    """A job array for a PBS batch queue.
+
+    Each task of the array runs one of a list of task scripts, chosen by
+    the array index. The job can depend on other batch jobs, so it only
+    starts once they have finished successfully.
+    """
+
+    __header = """
+               #!/bin/sh
+               #PBS -N %(name)s
+               """
+
+    # The job array option and index variable of PBS Pro.
+    array_option = '-J'
+    index_variable = 'PBS_ARRAY_INDEX'
+
+    def __init__(self, name='cwsl', resources=None, **kwargs):
+        super(BatchJob, self).__init__(**kwargs)
+
+        self.name = name
+        self.resources = dict(resources or {})
+        self.deps = []
+        self.job_id = None
+
+    def add_dep(self, dep):
+        """Add the id of a batch job that this job must wait for."""
+
+        if dep and dep not in self.deps:
+            self.deps.append(dep)
+
+    def to_str(self, task_dir=None, ntasks=1):
+        """Return the job array script, which runs the task scripts
+        (task_0.sh, task_1.sh, ...) in task_dir.
+        """
+
+        lines = [dedent(self.__header).strip() % {'name': self.name}]
+        for resource in sorted(self.resources):
+            value = self.resources[resource]
+            if resource == 'queue':
+                lines.append('#PBS -q %s' % value)
+            elif resource == 'project':
+                lines.append('#PBS -P %s' % value)
+            else:
+                lines.append('#PBS -l %s=%s' % (resource, value))
+        # Arrays must have more than one task.
+        if ntasks > 1:
+            lines.append('#PBS %s 0-%d' % (self.array_option, ntasks - 1))
+
+        task_script = os.path.join(task_dir or '.', 'task_${%s:-0}.sh' % self.index_variable)
+        lines.append('')
+        lines.append('sh %s' % task_script)
+
+        return '\n'.join(lines) + '\n'
+
+
+class PBSExecManager(SimpleExecManager):
+    """Submits the commands to a PBS batch queue as a job array.
+
+    The commands are packed into array tasks, so that each task should
+    run for about walltime seconds, given the estimated runtime of a
+    single command. Each task is a script like the SimpleJob script.
+
+    The job id is kept in job_id. A later ProcessUnit whose inputs come
+    from this one passes the id to add_job_deps, so its job waits in the
+    queue until this one has finished.
+
+    qsub and qstat can be replaced by stand-ins for testing.
+
+    """
+
+    runs_on_submit = False
+
+    def __init__(self, verbose=False, noexec=False, job_dir=None,
+                 command_runtime=60, walltime=3600, max_array_size=1000,
+                 resources=None, name='cwsl', qsub='qsub', qstat='qstat'):
+        # self.job holds the environment set up shared by every task.
+        super(PBSExecManager, self).__init__(verbose, noexec)
+
+        self.batch_job = self.new_task(None, resources=resources, name=name)
+        # A list of SimpleJobs, one for each command and its annotation.
+        self.command_groups = []
+
+        self.job_dir = job_dir
+        self.command_runtime = command_runtime
+        self.walltime = walltime
+        self.max_array_size = max_array_size
+        self.qsub = qsub
+        self.qstat = qstat
+
+    @classmethod
+    def from_options(cls, noexec, options):
+        """Create the manager from the execution options and the configuration."""
+
+        resources = dict(options.get('resources', {}))
+        for resource, config_name in [('queue', 'batch_queue'),
+                                      ('project', 'batch_project')]:
+            value = options.get(resource, getattr(configuration, config_name, ''))
+            if value:
+                resources[resource] = value
+
+        return cls(noexec=noexec,
+                   job_dir=options.get('job_dir', getattr(configuration, 'batch_job_dir', '')) or None,
+                   command_runtime=options.get('command_runtime', 60),
+                   walltime=options.get('walltime', 3600),
+                   max_array_size=options.get('max_array_size', 1000),
+                   resources=resources,
+                   qsub=options.get('qsub', 'qsub'),
+                   qstat=options.get('qstat', 'qstat'))
+
+    @property
+    def job_id(self):
+        return self.batch_job.job_id
+
+    def new_task(self, exec_node, ratio_unique=1.0, dep=None, **kwargs):
+        task = BatchJob(**kwargs)
+        if dep:
+            self.add_dep(task, dep)
+        return task
+
+    def add_dep(self, task, dep):
+        task.add_dep(dep)
+
+    def add_job_deps(self, job_ids):
+        for job_id in job_ids:
+            self.add_dep(self.batch_job, job_id)
+
+    def add_cmd(self, cmd_list, out_files, annotation=None, on_success=None,
+                on_created=None):
+        self._out_files = out_files
+
+        group = SimpleJob()
+        self.queue_commands(group, cmd_list, out_files, annotation,
+                            on_success, on_created)
+
+        self.command_groups.append(group)
+
+    def chunk_size(self):
+        """The number of commands to run in each array task."""
+
+        size = max(1, int(self.walltime // max(self.command_runtime, 1)))
+        ntasks = -(-len(self.command_groups) // size)
+        if ntasks > self.max_array_size:
+            size = -(-len(self.command_groups) // self.max_array_size)
+
+        return size
+
+    def task_jobs(self):
+        """Pack the commands into one SimpleJob for each array task."""
+
+        size = self.chunk_size()
+
+        tasks = []
+        for start in range(0, len(self.command_groups), size):
+            task = SimpleJob()
+            for precmd in self.job.precmds:
+                self.add_pre_cmd(task, precmd)
+            for group in self.command_groups[start:start + size]:
+                for precmd in group.precmds:
+                    self.add_pre_cmd(task, precmd)
+                task.cmds.extend(group.cmds)
+                task.outdirs.update(group.outdirs)
+            if task.outdirs:
+                task.add_pre_cmd(['mkdir', '-p'] + sorted(task.outdirs))
+            tasks.append(task)
+
+        return tasks
+
+    def submit(self):
+        """Write the task scripts and the job array script, then submit
+        the job with qsub.
+        """
+
+        tasks = self.task_jobs()
+        if not tasks:
+            log.warning("No commands to submit.")
+            return
+
+        # The walltime must cover a whole task.
+        walltime = max(self.walltime, self.chunk_size() * self.command_runtime)
+        if 'walltime' not in self.batch_job.resources:
+            self.batch_job.resources['walltime'] = format_walltime(walltime)
+
+        if self.noexec:
+            log.warning("Would submit job:\n\n========>\n%s\n<========\n\n"
+                        % self.batch_job.to_str(self.job_dir, len(tasks)))
+            return
+
+        if self.job_dir:
+            make_dirs(self.job_dir)
+        # The scripts must stay until the job has run.
+        task_dir = tempfile.mkdtemp(prefix='cwsl_job_', dir=self.job_dir)
+        for i, task in enumerate(tasks):
+            with open(os.path.join(task_dir, 'task_%d.sh' % i), 'w') as task_file:
+                task_file.write(task.to_str() + '\n')
+
+        script_name = os.path.join(task_dir, 'job.sh')
+        with open(script_name, 'w') as script_file:
+            script_file.write(self.batch_job.to_str(task_dir, len(tasks)))
+
+        args = [self.qsub]
+        if self.batch_job.deps:
+            args += ['-W', 'depend=afterok:' + ':'.join(self.batch_job.deps)]
+        args.append(script_name)
+
+        output = subprocess.check_output(args)
+        self.batch_job.job_id = output.strip()
+        log.info("Submitted job %s with %d tasks" % (self.job_id, len(tasks)))
+
+    def status(self):
+        """Return the PBS state of the job (e.g. Q, R or F),
+        or None if the queue no longer knows about it.
+        """
+
+        if not self.job_id:
+            return None
+
+        try:
+            output = subprocess.check_output([self.qstat, '-f', self.job_id],
+                                             stderr=subprocess.STDOUT)
+        except subprocess.CalledProcessError:
+            return None
+
+        found = re.search(r"job_state = (\w)", output)
+        if found:
+            return found.group(1)
+
+        return None
+
+    def wait(self, poll_interval=30):
+        """Wait until the job has finished."""
+
+        while self.status() not in (None, 'F'):
+            time.sleep(poll_interval)
+
+
+def retry_options(options):
+    """The retry policy in a dictionary of execution options."""
+
+    return {'retries': options.get('retries', 0),
+            'retry_delay': options.get('retry_delay', 1.0),
+            'stop_on_error': options.get('stop_on_error', False)}
+
+
+def format_walltime(seconds):
+    """Format a number of seconds as a PBS walltime, HH:MM:SS."""
+
+    seconds = int(seconds)
+    return '%02d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def make_dirs(dir_path):
+    """Make a directory and its parents, if they do not already exist.
+
+    Safe to call from many workers at once.
+
+    """
+
+    if not dir_path:
+        return
+
+    try:
+        os.makedirs(dir_path)
+    except OSError, e:
+        if e.errno != errno.EEXIST or not os.path.isdir(dir_path):
+            raise
+
+
+# The exec managers that can be chosen in the configuration or the
+# execution options, by name.
+EXEC_MANAGERS = {'SimpleExecManager': SimpleExecManager,
+                 'StreamingExecManager': StreamingExecManager,
+                 'ParallelExecManager': ParallelExecManager,
+                 'PBSExecManager': PBSExecManager}
+
+
+def get_exec_manager(name, noexec=False, options=None):
+    """Create the exec manager with the given name."""
+
+    try:
+        manager_class = EXEC_MANAGERS[name]
+    except KeyError:
+        raise UnknownExecManagerError("Unknown execution manager: %s" % name)
+
+    return manager_class.from_options(noexec, options or {})
+
+
+class UnknownExecManagerError(Exception):
+    pass
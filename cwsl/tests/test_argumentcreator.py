@@ -127,6 +127,35 @@ class TestArgumentCreator(unittest.TestCase):
         self.assertEqual(len(outputs), 2)
 
 
+    def test_joined_combinations(self):
+        """ Test that only the shared combinations with files are planned."""
+
+        institute_model_pattern = "/fake/%variable%_%model%_%institute%.file"
+        in_constraints = [Constraint('model', ['model_1', 'model_2', 'model_3']),
+                          Constraint('variable', ['variable_1']),
+                          Constraint('institute', ['institute_1', 'institute_2'])]
+        test_filecreator = FileCreator(institute_model_pattern, in_constraints)
+        test_filecreator.get_files({'model': 'model_1',
+                                    'institute': 'institute_2'}, update=True)
+        test_filecreator.get_files({'model': 'model_3',
+                                    'institute': 'institute_1'}, update=True)
+
+        output_pattern = "/an/output/%variable%_%model%_%institute%.file"
+        test_output_filecreator = FileCreator(output_pattern, in_constraints)
+
+        test_argument_creator = ArgumentCreator([test_filecreator],
+                                                test_output_filecreator)
+
+        planned = [dict(zip(test_argument_creator.all_names, combination))
+                   for combination in test_argument_creator.all_combinations]
+
+        # Two of the six combinations of values have files.
+        self.assertEqual(len(planned), 2)
+        self.assertIn({'variable': 'variable_1', 'model': 'model_1',
+                       'institute': 'institute_2'}, planned)
+        self.assertIn({'variable': 'variable_1', 'model': 'model_3',
+                       'institute': 'institute_1'}, planned)
+
     def test_two_inputs(self):
         """ Test that the ArgumentCreator works with multiple input datasets."""
 
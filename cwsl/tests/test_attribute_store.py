@@ -0,0 +1,126 @@
+"""
+Authors: Tim Bedin, Tim Erwin
+
+Copyright 2014 CSIRO
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Tests for the AttributeStore class.
+
+"""
+
+import logging
+import unittest
+
+from cwsl.core.attribute_store import AttributeStore
+
+
+module_logger = logging.getLogger('cwsl.tests.test_attribute_store')
+
+
+class TestAttributeStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store = AttributeStore(['colour', 'animal'])
+        self.store.add('/fake/green_echidna.txt', ['green', 'echidna'])
+        self.store.add('/fake/blue_kangaroo.txt', ['blue', 'kangaroo'])
+        self.store.add('/fake/red_kangaroo.txt', ['red', 'kangaroo'])
+        self.store.add('/fake/green_kangaroo.txt', ['green', 'kangaroo'])
+
+    def test_encoding(self):
+        """ Each distinct value should be stored once, with a code per file. """
+
+        self.assertEqual(len(self.store), 4)
+        self.assertEqual(self.store.values['animal'], ['echidna', 'kangaroo'])
+        self.assertEqual(list(self.store.columns['animal']), [0, 1, 1, 1])
+        self.assertEqual(self.store.row(3), ('green', 'kangaroo'))
+        self.assertEqual(self.store.atts(0),
+                         {'colour': 'green', 'animal': 'echidna'})
+
+    def test_repeated_path(self):
+        """ Adding a path twice should return the existing id. """
+
+        self.assertEqual(self.store.add('/fake/red_kangaroo.txt', ['red', 'kangaroo']), 2)
+        self.assertEqual(len(self.store), 4)
+
+    def test_find(self):
+        """ find should return the ids of the files with every requested value. """
+
+        self.assertEqual(self.store.find({'animal': 'kangaroo'}), [1, 2, 3])
+        self.assertEqual(self.store.find({'animal': 'kangaroo',
+                                          'colour': 'green'}), [3])
+        self.assertEqual(self.store.find({'colour': 'purple'}), [])
+
+    def test_combinations(self):
+        """ combinations should return the distinct rows of values. """
+
+        self.store.add('/other/green_echidna.txt', ['green', 'echidna'])
+
+        self.assertEqual(self.store.combinations(),
+                         set([('green', 'echidna'), ('blue', 'kangaroo'),
+                              ('red', 'kangaroo'), ('green', 'kangaroo')]))
+        self.assertItemsEqual(self.store.present_values('colour'),
+                              ['green', 'blue', 'red'])
+
+    def test_bitmaps(self):
+        """ Bitmaps should be kept up to date as files are added. """
+
+        self.assertEqual(self.store.bitmap('colour', 'green'), 0b1001)
+        self.assertEqual(self.store.bitmap('colour', 'purple'), 0)
+
+        self.store.add('/fake/green_wombat.txt', ['green', 'wombat'])
+
+        self.assertEqual(self.store.bitmap('colour', 'green'), 0b11001)
+        self.assertEqual(self.store.find({'colour': 'green',
+                                          'animal': 'wombat'}), [4])
+
+    def test_remove(self):
+        """ Removed files should no longer be found. """
+
+        self.store.remove('/fake/blue_kangaroo.txt')
+
+        self.assertEqual(len(self.store), 3)
+        self.assertEqual(self.store.find({'animal': 'kangaroo'}), [2, 3])
+        self.assertNotIn('blue', self.store.present_values('colour'))
+        self.assertNotIn(('blue', 'kangaroo'), self.store.combinations())
+
+    def test_remove_and_add(self):
+        """ A removed file should stay removed when others are added, and can be added again. """
+
+        self.store.remove('/fake/green_echidna.txt')
+        self.store.add('/fake/green_wombat.txt', ['green', 'wombat'])
+
+        self.assertEqual(self.store.find({'colour': 'green'}), [3, 4])
+        self.assertEqual(self.store.bitmap('colour', 'green'), 0b11000)
+        self.assertNotIn('echidna', self.store.present_values('animal'))
+
+        new_id = self.store.add('/fake/green_echidna.txt', ['green', 'echidna'])
+
+        self.assertEqual(new_id, 5)
+        self.assertEqual(self.store.find({'animal': 'echidna'}), [5])
+        self.assertTrue(self.store.has_combination(('green', 'echidna')))
+
+    def test_sparse_find(self):
+        """ Rare values should be searched through the columns, and their bitmaps not cached. """
+
+        store = AttributeStore(['colour', 'animal'])
+        for i in range(200):
+            store.add('/fake/{0}.txt'.format(i),
+                      ['red' if i % 100 == 7 else 'green', ['echidna', 'kangaroo'][i % 2]])
+        store.remove('/fake/7.txt')
+
+        self.assertEqual(store.find({'colour': 'red', 'animal': 'kangaroo'}), [107])
+        self.assertEqual(store.find({'colour': 'red', 'animal': 'echidna'}), [])
+        self.assertEqual(store.find({'colour': 'green', 'animal': 'echidna'}),
+                         range(0, 200, 2))
+        self.assertEqual(store.bitmap('colour', 'red'), 1 << 107)
+        self.assertNotIn('red', store.bitmaps['colour'])
+        self.assertIn('green', store.bitmaps['colour'])
@@ -19,7 +19,7 @@ Tests for the Constraint class.
 
 import unittest
 
-from cwsl.core.constraint import Constraint
+from cwsl.core.constraint import Constraint, ConstraintSet
 
 
 class TestConstraint(unittest.TestCase):
@@ -111,13 +111,24 @@ class TestConstraint(unittest.TestCase):
                                        self.tas_constraint.values))
 
     def test_setter(self):
-        """ Test setting the value of a constraint key. """
+        """ Test that the values of a constraint can not be changed. """
 
-        self.tas_constraint.values = ['pr']
+        with self.assertRaises(AttributeError):
+            self.tas_constraint.values = ['pr']
         self.assertItemsEqual(
             self.tas_constraint.values,
-            ['pr'],
-            '''Setter method not setting values correctly''')
+            ['tas'],
+            '''Constraint values should not change''')
+
+    def test_interned(self):
+        """ Constraints with the same key and values should be the same object. """
+
+        self.assertIs(Constraint('model', ['BNU-ESM', 'ACCESS1-0']),
+                      self.model_constraint)
+        self.assertIsNot(Constraint('model', ['BNU-ESM']),
+                         self.model_constraint)
+        self.assertNotEqual(Constraint('model', ['BNU-ESM']),
+                            self.model_constraint)
 
     def test_constraint_set(self):
         """ Test to make sure that putting constraint objects into a set works correctly."""
@@ -203,3 +214,46 @@ class TestConstraint(unittest.TestCase):
                          ('things', 'something_else')]
 
         self.assertItemsEqual(expected_outs, out_vals)
+
+
+class TestConstraintSet(unittest.TestCase):
+
+    def setUp(self):
+
+        self.cons_set = ConstraintSet([Constraint('variable', ['tas']),
+                                       Constraint('model', ['ACCESS1-0'])])
+
+    def test_lookup(self):
+        """ Constraints should be found by key. """
+
+        self.assertEqual(self.cons_set.get('model'), Constraint('model', ['ACCESS1-0']))
+        self.assertIsNone(self.cons_set.get('experiment'))
+        self.assertIn(Constraint('variable', ['tas']), self.cons_set)
+        self.assertNotIn(Constraint('variable', ['pr']), self.cons_set)
+
+    def test_merge_and_override(self):
+        """ add should merge values and override should replace them. """
+
+        self.cons_set.add(Constraint('variable', ['pr']))
+        self.cons_set.override(Constraint('model', ['MIROC5']))
+
+        self.assertEqual(self.cons_set,
+                         set([Constraint('variable', ['tas', 'pr']),
+                              Constraint('model', ['MIROC5'])]))
+
+    def test_remove(self):
+        """ Constraints should be removable by value or by key. """
+
+        self.cons_set.remove(Constraint('variable', ['tas']))
+        self.assertEqual(len(self.cons_set), 1)
+
+        self.cons_set.remove_key('model')
+        self.assertEqual(self.cons_set, set())
+
+    def test_remove_constraints(self):
+        """ remove_constraints should return a copy without the named constraints. """
+
+        removed = Constraint.remove_constraints(['model'], self.cons_set)
+
+        self.assertEqual(removed, set([Constraint('variable', ['tas'])]))
+        self.assertEqual(len(self.cons_set), 2)
@@ -0,0 +1,167 @@
+"""
+Authors: Tim Bedin, Tim Erwin
+
+Copyright 2014 CSIRO
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Tests for the DirectoryWalker class.
+
+"""
+
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+import time
+from collections import Counter
+
+from cwsl.core.constraint import Constraint
+from cwsl.core.directory_walker import DirectoryWalker, ListingCache, scan_dir
+from cwsl.core.pattern_parser import PatternParser
+
+
+module_logger = logging.getLogger('cwsl.tests.test_directory_walker')
+
+
+class TestDirectoryWalker(unittest.TestCase):
+
+    def setUp(self):
+        # Build a small file tree to walk.
+        self.tempdir = tempfile.mkdtemp()
+        for model in ['ACCESS1-0', 'ACCESS1-3', 'MIROC5']:
+            for variable in ['tas', 'pr']:
+                dir_path = os.path.join(self.tempdir, model, variable)
+                os.makedirs(dir_path)
+                for year in ['1986', '2005']:
+                    file_name = '{0}_{1}_{2}.nc'.format(variable, model, year)
+                    open(os.path.join(dir_path, file_name), 'w').close()
+
+        # Age the directories, so listings are not too fresh to be trusted.
+        old_time = time.time() - 60
+        for dir_path, _, _ in os.walk(self.tempdir):
+            os.utime(dir_path, (old_time, old_time))
+
+        self.pattern = os.path.join(self.tempdir, '%model%/%variable%/%variable%_%model%_%year%.nc')
+
+        # Count the directory listings.
+        self.listed = Counter()
+
+        def counting_list_dir(dir_path):
+            self.listed[dir_path] += 1
+            return scan_dir(dir_path)
+
+        self.list_dir = counting_list_dir
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_unconstrained(self):
+        """ With no constraints, the walker should find every file. """
+
+        walker = DirectoryWalker(self.pattern)
+
+        self.assertEqual(len(walker.walk()), 12)
+
+    def test_constrained(self):
+        """ The walker should only find files allowed by the constraints. """
+
+        walker = DirectoryWalker(self.pattern,
+                                 set([Constraint('model', ['ACCESS1-0', 'MIROC5']),
+                                      Constraint('year', ['1986'])]))
+        found_files = walker.walk()
+
+        expected_files = [os.path.join(self.tempdir, model, variable,
+                                       '{0}_{1}_1986.nc'.format(variable, model))
+                          for model in ['ACCESS1-0', 'MIROC5']
+                          for variable in ['tas', 'pr']]
+        self.assertItemsEqual(expected_files, found_files)
+
+    def test_directories_listed_once(self):
+        """ Each directory should be listed at most once, and only if needed. """
+
+        walker = DirectoryWalker(self.pattern,
+                                 set([Constraint('model', ['ACCESS1-0', 'ACCESS1-3']),
+                                      Constraint('year', ['1986', '2005'])]),
+                                 list_dir=self.list_dir)
+        found_files = walker.walk()
+
+        self.assertEqual(len(found_files), 8)
+        self.assertEqual(max(self.listed.values()), 1)
+        # The model names are built from the constraints, not listed.
+        self.assertNotIn(self.tempdir, self.listed)
+        self.assertNotIn(os.path.join(self.tempdir, 'MIROC5'), self.listed)
+
+    def test_missing_values(self):
+        """ Constraint values that do not exist should not be found. """
+
+        walker = DirectoryWalker(self.pattern,
+                                 set([Constraint('model', ['NotAModel'])]))
+
+        self.assertEqual(walker.walk(), [])
+
+    def test_parallel_walk(self):
+        """ A parallel walk should find the same files, in the same order, as a serial walk. """
+
+        walker = DirectoryWalker(self.pattern,
+                                 set([Constraint('variable', ['tas'])]))
+
+        serial_files = walker.walk()
+        parallel_files = walker.walk(workers=4)
+
+        self.assertEqual(len(serial_files), 6)
+        self.assertEqual(serial_files, parallel_files)
+
+    def test_listing_cache(self):
+        """ A ListingCache should only list changed directories again. """
+
+        listing_cache = ListingCache(self.list_dir)
+        walker = DirectoryWalker(self.pattern, list_dir=listing_cache)
+
+        self.assertEqual(len(walker.walk()), 12)
+        self.listed.clear()
+
+        dir_path = os.path.join(self.tempdir, 'MIROC5', 'pr')
+        open(os.path.join(dir_path, 'pr_MIROC5_2006.nc'), 'w').close()
+        # Make sure the mtime changes, even on coarse file systems.
+        dir_stat = os.stat(dir_path)
+        os.utime(dir_path, (dir_stat.st_atime, dir_stat.st_mtime + 10))
+
+        self.assertEqual(len(walker.walk()), 13)
+        self.assertEqual(self.listed.keys(), [dir_path])
+
+    def test_listing_cache_bound(self):
+        """ A ListingCache should not remember more entries than its bound. """
+
+        listing_cache = ListingCache(self.list_dir, max_entries=5)
+        walker = DirectoryWalker(self.pattern, list_dir=listing_cache)
+
+        self.assertEqual(len(walker.walk()), 12)
+        self.assertEqual(len(walker.walk()), 12)
+        self.assertLessEqual(listing_cache.n_entries, 5)
+        self.assertEqual(listing_cache.n_entries,
+                         sum(len(entries) for _, entries in listing_cache.listings.values()))
+        # Listings that were dropped are listed again.
+        self.assertGreater(sum(self.listed.values()), 10)
+
+    def test_walk_attributes(self):
+        """ The attributes found while walking should match the parsed paths. """
+
+        walker = DirectoryWalker(self.pattern,
+                                 set([Constraint('year', ['2005'])]))
+        parser = PatternParser(self.pattern)
+
+        found = walker.walk_attributes()
+
+        self.assertEqual(len(found), 6)
+        for path, attributes in found:
+            self.assertEqual(attributes, parser.parse_dict(path))
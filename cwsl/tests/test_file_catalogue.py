@@ -0,0 +1,177 @@
+"""
+Authors: Tim Bedin, Tim Erwin
+
+Copyright 2014 CSIRO
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Tests for the FileCatalogue class.
+
+"""
+
+import os
+import glob
+import shutil
+import logging
+import tempfile
+import sqlite3
+import unittest
+import time
+
+import mock
+
+from cwsl.core import file_catalogue
+from cwsl.core.constraint import Constraint
+from cwsl.core.file_catalogue import FileCatalogue
+from cwsl.core.directory_walker import DirectoryWalker
+from cwsl.core.pattern_dataset import PatternDataSet
+
+
+module_logger = logging.getLogger('cwsl.tests.test_file_catalogue')
+
+
+class TestFileCatalogue(unittest.TestCase):
+
+    def setUp(self):
+        # Build a small file tree to scan.
+        self.tempdir = tempfile.mkdtemp()
+        self.datadir = os.path.join(self.tempdir, 'data')
+        os.mkdir(self.datadir)
+        for colour in ['green', 'blue']:
+            os.mkdir(os.path.join(self.datadir, colour))
+            for animal in ['echidna', 'kangaroo']:
+                file_name = os.path.join(self.datadir, colour,
+                                         '{0}_{1}.txt'.format(colour, animal))
+                open(file_name, 'w').close()
+
+        # Age the directories, so listings are not too fresh to be trusted.
+        old_time = time.time() - 60
+        for dir_path, _, _ in os.walk(self.datadir):
+            os.utime(dir_path, (old_time, old_time))
+
+        self.pattern = os.path.join(self.datadir, '%colour%/%colour%_%animal%.txt')
+        self.glob_pattern = os.path.join(self.datadir, '*/*_*.txt')
+
+        self.catalogue = FileCatalogue(os.path.join(self.tempdir, 'catalogue.db'))
+        self.walker = DirectoryWalker(self.pattern, list_dir=self.catalogue.list_dir)
+
+    def tearDown(self):
+        self.catalogue.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_walk(self):
+        """ A walk using the catalogue should find the same files as glob.glob. """
+
+        self.assertItemsEqual(self.walker.walk(),
+                              glob.glob(self.glob_pattern))
+
+    def test_unchanged_directories(self):
+        """ Unchanged directories should not be listed again. """
+
+        self.walker.walk()
+
+        with mock.patch('os.listdir') as mock_listdir:
+            found_files = self.walker.walk()
+
+            self.assertFalse(mock_listdir.called)
+            self.assertEqual(len(found_files), 4)
+
+    def test_changed_directory(self):
+        """ A directory that has changed should be listed again. """
+
+        self.walker.walk()
+
+        new_file = os.path.join(self.datadir, 'blue', 'blue_bilby.txt')
+        open(new_file, 'w').close()
+        # Make sure the mtime changes, even on coarse file systems.
+        dir_stat = os.stat(os.path.join(self.datadir, 'blue'))
+        os.utime(os.path.join(self.datadir, 'blue'),
+                 (dir_stat.st_atime, dir_stat.st_mtime + 10))
+
+        found_files = self.walker.walk()
+
+        self.assertIn(new_file, found_files)
+        self.assertEqual(len(found_files), 5)
+
+    def test_fresh_listing(self):
+        """ A directory modified just before it was listed should be listed again. """
+
+        blue_dir = os.path.join(self.datadir, 'blue')
+        os.utime(blue_dir, None)
+        self.walker.walk()
+
+        with mock.patch('os.listdir', wraps=os.listdir) as mock_listdir:
+            self.walker.walk()
+
+            mock_listdir.assert_called_once_with(blue_dir)
+
+    def test_configured_catalogue(self):
+        """ Every configured catalogue for a database should share one connection. """
+
+        db_path = os.path.join(self.tempdir, 'configured.db')
+        with mock.patch.object(file_catalogue.configuration, 'file_catalogue',
+                               db_path, create=True):
+            first_catalogue = file_catalogue.configured_catalogue()
+            second_catalogue = file_catalogue.configured_catalogue()
+
+        self.assertIs(first_catalogue, second_catalogue)
+        first_catalogue.close()
+        del file_catalogue._catalogues[db_path]
+
+    def test_migration(self):
+        """ Old tables should be dropped once, when the database is first opened. """
+
+        db_path = os.path.join(self.tempdir, 'old.db')
+        connection = sqlite3.connect(db_path)
+        with connection:
+            connection.execute("CREATE TABLE directories (path TEXT)")
+        connection.close()
+
+        FileCatalogue(db_path).close()
+
+        def tables():
+            connection = sqlite3.connect(db_path)
+            names = [row[0] for row in
+                     connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+            version = connection.execute("PRAGMA user_version").fetchone()[0]
+            connection.close()
+            return sorted(names), version
+
+        self.assertEqual(tables(), (['listings'], file_catalogue.SCHEMA_VERSION))
+
+        # The migration is not run again.
+        connection = sqlite3.connect(db_path)
+        with connection:
+            connection.execute("CREATE TABLE directories (path TEXT)")
+        connection.close()
+
+        FileCatalogue(db_path).close()
+
+        self.assertEqual(tables(), (['directories', 'listings'], file_catalogue.SCHEMA_VERSION))
+
+    def test_patterndataset_attributes(self):
+        """ A PatternDataSet scanned with the catalogue should find the attributes. """
+
+        first_ds = PatternDataSet(self.pattern, catalogue=self.catalogue)
+
+        second_ds = PatternDataSet(self.pattern,
+                                   set([Constraint('colour', ['blue'])]),
+                                   catalogue=self.catalogue)
+
+        self.assertEqual(second_ds.get_constraint('animal'),
+                         Constraint('animal', ['echidna', 'kangaroo']))
+        found_files = second_ds.get_files({'animal': 'echidna'})
+        self.assertEqual(len(found_files), 1)
+        self.assertEqual(found_files[0].all_atts,
+                         {'colour': 'blue', 'animal': 'echidna'})
+        self.assertEqual(first_ds.constraints,
+                         set([Constraint('colour', ['blue', 'green']),
+                              Constraint('animal', ['echidna', 'kangaroo'])]))
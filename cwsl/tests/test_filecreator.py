@@ -59,3 +59,103 @@ class TestFileCreator(unittest.TestCase):
         all_files = [file_thing for file_thing in this_file_creator.files]
         # There should only be 3 valid file combinations returned.
         self.assertEqual(len(all_files), 3)
+
+    def test_files_skips_foreign_combinations(self):
+        ''' The .files property should skip combinations that are not files of this FileCreator. '''
+
+        cons_set = set([Constraint('model', ['ACCESS1-0', 'ACCESS1-3']),
+                        Constraint('experiment', ['rcp45', 'rcp85'])])
+
+        this_file_creator = FileCreator("/a/fake/pattern/%model%_%experiment%.nc",
+                                        extra_constraints=cons_set)
+        this_file_creator.get_files({'model': 'ACCESS1-3', 'experiment': 'rcp45'},
+                                    check=False, update=True)
+
+        foreign_combinations = [
+            # An attribute this FileCreator does not have.
+            [Constraint('model', ['ACCESS1-0']), Constraint('experiment', ['rcp45']),
+             Constraint('variable', ['tas'])],
+            # A missing attribute.
+            [Constraint('model', ['ACCESS1-0'])],
+            # More than one value for an attribute.
+            [Constraint('model', ['ACCESS1-0', 'ACCESS1-3']),
+             Constraint('experiment', ['rcp85'])],
+            # A value the constraints do not allow.
+            [Constraint('model', ['CSIRO-Mk3-6-0']), Constraint('experiment', ['rcp85'])]]
+        for combination in foreign_combinations:
+            this_file_creator.valid_combinations.add(frozenset(combination))
+
+        self.assertEqual([file_thing.full_path for file_thing in this_file_creator.files],
+                         ['/a/fake/pattern/ACCESS1-3_rcp45.nc'])
+
+    def test_files_applies_constraints(self):
+        ''' The .files property should only return files allowed by the current constraints. '''
+
+        cons_set = set([Constraint('model', ['ACCESS1-0', 'ACCESS1-3']),
+                        Constraint('experiment', ['rcp45', 'rcp85'])])
+
+        this_file_creator = FileCreator("/a/fake/pattern/%model%_%experiment%.nc",
+                                        extra_constraints=cons_set)
+        for model, experiment in [('ACCESS1-3', 'rcp85'), ('ACCESS1-0', 'rcp45'),
+                                  ('ACCESS1-3', 'rcp45')]:
+            this_file_creator.get_files({'model': model, 'experiment': experiment},
+                                        check=False, update=True)
+
+        # The files are returned in order.
+        self.assertEqual([file_thing.full_path for file_thing in this_file_creator.files],
+                         ['/a/fake/pattern/ACCESS1-0_rcp45.nc',
+                          '/a/fake/pattern/ACCESS1-3_rcp45.nc',
+                          '/a/fake/pattern/ACCESS1-3_rcp85.nc'])
+
+        this_file_creator.constraints.discard(Constraint('experiment', ['rcp45', 'rcp85']))
+        this_file_creator.constraints.add(Constraint('experiment', ['rcp85']))
+
+        self.assertEqual([file_thing.full_path for file_thing in this_file_creator.files],
+                         ['/a/fake/pattern/ACCESS1-3_rcp85.nc'])
+
+    def test_checked_files(self):
+        ''' Checked get_files should only return the valid files that match, and not removed ones. '''
+
+        cons_set = set([Constraint('model', ['ACCESS1-0', 'ACCESS1-3']),
+                        Constraint('experiment', ['rcp45', 'rcp85'])])
+
+        this_file_creator = FileCreator("/a/fake/pattern/%model%_%experiment%.nc",
+                                        extra_constraints=cons_set)
+
+        for model, experiment in [('ACCESS1-0', 'rcp45'), ('ACCESS1-0', 'rcp85'),
+                                  ('ACCESS1-3', 'rcp45')]:
+            this_file_creator.get_files({'model': model, 'experiment': experiment},
+                                        check=False, update=True)
+
+        rcp45_files = this_file_creator.get_files({'experiment': 'rcp45', 'variable': 'tas'},
+                                                  check=True, update=False)
+        self.assertItemsEqual([file_thing.full_path for file_thing in rcp45_files],
+                              ['/a/fake/pattern/ACCESS1-0_rcp45.nc',
+                               '/a/fake/pattern/ACCESS1-3_rcp45.nc'])
+        self.assertEqual(this_file_creator.get_files({'model': 'ACCESS1-3',
+                                                      'experiment': 'rcp85'},
+                                                     check=True, update=False), [])
+
+        this_file_creator.remove_files(['/a/fake/pattern/ACCESS1-0_rcp45.nc'])
+
+        self.assertEqual(len(this_file_creator.get_files({}, check=True, update=False)), 2)
+
+    def test_aliased_checked_files(self):
+        ''' Checked get_files should look up aliases, and find nothing for unknown constraints. '''
+
+        cons_set = set([Constraint('model', ['ACCESS1-0', 'ACCESS1-3'])])
+        this_file_creator = FileCreator("/a/fake/pattern/%model%.nc",
+                                        extra_constraints=cons_set)
+        for model in ['ACCESS1-0', 'ACCESS1-3']:
+            this_file_creator.get_files({'model': model}, check=False, update=True)
+
+        this_file_creator.alias_constraint('model', 'obsmodel')
+        this_file_creator.cons_names.append('obsmodel')
+        this_file_creator.cons_names.append('missing')
+
+        found_files = this_file_creator.get_files({'obsmodel': 'ACCESS1-3'},
+                                                  check=True, update=False)
+        self.assertEqual([file_thing.full_path for file_thing in found_files],
+                         ['/a/fake/pattern/ACCESS1-3.nc'])
+        self.assertEqual(this_file_creator.get_files({'missing': 'value'},
+                                                     check=True, update=False), [])
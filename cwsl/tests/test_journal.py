@@ -0,0 +1,97 @@
+"""
+Authors: Tim Bedin, Tim Erwin
+
+Copyright 2014 CSIRO
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Tests for the execution Journal.
+
+"""
+
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+import subprocess
+
+from cwsl.core.journal import (Journal, QUEUED, COMPLETED,
+                               command_hash, journal_path)
+
+
+module_logger = logging.getLogger('cwsl.tests.test_journal')
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.journal_file = os.path.join(self.tempdir, 'journals', 'test.jsonl')
+        self.out_file = os.path.join(self.tempdir, 'outfile.nc')
+        self.cmd_hash = command_hash(['echo', 'infile.nc', self.out_file])
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_record(self):
+        """ Test that the status of commands is kept between runs. """
+
+        journal = Journal(self.journal_file)
+        journal.record(self.cmd_hash, QUEUED, ['infile.nc'], [self.out_file])
+        journal.close()
+
+        journal = Journal(self.journal_file)
+        self.assertEqual(journal.status[self.cmd_hash], QUEUED)
+        self.assertFalse(journal.is_complete(self.cmd_hash, [self.out_file]))
+
+        journal.record(self.cmd_hash, COMPLETED)
+        journal.close()
+
+        # The output must still exist.
+        journal = Journal(self.journal_file)
+        self.assertFalse(journal.is_complete(self.cmd_hash, [self.out_file]))
+        open(self.out_file, 'w').close()
+        self.assertTrue(journal.is_complete(self.cmd_hash, [self.out_file]))
+        journal.close()
+
+    def test_completion_cmd(self):
+        """ Test that the shell can mark a command as completed. """
+
+        journal = Journal(self.journal_file)
+        journal.record(self.cmd_hash, QUEUED)
+        subprocess.check_call(' '.join(journal.completion_cmd(self.cmd_hash)),
+                              shell=True)
+        journal.close()
+
+        journal = Journal(self.journal_file)
+        self.assertEqual(journal.status[self.cmd_hash], COMPLETED)
+        journal.close()
+
+    def test_bad_line(self):
+        """ Test that a line cut short by a crash is skipped. """
+
+        journal = Journal(self.journal_file)
+        journal.record(self.cmd_hash, COMPLETED)
+        journal.close()
+        with open(self.journal_file, 'a') as journal_file:
+            journal_file.write('{"hash": "abc')
+
+        journal = Journal(self.journal_file)
+        self.assertEqual(journal.status, {self.cmd_hash: COMPLETED})
+        journal.close()
+
+    def test_journal_path(self):
+        """ Test that a ProcessUnit always gets the same journal. """
+
+        first = journal_path('/journals', 'echo', '/out/%model%.nc')
+        self.assertEqual(first, journal_path('/journals', 'echo', '/out/%model%.nc'))
+        self.assertNotEqual(first, journal_path('/journals', 'cat', '/out/%model%.nc'))
@@ -0,0 +1,105 @@
+"""
+Authors: Tim Bedin, Tim Erwin
+
+Copyright 2014 CSIRO
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Tests for reading file manifests.
+
+"""
+
+import os
+import gzip
+import json
+import shutil
+import logging
+import tempfile
+import unittest
+
+from cwsl.core.constraint import Constraint
+from cwsl.core.manifest import read_manifest, match_manifest
+from cwsl.core.pattern_parser import PatternParser
+from cwsl.core.pattern_dataset import PatternDataSet
+
+
+module_logger = logging.getLogger('cwsl.tests.test_manifest')
+
+
+class TestManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+        self.pattern = '/fake/%colour%/%colour%_%animal%.txt'
+        self.paths = ['/fake/green/green_echidna.txt', '/fake/blue/blue_kangaroo.txt',
+                      '/fake/red/red_kangaroo.txt', '/fake/red/red_wombat.txt',
+                      '/other/red/red_kangaroo.txt', '/fake/README']
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write_manifest(self, name, contents, opener=open):
+        manifest_path = os.path.join(self.tempdir, name)
+        manifest_file = opener(manifest_path, 'wb')
+        manifest_file.write(contents)
+        manifest_file.close()
+        return manifest_path
+
+    def test_formats(self):
+        """ Each manifest format should give the same paths. """
+
+        records = [{'path': path, 'size': 10} for path in self.paths]
+        manifests = [self.write_manifest('files.txt', '\n'.join(self.paths) + '\n'),
+                     self.write_manifest('files.csv', 'size,path\n' +
+                                         ''.join('10,{0}\n'.format(path) for path in self.paths)),
+                     self.write_manifest('files.json', json.dumps({'files': records})),
+                     self.write_manifest('files.jsonl.gz',
+                                         '\n'.join(json.dumps(record) for record in records),
+                                         opener=gzip.open)]
+
+        for manifest_path in manifests:
+            self.assertEqual(list(read_manifest(manifest_path)), self.paths)
+
+    def test_relative_paths(self):
+        """ Relative paths should be relative to the manifest. """
+
+        manifest_path = self.write_manifest('files.txt', './green/green_echidna.txt\n')
+
+        self.assertEqual(list(read_manifest(manifest_path)),
+                         [os.path.join(self.tempdir, 'green', 'green_echidna.txt')])
+
+    def test_patterndataset(self):
+        """ A PatternDataSet should read its files from a manifest. """
+
+        manifest_path = self.write_manifest('files.txt', '\n'.join(self.paths))
+
+        pattern_ds = PatternDataSet(self.pattern,
+                                    set([Constraint('animal', ['kangaroo', 'wombat'])]),
+                                    manifest=manifest_path)
+
+        self.assertItemsEqual(pattern_ds.files, self.paths[1:4])
+        self.assertEqual(pattern_ds.get_constraint('colour'),
+                         Constraint('colour', ['blue', 'red']))
+        self.assertEqual(len(pattern_ds.get_files({'colour': 'red'})), 2)
+
+    def test_deeper_paths(self):
+        """ Paths deeper than the pattern should not match it. """
+
+        manifest_path = self.write_manifest('files.txt',
+                                            '/data/a/tas/tas_a_2000.nc\n'
+                                            '/data/a/extra/tas/tas_a_2000.nc\n'
+                                            '/data/a/tas/sub/tas_a_2000.nc\n')
+        parser = PatternParser('/data/%model%/%variable%/%file%')
+
+        self.assertEqual(list(match_manifest(manifest_path, parser)),
+                         [('/data/a/tas/tas_a_2000.nc',
+                           {'model': 'a', 'variable': 'tas', 'file': 'tas_a_2000.nc'})])
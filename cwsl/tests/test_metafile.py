@@ -40,3 +40,18 @@ class TestMetaFile(unittest.TestCase):
         self.assertNotEqual(meta_1, meta_2)
         self.assertNotEqual(meta_1, meta_3)
         self.assertEqual(meta_1, meta_4)
+
+    def test_attributes(self):
+        """ MetaFiles should give the same attributes however they are built. """
+
+        meta_1 = MetaFile("file1", "/a/fake", {"animal": "kangaroo", "colour": "red"})
+        meta_2 = MetaFile.from_values("file1", "/a/fake", ("colour", "animal"),
+                                      ("red", "kangaroo"))
+
+        self.assertEqual(meta_1, meta_2)
+        self.assertEqual(hash(meta_1), hash(meta_2))
+        self.assertEqual(meta_2.all_atts, {"animal": "kangaroo", "colour": "red"})
+        self.assertEqual(meta_2.full_path, "/a/fake/file1")
+        self.assertIs(meta_1.att_names, meta_2.att_names)
+        with self.assertRaises(AttributeError):
+            meta_1.filename = "file2"
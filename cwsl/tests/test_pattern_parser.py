@@ -0,0 +1,75 @@
+"""
+Authors: Tim Bedin, Tim Erwin
+
+Copyright 2014 CSIRO
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Tests for the PatternParser class.
+
+"""
+
+import logging
+import unittest
+
+from cwsl.core.pattern_parser import PatternParser, PathTemplate, attribute_names
+
+
+module_logger = logging.getLogger('cwsl.tests.test_pattern_parser')
+
+
+class TestPatternParser(unittest.TestCase):
+
+    def setUp(self):
+        self.drs_pattern = '/data/%model%/%variable%/%variable%_%model%_%ensemble%.nc'
+
+    def test_parse(self):
+        """ The parser should return the attribute values of a path. """
+
+        parser = PatternParser(self.drs_pattern)
+
+        self.assertEqual(parser.att_names, ['model', 'variable', 'ensemble'])
+        self.assertEqual(parser.parse('/data/ACCESS1-0/tas/tas_ACCESS1-0_r1i1p1.nc'),
+                         ('ACCESS1-0', 'tas', 'r1i1p1'))
+        self.assertEqual(parser.parse_dict('/data/CSIRO_Mk3/tas/tas_CSIRO_Mk3_r1i1p1.nc'),
+                         {'model': 'CSIRO_Mk3', 'variable': 'tas', 'ensemble': 'r1i1p1'})
+
+    def test_no_match(self):
+        """ Paths that do not match the pattern should give None. """
+
+        parser = PatternParser(self.drs_pattern)
+
+        for path in ['/data/MIROC5/tas/pr_MIROC5_r1i1p1.nc',
+                     '/data/MIROC5/tas/tas_MIROC5_.nc',
+                     '/other/MIROC5/tas/tas_MIROC5_r1i1p1.nc']:
+            self.assertIsNone(parser.parse(path))
+            self.assertIsNone(parser.parse_dict(path))
+
+    def test_attribute_names(self):
+        """ attribute_names should return every name in the pattern. """
+
+        self.assertEqual(attribute_names(self.drs_pattern),
+                         ['model', 'variable', 'variable', 'model', 'ensemble'])
+
+    def test_path_template(self):
+        """ A PathTemplate should fill the pattern like a substitution per attribute. """
+
+        template = PathTemplate('/data/{out}/%model%/%variable%_%model%_%ensemble%.nc')
+
+        self.assertEqual(template.fill({'model': 'MIROC5', 'variable': 'tas',
+                                        'ensemble': 'r1i1p1'}),
+                         '/data/{out}/MIROC5/tas_MIROC5_r1i1p1.nc')
+        self.assertEqual(template.fill({'model': 'MIROC5'}),
+                         '/data/{out}/MIROC5/%variable%_MIROC5_%ensemble%.nc')
+        self.assertEqual(template.fill_many(['variable', 'model'],
+                                            [('tas', 'MIROC5'), ('pr', 'ACCESS1-0')]),
+                         ['/data/{out}/MIROC5/tas_MIROC5_%ensemble%.nc',
+                          '/data/{out}/ACCESS1-0/pr_ACCESS1-0_%ensemble%.nc'])
@@ -17,6 +17,9 @@ Contains tests for the PatternDataSet class.
 
 """
 
+import os
+import shutil
+import tempfile
 import unittest
 import logging
 
@@ -93,19 +96,18 @@ class TestPatternDataSet(unittest.TestCase):
                           "/not/real/pattern/%model%.nc",
                           constraint_set=test_cons)
 
-    def test_build_glob_patterns(self):
-        """ When constraints are given in the constructor, restrict the patterns on the fs to glob. """
+    def test_restricted_walk(self):
+        """ When constraints are given in the constructor, only walk the matching files on the fs. """
 
         given_cons = set([Constraint('colour', ['pink', 'green'])])
 
         pattern_ds = PatternDataSet(self.mock_file_pattern,
                                     given_cons)
 
-        expected_patterns = ['/fake/pink_*.txt',
-                             '/fake/green_*.txt']
-
-        self.assertItemsEqual(pattern_ds.glob_patterns,
-                              expected_patterns)
+        segment_regex = pattern_ds.walker.segment_regex(1, {})
+        self.assertTrue(segment_regex.match('pink_kangaroo.txt'))
+        self.assertTrue(segment_regex.match('green_echidna.txt'))
+        self.assertFalse(segment_regex.match('blue_kangaroo.txt'))
 
     def test_cons_from_pattern(self):
         """ The PatternDataSet should build a complete set of constraints by globbing on the file system."""
@@ -143,3 +145,84 @@ class TestPatternDataSet(unittest.TestCase):
             self.assertEqual("/fake/red_kangaroo.txt",
                              found_files[0].full_path)
 
+
+    def test_records(self):
+        """ The PatternDataSet should parse each file once into a table of attribute values. """
+
+        with mock.patch('cwsl.core.pattern_dataset.PatternDataSet.glob_fs') as mock_glob:
+            mock_glob.return_value = self.mock_file_list
+
+            pattern_ds = PatternDataSet(self.mock_file_pattern)
+
+        self.assertEqual(pattern_ds.att_names, ['colour', 'animal'])
+        file_id = pattern_ds.store.path_ids['/fake/green_echidna.txt']
+        self.assertEqual(pattern_ds.store.row(file_id), ('green', 'echidna'))
+        self.assertEqual(len(pattern_ds.store), 4)
+        self.assertEqual(pattern_ds.read_atts('/fake/red_kangaroo.txt'),
+                         {'colour': 'red', 'animal': 'kangaroo'})
+        self.assertEqual(len(pattern_ds.valid_combinations), 4)
+
+    def test_lazy(self):
+        """ A lazy PatternDataSet should not scan the file system until it is needed. """
+
+        with mock.patch('cwsl.core.pattern_dataset.PatternDataSet.glob_fs') as mock_glob:
+            mock_glob.return_value = self.mock_file_list
+
+            pattern_ds = PatternDataSet(self.mock_file_pattern, lazy=True)
+
+            self.assertFalse(mock_glob.called)
+            self.assertItemsEqual(pattern_ds.cons_names, ['colour', 'animal'])
+
+            found_files = pattern_ds.get_files({'colour': 'green'})
+
+            self.assertEqual(len(found_files), 1)
+            self.assertEqual(pattern_ds.constraints, self.fake_constraints)
+            self.assertEqual(len(pattern_ds.valid_combinations), 4)
+            mock_glob.assert_called_once_with()
+
+    def test_refresh(self):
+        """ refresh should report and index the files that have changed. """
+
+        with mock.patch('cwsl.core.pattern_dataset.PatternDataSet.glob_fs') as mock_glob:
+            mock_glob.return_value = self.mock_file_list
+
+            pattern_ds = PatternDataSet(self.mock_file_pattern)
+
+            mock_glob.return_value = ['/fake/green_echidna.txt', '/fake/blue_kangaroo.txt',
+                                      '/fake/red_kangaroo.txt', '/fake/red_wombat.txt']
+            added, removed, changed = pattern_ds.refresh()
+
+        self.assertEqual(added, ['/fake/red_wombat.txt'])
+        self.assertEqual(removed, ['/fake/purple_kangaroo.txt'])
+        self.assertEqual(changed, [])
+        self.assertEqual(pattern_ds.get_constraint('colour'),
+                         Constraint('colour', ['green', 'blue', 'red']))
+        self.assertEqual(pattern_ds.get_constraint('animal'),
+                         Constraint('animal', ['echidna', 'kangaroo', 'wombat']))
+        self.assertEqual(len(pattern_ds.get_files({'colour': 'red'})), 2)
+        self.assertEqual(pattern_ds.get_files({'colour': 'purple'}), [])
+        self.assertEqual(len(pattern_ds.valid_combinations), 4)
+
+    def test_refresh_changed_files(self):
+        """ refresh should report rewritten files when changes are tracked. """
+
+        tempdir = tempfile.mkdtemp()
+        try:
+            for colour in ['green', 'blue']:
+                open(os.path.join(tempdir, colour + '_echidna.txt'), 'w').close()
+
+            pattern_ds = PatternDataSet(os.path.join(tempdir, '%colour%_%animal%.txt'),
+                                        track_changes=True)
+
+            rewritten = os.path.join(tempdir, 'blue_echidna.txt')
+            with open(rewritten, 'w') as rewritten_file:
+                rewritten_file.write('spines')
+
+            added, removed, changed = pattern_ds.refresh()
+        finally:
+            shutil.rmtree(tempdir)
+
+        self.assertEqual(added, [])
+        self.assertEqual(removed, [])
+        self.assertEqual(changed, [rewritten])
+        self.assertEqual(len(pattern_ds.valid_combinations), 2)
@@ -17,6 +17,9 @@ Tests for the ProcessUnit class.
 
 """
 
+import os
+import shutil
+import tempfile
 import unittest
 import logging
 
@@ -25,7 +28,9 @@ import mock
 from cwsl.configuration import configuration
 from cwsl.core.constraint import Constraint
 from cwsl.core.pattern_dataset import PatternDataSet
-from cwsl.core.process_unit import ProcessUnit, EmptyOverwriteError
+from cwsl.core.result_cache import configured_cache, cache_key, file_fingerprint
+from cwsl.core.process_unit import (ProcessUnit, EmptyOverwriteError, TooManyCommandsError,
+                                    up_to_date)
 
 
 module_logger = logging.getLogger('cwsl.tests.test_process_unit')
@@ -191,6 +196,27 @@ class TestProcessUnit(unittest.TestCase):
         self.assertEqual(len(all_files), 1)
         self.assertEqual(all_files[0].full_path, '/a/new/pattern/fake_1/file_1/pattern_1.file')
 
+    def test_mapped_file_creator_input(self):
+        """ Test that a mapped constraint selects the files of a FileCreator input. """
+
+        with mock.patch('cwsl.core.pattern_dataset.PatternDataSet.glob_fs') as mock_glob:
+            mock_glob.return_value = ['/in/{0}_tas_mean.nc'.format(model) for model in 'ABC']
+            model_ds = PatternDataSet('/in/%model%_%variable%_%agg%.nc')
+            mock_glob.return_value = ['/obs/tas_mean.nc']
+            obs_ds = PatternDataSet('/obs/%variable%_%agg%.nc')
+
+        first_unit = ProcessUnit([model_ds], '/out/%model%_%variable%_%agg%.nc', 'echo')
+        file_creator = first_unit.execute(simulate=True)
+
+        second_unit = ProcessUnit([file_creator, obs_ds], '/out2/%obsmodel%_%variable%_%agg%.nc',
+                                  'echo', map_dict={'obsmodel': ('model', 0)})
+        second_unit.execute(simulate=True)
+
+        commands = second_unit.scheduler.job.to_str().splitlines()
+        for model in 'ABC':
+            self.assertIn('echo /out/{0}_tas_mean.nc /obs/tas_mean.nc /out2/{0}_tas_mean.nc'
+                          .format(model), commands)
+
     def test_kwstrings(self):
         """ Test to check that multi-constraint keyword arguments can be created. """
 
@@ -201,3 +227,363 @@ class TestProcessUnit(unittest.TestCase):
         expected_string = self.script_header + 'mkdir -p /a/new/pattern/fake_1/file_1\necho test_file1 /a/new/pattern/fake_1/file_1/pattern_1.file --title fake_1-file_1\n'
 
         self.assertEqual(expected_string, the_process_unit.scheduler.job.to_str())
+
+    def test_streaming_execution(self):
+        """ Test that the exec manager can be chosen in the execution options. """
+
+        the_process_unit = ProcessUnit([self.a_pattern_ds], '/another/%file%/%pattern%.txt',
+                                       'echo', execution_options={'execution_manager': 'StreamingExecManager'})
+
+        ds_result = the_process_unit.execute(simulate=True)
+
+        outfiles = [file_thing for file_thing in ds_result.files]
+        self.assertEqual(len(outfiles), 1)
+        self.assertEqual(the_process_unit.scheduler.submitted, 1)
+        self.assertEqual(the_process_unit.scheduler.completed, 1)
+
+    def test_plan_stats(self):
+        """ Test that the size of a run can be estimated before it runs. """
+
+        extra_cons = set([Constraint('animal', ['moose', 'kangaroo'])])
+        the_process_unit = ProcessUnit([self.a_pattern_ds], '/another/%file%/%pattern%_%animal%.txt',
+                                       'echo', extra_constraints=extra_cons)
+
+        stats = the_process_unit.plan_stats()
+        self.assertEqual(stats['combinations'], 1)
+        self.assertEqual(stats['commands'], 2)
+        self.assertEqual(stats['output_files'], 2)
+
+    def test_plan_stats_inputs(self):
+        """ Test that only the input files in the planned combinations are counted. """
+
+        with mock.patch('cwsl.core.pattern_dataset.PatternDataSet.glob_fs') as mock_glob:
+            mock_glob.return_value = ['/a/ACCESS1-0_tas.nc', '/a/MIROC5_tas.nc']
+            first_ds = PatternDataSet('/a/%model%_%variable%.nc')
+            mock_glob.return_value = ['/b/ACCESS1-0.txt']
+            second_ds = PatternDataSet('/b/%model%.txt')
+
+        the_process_unit = ProcessUnit([first_ds, second_ds], '/another/%model%.txt', 'echo',
+                                       extra_constraints=set([Constraint('model', ['ACCESS1-0'])]))
+
+        stats = the_process_unit.plan_stats()
+        self.assertEqual(stats['commands'], 1)
+        self.assertEqual(stats['input_files'], 2)
+
+        the_process_unit = ProcessUnit([first_ds, second_ds], '/another/%model%.txt', 'echo')
+
+        stats = the_process_unit.plan_stats()
+        self.assertEqual(stats['commands'], 2)
+        self.assertEqual(stats['input_files'], 3)
+
+    def test_max_commands(self):
+        """ Test that a run with too many commands is refused. """
+
+        extra_cons = set([Constraint('animal', ['moose', 'kangaroo'])])
+        the_process_unit = ProcessUnit([self.a_pattern_ds], '/another/%file%/%pattern%_%animal%.txt',
+                                       'echo', extra_constraints=extra_cons,
+                                       execution_options={'max_commands': 1})
+
+        self.assertRaises(TooManyCommandsError, the_process_unit.execute, simulate=True)
+
+    def test_plan_estimate(self):
+        """ Test that the plan estimate is kept on the ProcessUnit when it runs. """
+
+        extra_cons = set([Constraint('animal', ['moose', 'kangaroo'])])
+        the_process_unit = ProcessUnit([self.a_pattern_ds], '/another/%file%/%pattern%_%animal%.txt',
+                                       'echo', extra_constraints=extra_cons)
+        self.assertIsNone(the_process_unit.plan_estimate)
+
+        the_process_unit.execute(simulate=True)
+
+        self.assertEqual(the_process_unit.plan_estimate,
+                         {'combinations': 1, 'commands': 2, 'output_files': 2})
+
+    def test_batch_dependencies(self):
+        """ Test that a batch job waits for the job that creates its inputs. """
+
+        test_dir = tempfile.mkdtemp()
+        try:
+            qsub_log = os.path.join(test_dir, 'qsub.log')
+            qsub = os.path.join(test_dir, 'qsub')
+            with open(qsub, 'w') as qsub_file:
+                qsub_file.write('#!/bin/sh\necho "$@" >> {0}\necho $$.fake\n'.format(qsub_log))
+            os.chmod(qsub, 0755)
+
+            batch_options = {'execution_manager': 'PBSExecManager',
+                             'qsub': qsub, 'job_dir': test_dir}
+
+            first_unit = ProcessUnit([self.a_pattern_ds], '/another/%file%/%pattern%.txt',
+                                     'echo', execution_options=batch_options)
+            first_output = first_unit.execute()
+            self.assertEqual(first_output.job_ids, [first_unit.scheduler.job_id])
+
+            second_unit = ProcessUnit([first_output], '/final/%file%/%pattern%.txt',
+                                      'echo', execution_options=batch_options)
+            second_unit.execute()
+
+            with open(qsub_log) as log_file:
+                second_args = log_file.read().splitlines()[1].split()
+            self.assertEqual(second_args[:2], ['-W', 'depend=afterok:' + first_output.job_ids[0]])
+        finally:
+            shutil.rmtree(test_dir)
+
+    def test_failed_outputs(self):
+        """ Test that the outputs of failed commands are not passed on. """
+
+        extra_cons = set([Constraint('animal', ['moose', 'kangaroo'])])
+        the_process_unit = ProcessUnit([self.a_pattern_ds], '/another/%file%/%pattern%_%animal%.txt',
+                                       'echo', extra_constraints=extra_cons,
+                                       execution_options={'execution_manager': 'StreamingExecManager'})
+
+        failed_file = '/another/file_1/pattern_1_moose.txt'
+        with mock.patch('cwsl.core.scheduler.StreamingExecManager.failed_files',
+                        new_callable=mock.PropertyMock) as mock_failed:
+            mock_failed.return_value = set([failed_file])
+            ds_result = the_process_unit.execute(simulate=True)
+
+        outfiles = [file_thing.full_path for file_thing in ds_result.files]
+        self.assertEqual(outfiles, ['/another/file_1/pattern_1_kangaroo.txt'])
+        self.assertEqual(len(ds_result.valid_hashes), 1)
+
+    def test_failed_planning(self):
+        """ Test that the workers are stopped and the journal closed if planning fails. """
+
+        test_dir = tempfile.mkdtemp()
+        try:
+            options = {'execution_manager': 'StreamingExecManager',
+                       'journal': os.path.join(test_dir, 'journal.jsonl')}
+            the_process_unit = ProcessUnit([self.a_pattern_ds], '/another/%file%/%pattern%.txt',
+                                           'echo', execution_options=options)
+
+            with mock.patch.object(the_process_unit, 'apply_kwstring',
+                                   side_effect=ValueError), \
+                    mock.patch('cwsl.core.scheduler.StreamingExecManager.cancel') as mock_cancel, \
+                    mock.patch('cwsl.core.process_unit.Journal.close') as mock_close:
+                self.assertRaises(ValueError, the_process_unit.execute)
+
+                mock_cancel.assert_called_once_with()
+                mock_close.assert_called_once_with()
+        finally:
+            shutil.rmtree(test_dir)
+
+    def test_journal_resume(self):
+        """ Test that commands completed in an earlier run are skipped. """
+
+        test_dir = tempfile.mkdtemp()
+        old_path = os.environ['PATH']
+        try:
+            # A stand-in for the environment modules command.
+            module_path = os.path.join(test_dir, 'module')
+            with open(module_path, 'w') as module_file:
+                module_file.write('#!/bin/sh\nexit 0\n')
+            os.chmod(module_path, 0755)
+            os.environ['PATH'] = test_dir + os.pathsep + old_path
+
+            out_pattern = os.path.join(test_dir, '%file%', '%pattern%.txt')
+            options = {'journal': os.path.join(test_dir, 'journal.jsonl')}
+
+            first_unit = ProcessUnit([self.a_pattern_ds], out_pattern, 'echo',
+                                     execution_options=options)
+            first_unit.execute()
+            self.assertEqual(len(first_unit.scheduler.job.cmds), 2)
+
+            out_file = os.path.join(test_dir, 'file_1', 'pattern_1.txt')
+            open(out_file, 'w').close()
+
+            second_unit = ProcessUnit([self.a_pattern_ds], out_pattern, 'echo',
+                                      execution_options=options)
+            ds_result = second_unit.execute()
+            self.assertEqual(second_unit.scheduler.job.cmds, [])
+
+            # The skipped output is still passed on.
+            outfiles = [file_thing.full_path for file_thing in ds_result.files]
+            self.assertEqual(outfiles, [out_file])
+        finally:
+            os.environ['PATH'] = old_path
+            shutil.rmtree(test_dir)
+
+    def test_skip_up_to_date(self):
+        """ Test that commands with outputs newer than their inputs are skipped. """
+
+        test_dir = tempfile.mkdtemp()
+        try:
+            in_file = os.path.join(test_dir, 'infile.txt')
+            out_file = os.path.join(test_dir, 'file_1', 'pattern_1.txt')
+            os.mkdir(os.path.dirname(out_file))
+            open(in_file, 'w').close()
+            open(out_file, 'w').close()
+            os.utime(in_file, (1000, 1000))
+            self.a_pattern_ds.get_files.return_value[0].full_path = in_file
+
+            out_pattern = os.path.join(test_dir, '%file%', '%pattern%.txt')
+            options = {'skip_up_to_date': True}
+
+            the_process_unit = ProcessUnit([self.a_pattern_ds], out_pattern, 'echo',
+                                           execution_options=options)
+            ds_result = the_process_unit.execute(simulate=True)
+            self.assertEqual(the_process_unit.scheduler.job.cmds, [])
+            self.assertEqual([file_thing.full_path for file_thing in ds_result.files],
+                             [out_file])
+
+            # Now the input is newer.
+            os.utime(in_file, None)
+            os.utime(out_file, (1000, 1000))
+            the_process_unit = ProcessUnit([self.a_pattern_ds], out_pattern, 'echo',
+                                           execution_options=options)
+            the_process_unit.execute(simulate=True)
+            self.assertEqual(the_process_unit.scheduler.job.cmds,
+                             [['echo', in_file, out_file]])
+        finally:
+            shutil.rmtree(test_dir)
+
+    def test_up_to_date(self):
+        """ Test the comparison of input and output modification times. """
+
+        test_dir = tempfile.mkdtemp()
+        try:
+            in_file = os.path.join(test_dir, 'in.txt')
+            out_file = os.path.join(test_dir, 'out.txt')
+            open(in_file, 'w').close()
+            self.assertFalse(up_to_date([in_file], [out_file]))
+
+            open(out_file, 'w').close()
+            os.utime(in_file, (1000, 1000))
+            self.assertTrue(up_to_date([in_file], [out_file]))
+
+            os.utime(out_file, (500, 500))
+            self.assertFalse(up_to_date([in_file], [out_file]))
+
+            # Cached input times are used.
+            self.assertTrue(up_to_date([in_file], [out_file], {in_file: 100}))
+            self.assertFalse(up_to_date([os.path.join(test_dir, 'missing')], [out_file]))
+        finally:
+            shutil.rmtree(test_dir)
+
+    def test_result_cache(self):
+        """ Test that cached results are reused instead of running the command. """
+
+        test_dir = tempfile.mkdtemp()
+        try:
+            in_file = os.path.join(test_dir, 'infile.txt')
+            with open(in_file, 'w') as in_data:
+                in_data.write('input')
+            self.a_pattern_ds.get_files.return_value[0].full_path = in_file
+
+            # Another user's run of the same command on the same input.
+            options = {'result_cache': os.path.join(test_dir, 'cache'),
+                       'execution_manager': 'StreamingExecManager'}
+            first_out = os.path.join(test_dir, 'user_1', 'file_1', 'pattern_1.txt')
+            cache = configured_cache(options)
+            fingerprints = {in_file: file_fingerprint(in_file)}
+            os.makedirs(os.path.dirname(first_out))
+            with open(first_out, 'w') as out_data:
+                out_data.write('output')
+            cache.store(cache_key(['echo', in_file, first_out], [in_file], [first_out],
+                                  fingerprints), [first_out])
+            cache.close()
+
+            out_pattern = os.path.join(test_dir, 'user_2', '%file%', '%pattern%.txt')
+            the_process_unit = ProcessUnit([self.a_pattern_ds], out_pattern, 'echo',
+                                           execution_options=options)
+            the_process_unit.execute()
+
+            self.assertEqual(the_process_unit.scheduler.submitted, 0)
+            with open(os.path.join(test_dir, 'user_2', 'file_1', 'pattern_1.txt')) as out_data:
+                self.assertEqual(out_data.read(), 'output')
+        finally:
+            shutil.rmtree(test_dir)
+
+    def test_result_cache_annotation(self):
+        """ Test that outputs are cached before they are annotated, and
+        fetched outputs are annotated.
+
+        """
+
+        def fake_annotation(manager, annotation, out_files, job=None):
+            for out_file in out_files:
+                manager.queue_cmd(job, ['echo', annotation, '>>', out_file])
+
+        test_dir = tempfile.mkdtemp()
+        old_path = os.environ['PATH']
+        try:
+            # A stand-in for the environment modules command.
+            module_path = os.path.join(test_dir, 'module')
+            with open(module_path, 'w') as module_file:
+                module_file.write('#!/bin/sh\nexit 0\n')
+            os.chmod(module_path, 0755)
+            os.environ['PATH'] = test_dir + os.pathsep + old_path
+
+            in_file = os.path.join(test_dir, 'infile.txt')
+            with open(in_file, 'w') as in_data:
+                in_data.write('input\n')
+            self.a_pattern_ds.get_files.return_value[0].full_path = in_file
+
+            options = {'result_cache': os.path.join(test_dir, 'cache'),
+                       'execution_manager': 'StreamingExecManager'}
+            with mock.patch('cwsl.core.process_unit.utils.MetadataBuilder') as mock_metadata, \
+                    mock.patch('cwsl.core.scheduler.StreamingExecManager.add_annotation',
+                               new=fake_annotation):
+                for user in ['user_1', 'user_2']:
+                    mock_metadata.return_value.build.return_value = user
+                    out_pattern = os.path.join(test_dir, user, '%file%', '%pattern%.txt')
+                    the_process_unit = ProcessUnit([self.a_pattern_ds], out_pattern, 'cp',
+                                                   execution_options=options)
+                    the_process_unit.execute()
+
+            for user in ['user_1', 'user_2']:
+                with open(os.path.join(test_dir, user, 'file_1', 'pattern_1.txt')) as out_data:
+                    self.assertEqual(out_data.read(), 'input\n' + user + '\n')
+
+            cache = configured_cache(options)
+            stats = cache.stats()
+            cache.close()
+            self.assertEqual((stats['hits'], stats['stores']), (1, 1))
+            self.assertEqual(os.listdir(os.path.join(test_dir, 'cache', 'staging')), [])
+        finally:
+            os.environ['PATH'] = old_path
+            shutil.rmtree(test_dir)
+
+    def test_result_cache_failed_submit(self):
+        """ Test that the cache is closed if submitting the commands fails. """
+
+        test_dir = tempfile.mkdtemp()
+        try:
+            in_file = os.path.join(test_dir, 'infile.txt')
+            with open(in_file, 'w') as in_data:
+                in_data.write('input')
+            self.a_pattern_ds.get_files.return_value[0].full_path = in_file
+
+            options = {'result_cache': os.path.join(test_dir, 'cache')}
+            out_pattern = os.path.join(test_dir, 'out', '%file%', '%pattern%.txt')
+            the_process_unit = ProcessUnit([self.a_pattern_ds], out_pattern, 'cp',
+                                           execution_options=options)
+
+            with mock.patch('cwsl.core.scheduler.SimpleExecManager.submit',
+                            side_effect=OSError), \
+                    mock.patch('cwsl.core.result_cache.ResultCache.close') as mock_close:
+                self.assertRaises(OSError, the_process_unit.execute)
+                mock_close.assert_called_once_with()
+
+            self.assertEqual(os.listdir(os.path.join(test_dir, 'cache', 'staging')), [])
+        finally:
+            shutil.rmtree(test_dir)
+
+    def test_result_cache_missing_input(self):
+        """ Test that commands whose inputs don't exist yet are run, not cached. """
+
+        test_dir = tempfile.mkdtemp()
+        try:
+            self.a_pattern_ds.get_files.return_value[0].full_path = os.path.join(test_dir, 'missing.txt')
+            options = {'result_cache': os.path.join(test_dir, 'cache'),
+                       'execution_manager': 'StreamingExecManager'}
+            out_pattern = os.path.join(test_dir, 'out', '%file%', '%pattern%.txt')
+            the_process_unit = ProcessUnit([self.a_pattern_ds], out_pattern, 'echo',
+                                           execution_options=options)
+            the_process_unit.execute(simulate=False)
+
+            self.assertEqual(the_process_unit.scheduler.submitted, 1)
+            cache = configured_cache(options)
+            self.assertEqual(cache.stats()['results'], 0)
+            cache.close()
+        finally:
+            shutil.rmtree(test_dir)
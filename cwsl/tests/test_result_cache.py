@@ -0,0 +1,167 @@
+"""
+Authors: Tim Bedin, Tim Erwin
+
+Copyright 2014 CSIRO
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Tests for the ResultCache.
+
+"""
+
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+import subprocess
+
+from cwsl.core.result_cache import ResultCache, cache_key, file_fingerprint
+
+
+module_logger = logging.getLogger('cwsl.tests.test_result_cache')
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache = ResultCache(os.path.join(self.tempdir, 'cache'), max_bytes=100)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tempdir)
+
+    def write_file(self, name, contents):
+        path = os.path.join(self.tempdir, name)
+        with open(path, 'w') as out_file:
+            out_file.write(contents)
+        return path
+
+    def test_key(self):
+        """ Test that keys depend on input contents, not input or output paths. """
+
+        in_1 = self.write_file('in_1.nc', 'some data')
+        in_2 = self.write_file('in_2.nc', 'some data')
+        in_3 = self.write_file('in_3.nc', 'other data')
+        fingerprints = dict((path, file_fingerprint(path)) for path in [in_1, in_2, in_3])
+
+        key_1 = cache_key(['agg.sh', 'mean', in_1, '/user_1/out.nc'],
+                          [in_1], ['/user_1/out.nc'], fingerprints)
+        key_2 = cache_key(['agg.sh', 'mean', in_2, '/user_2/other.nc'],
+                          [in_2], ['/user_2/other.nc'], fingerprints)
+        self.assertEqual(key_1, key_2)
+
+        # Different arguments, inputs or output types are different results.
+        self.assertNotEqual(key_1, cache_key(['agg.sh', 'max', in_1, '/user_1/out.nc'],
+                                             [in_1], ['/user_1/out.nc'], fingerprints))
+        self.assertNotEqual(key_1, cache_key(['agg.sh', 'mean', in_3, '/user_1/out.nc'],
+                                             [in_3], ['/user_1/out.nc'], fingerprints))
+        self.assertNotEqual(key_1, cache_key(['agg.sh', 'mean', in_1, '/user_1/out.txt'],
+                                             [in_1], ['/user_1/out.txt'], fingerprints))
+
+    def test_missing_input(self):
+        """ Test that commands with inputs that don't exist yet are not cached. """
+
+        missing = os.path.join(self.tempdir, 'not_yet.nc')
+        fingerprints = {missing: self.cache.fingerprint(missing)}
+        self.assertEqual(fingerprints[missing], None)
+        self.assertEqual(cache_key(['agg.sh', missing, '/out.nc'], [missing], ['/out.nc'],
+                                   fingerprints), None)
+
+    def test_fingerprint(self):
+        """ Test that fingerprints are only recalculated when a file changes. """
+
+        in_file = self.write_file('in.nc', 'some data')
+        os.utime(in_file, (1000, 1000))
+        first = self.cache.fingerprint(in_file)
+        self.assertEqual(first, file_fingerprint(in_file))
+
+        # Same size and time - the stored fingerprint is used.
+        self.write_file('in.nc', 'more data')
+        os.utime(in_file, (1000, 1000))
+        self.assertEqual(self.cache.fingerprint(in_file), first)
+
+        os.utime(in_file, (2000, 2000))
+        self.assertEqual(self.cache.fingerprint(in_file), file_fingerprint(in_file))
+        self.assertNotEqual(self.cache.fingerprint(in_file), first)
+
+    def test_store_and_fetch(self):
+        """ Test that stored outputs can be fetched to a new place. """
+
+        out_file = self.write_file('out.nc', 'result')
+        new_file = os.path.join(self.tempdir, 'other_user', 'new.nc')
+
+        self.assertFalse(self.cache.fetch('abcdef', [new_file]))
+        self.cache.store('abcdef', [out_file])
+
+        # Changing the output does not change the cache.
+        self.write_file('out.nc', 'changed')
+        self.assertTrue(self.cache.fetch('abcdef', [new_file]))
+        with open(new_file) as fetched:
+            self.assertEqual(fetched.read(), 'result')
+
+        # Changing a fetched output does not change the cache.
+        with open(new_file, 'a') as fetched:
+            fetched.write(' appended')
+        other_file = os.path.join(self.tempdir, 'other_user', 'other.nc')
+        self.assertTrue(self.cache.fetch('abcdef', [other_file]))
+        with open(other_file) as fetched:
+            self.assertEqual(fetched.read(), 'result')
+
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['stores']), (2, 1, 1))
+        self.assertEqual(stats['results'], 1)
+        self.assertEqual(stats['bytes'], len('result'))
+        self.assertIn('2 hits', self.cache.report())
+
+    def test_stage(self):
+        """ Test that staged outputs are stored as they were when staged. """
+
+        out_file = self.write_file('out.nc', 'result')
+        staged_dir, copy_cmd = self.cache.stage([out_file])
+        subprocess.check_call(' '.join(copy_cmd), shell=True)
+
+        # e.g. the output is annotated after it is staged.
+        self.write_file('out.nc', 'result annotated')
+        self.cache.store('abcdef', [out_file], staged_dir)
+        self.assertFalse(os.path.exists(staged_dir))
+
+        fetched = os.path.join(self.tempdir, 'fetched.nc')
+        self.assertTrue(self.cache.fetch('abcdef', [fetched]))
+        with open(fetched) as fetched_file:
+            self.assertEqual(fetched_file.read(), 'result')
+        self.assertEqual(self.cache.stats()['bytes'], len('result'))
+
+        # Outputs that were never staged are not stored.
+        staged_dir, copy_cmd = self.cache.stage([out_file])
+        self.cache.store('123456', [out_file], staged_dir)
+        self.assertFalse(self.cache.fetch('123456', [fetched]))
+        self.assertFalse(os.path.exists(staged_dir))
+
+    def test_eviction(self):
+        """ Test that the least recently used results are evicted. """
+
+        fetched = os.path.join(self.tempdir, 'fetched')
+        self.cache.store('aaaa', [self.write_file('a', 'x' * 40)])
+        self.cache.store('bbbb', [self.write_file('b', 'x' * 40)])
+
+        # Use the first result again, so the second is the oldest.
+        self.assertTrue(self.cache.fetch('aaaa', [fetched]))
+
+        # The cache is now over 100 bytes.
+        self.cache.store('cccc', [self.write_file('c', 'x' * 40)])
+
+        self.assertFalse(self.cache.fetch('bbbb', [fetched]))
+        self.assertTrue(self.cache.fetch('aaaa', [fetched]))
+        self.assertTrue(self.cache.fetch('cccc', [fetched]))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+        self.assertFalse(os.path.exists(self.cache.result_dir('bbbb')))
@@ -17,9 +17,15 @@ Tests for the scheduler classes.
 
 """
 
+import os
+import shutil
+import tempfile
 import unittest
+import subprocess
 
-from cwsl.core.scheduler import SimpleExecManager
+from cwsl.core.scheduler import (SimpleExecManager, StreamingExecManager,
+                                 ParallelExecManager, PBSExecManager,
+                                 get_exec_manager, UnknownExecManagerError)
 
 
 class TestScheduler(unittest.TestCase):
@@ -53,3 +59,216 @@ class TestScheduler(unittest.TestCase):
 
         expected_string = """#!/bin/sh\nset -e\n\nmodule purge\nmodule load nco\nmkdir -p \necho infile_1.nc outfile_1.nc\nncatted -O -a vistrails_history,global,a,c,"This is an annotation" outfile_1.nc\n"""
         self.assertEqual(this_manager.job.to_str(), expected_string)
+
+
+class TestStreamingExecManager(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+        # A stand-in for the environment modules command.
+        bin_dir = os.path.join(self.test_dir, 'bin')
+        os.mkdir(bin_dir)
+        module_path = os.path.join(bin_dir, 'module')
+        with open(module_path, 'w') as module_file:
+            module_file.write('#!/bin/sh\nexit 0\n')
+        os.chmod(module_path, 0755)
+
+        self.old_path = os.environ['PATH']
+        os.environ['PATH'] = bin_dir + os.pathsep + self.old_path
+
+    def tearDown(self):
+        os.environ['PATH'] = self.old_path
+        shutil.rmtree(self.test_dir)
+
+    def test_streaming(self):
+        """ Test that each command is run, creating its output directory. """
+
+        this_manager = StreamingExecManager(queue_size=1)
+        out_files = [os.path.join(self.test_dir, 'out_' + str(i), 'outfile.txt')
+                     for i in range(5)]
+        for out_file in out_files:
+            this_manager.add_cmd(['touch', out_file], [out_file])
+        this_manager.submit()
+
+        self.assertEqual(this_manager.submitted, 5)
+        self.assertEqual(this_manager.completed, 5)
+        for out_file in out_files:
+            self.assertTrue(os.path.exists(out_file))
+
+        # Nothing is held back in one big script.
+        self.assertEqual(this_manager.job.cmds, [])
+
+    def test_failure(self):
+        """ Test that a failed command does not stop the others. """
+
+        this_manager = StreamingExecManager()
+        bad_file = os.path.join(self.test_dir, 'bad.txt')
+        good_file = os.path.join(self.test_dir, 'good.txt')
+        this_manager.add_cmd(['echo', 'broken', '&&', 'false'], [bad_file])
+        this_manager.add_cmd(['touch', good_file], [good_file])
+        this_manager.submit()
+
+        self.assertEqual(this_manager.completed, 1)
+        self.assertTrue(os.path.exists(good_file))
+        self.assertEqual(this_manager.failed_files, set([bad_file]))
+
+        failed_task = this_manager.failed_tasks[0]
+        self.assertEqual(failed_task.returncode, 1)
+        self.assertIn('broken', failed_task.output)
+
+    def test_stop_on_error(self):
+        """ Test that a failed command can stop the run. """
+
+        this_manager = StreamingExecManager(stop_on_error=True)
+        out_file = os.path.join(self.test_dir, 'outfile.txt')
+        this_manager.add_cmd(['false'], [out_file])
+
+        self.assertRaises(subprocess.CalledProcessError, this_manager.submit)
+        self.assertEqual(this_manager.completed, 0)
+
+    def test_cancel(self):
+        """ Test that cancelling stops the workers without running the queued commands. """
+
+        this_manager = StreamingExecManager()
+        first_file = os.path.join(self.test_dir, 'first.txt')
+        second_file = os.path.join(self.test_dir, 'second.txt')
+        this_manager.add_cmd(['sleep', '1', '&&', 'touch', first_file], [first_file])
+        this_manager.add_cmd(['touch', second_file], [second_file])
+        this_manager.cancel()
+
+        self.assertFalse(any(worker.is_alive() for worker in this_manager.workers))
+        self.assertFalse(os.path.exists(second_file))
+
+    def test_retries(self):
+        """ Test that a failed command is retried. """
+
+        # The command fails the first time it is run.
+        marker = os.path.join(self.test_dir, 'marker')
+        out_file = os.path.join(self.test_dir, 'outfile.txt')
+        command = ['test', '-e', marker, '||', '{', 'touch', marker, ';', 'false', ';', '}',
+                   '&&', 'touch', out_file]
+
+        this_manager = StreamingExecManager(retries=2, retry_delay=0)
+        this_manager.add_cmd(command, [out_file])
+        this_manager.submit()
+
+        self.assertEqual(this_manager.completed, 1)
+        self.assertEqual(this_manager.failed_tasks, [])
+        self.assertTrue(os.path.exists(out_file))
+
+    def test_parallel(self):
+        """ Test that commands run in parallel, sharing output directories. """
+
+        this_manager = ParallelExecManager(workers=4)
+        this_manager.add_module_deps(['cdo'])
+        out_dir = os.path.join(self.test_dir, 'shared', 'outputs')
+        out_files = [os.path.join(out_dir, 'outfile_' + str(i) + '.txt')
+                     for i in range(20)]
+        for out_file in out_files:
+            this_manager.add_cmd(['touch', out_file], [out_file])
+        this_manager.submit()
+
+        self.assertEqual(len(this_manager.workers), 4)
+        self.assertEqual(this_manager.completed, 20)
+        for out_file in out_files:
+            self.assertTrue(os.path.exists(out_file))
+
+    def test_get_exec_manager(self):
+        """ Test that exec managers can be chosen by name. """
+
+        this_manager = get_exec_manager('StreamingExecManager', noexec=True,
+                                        options={'queue_size': 3})
+        self.assertEqual(this_manager.tasks.maxsize, 3)
+        this_manager.submit()
+
+        this_manager = get_exec_manager('ParallelExecManager', noexec=True,
+                                        options={'workers': 2})
+        self.assertEqual(len(this_manager.workers), 2)
+        this_manager.submit()
+
+        self.assertTrue(isinstance(get_exec_manager('SimpleExecManager'),
+                                   SimpleExecManager))
+        self.assertRaises(UnknownExecManagerError,
+                          get_exec_manager, 'NoSuchExecManager')
+
+
+class TestPBSExecManager(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.qsub_log = os.path.join(self.test_dir, 'qsub.log')
+
+        # Stand-ins for qsub and qstat. qsub logs its arguments and
+        # returns a job id, qstat reports every job as queued.
+        self.qsub = os.path.join(self.test_dir, 'qsub')
+        with open(self.qsub, 'w') as qsub_file:
+            qsub_file.write('#!/bin/sh\necho "$@" >> %s\necho 1234.fake\n'
+                            % self.qsub_log)
+        os.chmod(self.qsub, 0755)
+
+        self.qstat = os.path.join(self.test_dir, 'qstat')
+        with open(self.qstat, 'w') as qstat_file:
+            qstat_file.write('#!/bin/sh\necho "Job Id: $2"\necho "    job_state = Q"\n')
+        os.chmod(self.qstat, 0755)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def make_manager(self, **kwargs):
+        return PBSExecManager(job_dir=os.path.join(self.test_dir, 'jobs'),
+                              qsub=self.qsub, qstat=self.qstat, **kwargs)
+
+    def test_job_array(self):
+        """ Test that commands are packed into the tasks of a job array. """
+
+        this_manager = self.make_manager(command_runtime=60, walltime=120,
+                                         resources={'queue': 'normal'})
+        for i in range(5):
+            out_file = '/output/dir_%d/outfile.txt' % i
+            this_manager.add_cmd(['echo', 'infile', out_file], [out_file])
+        this_manager.submit()
+
+        self.assertEqual(this_manager.job_id, '1234.fake')
+        self.assertEqual(this_manager.status(), 'Q')
+
+        with open(self.qsub_log) as log_file:
+            script_name = log_file.read().split()[-1]
+        with open(script_name) as script_file:
+            script = script_file.read()
+        self.assertIn('#PBS -q normal', script)
+        self.assertIn('#PBS -l walltime=00:02:00', script)
+        self.assertIn('#PBS -J 0-2', script)
+
+        # Two commands in each task.
+        task_dir = os.path.dirname(script_name)
+        tasks = sorted(name for name in os.listdir(task_dir)
+                       if name.startswith('task_'))
+        self.assertEqual(tasks, ['task_0.sh', 'task_1.sh', 'task_2.sh'])
+        with open(os.path.join(task_dir, 'task_0.sh')) as task_file:
+            task_script = task_file.read()
+        self.assertIn('module purge\nmkdir -p /output/dir_0 /output/dir_1\n', task_script)
+        self.assertIn('echo infile /output/dir_1/outfile.txt', task_script)
+
+    def test_max_array_size(self):
+        """ Test that big runs are packed into at most max_array_size tasks. """
+
+        this_manager = self.make_manager(command_runtime=60, walltime=60,
+                                         max_array_size=4)
+        for i in range(10):
+            this_manager.add_cmd(['echo', str(i)], [])
+
+        self.assertEqual(this_manager.chunk_size(), 3)
+        self.assertEqual(len(this_manager.task_jobs()), 4)
+
+    def test_dependencies(self):
+        """ Test that a job waits for the jobs it depends on. """
+
+        this_manager = self.make_manager()
+        this_manager.add_job_deps(['1111.fake', '2222.fake'])
+        this_manager.add_cmd(['echo', 'infile', 'outfile'], ['outfile'])
+        this_manager.submit()
+
+        with open(self.qsub_log) as log_file:
+            qsub_args = log_file.read().split()
+        self.assertEqual(qsub_args[:2], ['-W', 'depend=afterok:1111.fake:2222.fake'])
@@ -17,10 +17,13 @@ This module contains tests for the utils module.
 
 """
 
+import os
 import logging
 import unittest
 import tempfile
 
+import mock
+
 from cwsl.utils import utils
 
 
@@ -67,3 +70,31 @@ class TestUtils(unittest.TestCase):
         status_return = utils.get_git_status(self.tempfile.name)
         self.assertEqual(status_return,
                          "Could not determine file version.")
+
+        # The working directory is not changed.
+        cwd = os.getcwd()
+        utils.get_git_status(infile)
+        self.assertEqual(os.getcwd(), cwd)
+
+    def test_metadata_builder(self):
+        """ Test that git is only asked once per script in a run. """
+
+        with mock.patch('cwsl.utils.utils.get_vistrails_info') as mock_vt_info:
+            mock_vt_info.return_value = ('/vistrails/test.vt', 12)
+            with mock.patch('cwsl.utils.utils.get_git_status') as mock_git:
+                mock_git.return_value = 'Git info: abc123'
+
+                builder = utils.MetadataBuilder()
+                first = builder.build(['script.sh', 'infile_1.nc', 'outfile_1.nc'])
+                second = builder.build(['script.sh', 'infile_2.nc', 'outfile_2.nc'])
+                builder.build(['other.sh', 'infile_1.nc', 'outfile_1.nc'])
+
+                # The VisTrail file, script.sh and other.sh.
+                self.assertEqual(mock_git.call_count, 3)
+                self.assertEqual(mock_vt_info.call_count, 1)
+
+        self.assertEqual(first.splitlines()[:3], second.splitlines()[:3])
+        self.assertIn('VISTRAIL FILE: /vistrails/test.vt NODE NUMBER: 12 VERSION: Git info: abc123',
+                      first)
+        self.assertIn('SCRIPT: script.sh VERSION: Git info: abc123', first)
+        self.assertTrue(first.endswith('CMD: script.sh infile_1.nc outfile_1.nc\n'))
@@ -44,12 +44,14 @@ def get_git_status(ifile):
         git_version = "Could not determine file version."
         return git_version
 
-    cwd = os.getcwd()
-    (basepath, filename) = os.path.split(ifile)
-    os.chdir(basepath)
+    # Run git in the directory of the file, rather than changing
+    # the working directory of the whole process.
+    (basepath, filename) = os.path.split(os.path.abspath(ifile))
     try:
-        status = subprocess.check_output(['git','status',filename])
-        version = subprocess.check_output(['git','log',filename])
+        status = subprocess.check_output(['git', 'status', filename],
+                                         cwd=basepath, stderr=subprocess.STDOUT)
+        version = subprocess.check_output(['git', 'log', '-n', '1', filename],
+                                          cwd=basepath, stderr=subprocess.STDOUT)
 
         if not version:
             log.error("%s not in git repository" % ifile)
@@ -66,8 +68,6 @@ def get_git_status(ifile):
         log.error("Status called process failed.")
         git_version = "Could not determine file version."
 
-    os.chdir(cwd)
-
     return git_version
 
 
@@ -93,6 +93,77 @@ def get_vistrails_info():
     return(filename, current_version)
 
 
+class MetadataBuilder(object):
+    """
+    Builds the version metadata for the commands of a single run.
+
+    The user, the time, the VisTrail information and the git status of
+    each script and VisTrail file are looked up once, when they are
+    first needed, so only the command line changes from one command
+    to the next.
+
+    Raises NameError if the VisTrails api is not available.
+
+    """
+
+    def __init__(self):
+
+        rightnow = datetime.now()
+        self.time_string = rightnow.isoformat()
+        self.short_time = str(rightnow.year) + str(rightnow.month) + str(rightnow.day) + ':'
+
+        # Git status of each file, by path.
+        self.git_status = {}
+
+        vt_info = get_vistrails_info()
+
+        if vt_info[0]:
+            log.debug("vt_info is: {}".format(vt_info))
+            # Get the git information about the vistrails file.
+            vt_git = self.get_git_status(vt_info[0])
+        else:
+            log.warning("No VisTrail internal information found!")
+            vt_git = "No VisTrail infomation found."
+
+        vt_info_list = [self.short_time, 'VISTRAIL FILE:', str(vt_info[0]),
+                        'NODE NUMBER:', str(vt_info[1]), 'VERSION:', vt_git]
+
+        self.header = (' '.join([self.short_time, 'USER:', USER, 'NCI PROJECT:', PROJECT,
+                                 'DATE/TIME:', self.time_string]) + '\n' +
+                       ' '.join(vt_info_list) + '\n')
+
+        # The script line of the metadata, by script.
+        self.script_lines = {}
+
+    def get_git_status(self, ifile):
+        """ Return the git status of a file, only asking git once per file. """
+
+        try:
+            return self.git_status[ifile]
+        except KeyError:
+            git_status = get_git_status(ifile)
+            self.git_status[ifile] = git_status
+            return git_status
+
+    def build(self, command_line_list):
+        """
+        Takes in a full command line list, e.g. ['echo', 'infile.txt', 'outfile.txt']
+        and returns the metadata string for it.
+        """
+
+        script_name = command_line_list[0]
+        try:
+            real_script_name, script_line = self.script_lines[script_name]
+        except KeyError:
+            real_script_name = os.path.expandvars(script_name)
+            script_line = ' '.join([self.short_time, 'SCRIPT:', real_script_name, 'VERSION:',
+                                    self.get_git_status(script_name)]) + '\n'
+            self.script_lines[script_name] = (real_script_name, script_line)
+
+        return (self.header + script_line +
+                ' '.join([self.short_time, 'CMD:'] + [real_script_name] + command_line_list[1:]) + '\n')
+
+
 def build_metadata(command_line_list):
     """
     Takes in a full command line list, e.g. ['echo', 'infile.txt', 'outfile.txt']
@@ -104,31 +175,8 @@ def build_metadata(command_line_list):
         Script to be run, git version info
         Full command line of the task.
 
-    """
+    To build the metadata for many commands, use a MetadataBuilder.
 
-    rightnow = datetime.now()
-    time_string = rightnow.isoformat()
-    short_time = str(rightnow.year) + str(rightnow.month) + str(rightnow.day) + ':'
-
-    vt_info = get_vistrails_info()
-
-    if vt_info[0]:
-        log.debug("vt_info is: {}".format(vt_info))
-        # Get the git information about the script and the vistrails file.
-        vt_git = get_git_status(vt_info[0])
-    else:
-        log.warning("No VisTrail internal information found!")
-        vt_git = "No VisTrail infomation found."
-
-    script_git = get_git_status(command_line_list[0])
-
-    vt_info_list = [short_time, 'VISTRAIL FILE:', str(vt_info[0]), 'NODE NUMBER:', str(vt_info[1]), 'VERSION:', vt_git]
-
-    real_script_name = os.path.expandvars(command_line_list[0])
-    full_ver_string = (' '.join([short_time, 'USER:', USER, 'NCI PROJECT:', PROJECT, 'DATE/TIME:', time_string]) + '\n' +
-                       ' '.join(vt_info_list) + '\n' +
-                       ' '.join([short_time, 'SCRIPT:', real_script_name, 'VERSION:', script_git]) + '\n' +
-                       ' '.join([short_time, 'CMD:'] + [real_script_name] + command_line_list[1:]) + '\n')
-
-    return full_ver_string
+    """
 
+    return MetadataBuilder().build(command_line_list)
@@ -24,6 +24,7 @@ from vistrails.core.modules.vistrails_module import Module, ModuleError, NotCach
 from cwsl.configuration import configuration
 from cwsl.core.pattern_dataset import PatternDataSet
 from cwsl.core.constraint import Constraint
+from cwsl.core.file_catalogue import configured_catalogue
 
 import os
 import logging
@@ -40,6 +41,9 @@ class DataReferenceSyntax(NotCacheable, Module):
 
     _output_ports = [('out_dataset', '(csiro.au.cwsl:VtDataSet)')]
 
+    # The configuration option that holds a manifest of the files, if any.
+    manifest_option = None
+
     def __init__(self, pattern, constraints=None):
         Module.__init__(self)
         self.pattern = pattern
@@ -62,6 +66,15 @@ class DataReferenceSyntax(NotCacheable, Module):
         patterns = os.path.join(basepath,self.pattern)
         return patterns
 
+    def get_manifest(self):
+        """
+        Return the manifest of files set in the configuration,
+        or None to scan the file system.
+        """
+        if self.manifest_option and configuration.check(self.manifest_option):
+            return getattr(configuration, self.manifest_option)
+        return None
+
     def compute(self):
 
         # Determine file path
@@ -80,7 +93,11 @@ class DataReferenceSyntax(NotCacheable, Module):
             raise ModuleError(self, "No constraints set on DataSet - you can not run a workflow on the entire DataSet")
 
         # Create dataset based on file search path and contraints
-        dataset = PatternDataSet(patterns, constraints)
+        manifest = self.get_manifest()
+        if manifest:
+            logger.debug('Using manifest %s' % manifest)
+        dataset = PatternDataSet(patterns, constraints, catalogue=configured_catalogue(),
+                                 manifest=manifest)
 
         if not dataset.files:
             error_string = "No files found for this dataset with constraints: {}".format(constraints)
@@ -146,6 +163,8 @@ class CMIP5(GlobalClimateModel):
                    'product': 'GCM',
                   }
 
+    manifest_option = 'cmip5_manifest'
+
 class CMIP3(GlobalClimateModel):
     """
     File path search for CMIP3 based on CMIP5 DRS structure (http://cmip-pcmdi.llnl.gov/cmip5/docs/cmip5_data_reference_syntax.pdf)
@@ -160,6 +179,8 @@ class CMIP3(GlobalClimateModel):
                    'product': 'GCM',
                   }
 
+    manifest_option = 'cmip3_manifest'
+
 class RegionalClimateModel_SDMa_NRM(RegionalClimateModel):
     """
     Creates a DataSet based on the CORDEX DRS.
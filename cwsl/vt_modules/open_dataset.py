@@ -20,6 +20,7 @@ VT Module to build a DataSet from a pattern on the file system.
 """
 
 from cwsl.core.pattern_dataset import PatternDataSet
+from cwsl.core.file_catalogue import configured_catalogue
 
 from vistrails.core.modules import vistrails_module
 from vistrails.core.modules.basic_modules import String
@@ -48,6 +49,9 @@ class OpenDataSet(vistrails_module.Module):
 
         extra_constraints = set()
 
-        output_ds = PatternDataSet(file_pattern, extra_constraints)
+        # The scan is deferred until a downstream module needs the files.
+        output_ds = PatternDataSet(file_pattern, extra_constraints,
+                                   catalogue=configured_catalogue(),
+                                   lazy=True)
 
         self.setResult('out_dataset', output_ds)